@@ -5,15 +5,43 @@ from matplotlib import pyplot as plt
 plt.rcParams.update({"text.color": "white"})
 import numpy as np
 from datetime import datetime
-from fpdf import FPDF
 import os
 import glob
 from antenna_controller import AntennaController
-from aoa_controller import AoAController, parse_uudf
+from aoa_controller import AoAController, parse_event
+from latency import LATENCY
 import shutil
 import tkinter as tk
 from live_plot import LivePlot
 from webcam_window import WebcamWindow
+from report_writer import RasterReport, VectorReport
+from sample_table import SampleTable, group_indices, group_starts
+from bootstrap import bootstrap, confidence_interval
+from aoa_estimator import ESTIMATOR_METHODS, StreamingEstimator, load_estimator
+from iq_features import iq_features
+from angular_error import great_circle_errors
+from sample_filters import FilterChain
+from tag_registry import REGISTRY, REGISTRY_FILE, load_registry
+from calibration import (
+    CALIBRATION_FILE,
+    Calibration,
+    load_calibration,
+    save_calibration,
+)
+from rssi_errors import (
+    MIN_BIN_SAMPLES,
+    SPEC_ERROR,
+    SPEC_PERCENTILE,
+    binned_errors,
+    model_errors,
+    rssi_errors,
+)
+
+# Metrics with bootstrap confidence intervals in the report: mean absolute
+# error, 90th percentile error and the fraction of errors within 10 degrees.
+CI_METRICS = ["mean", "p90", "within_10"]
+# Tags per page of the per tag error maps over azimuth and tilt
+GRID_TAGS_PER_PAGE = 6
 
 
 class AoATester:
@@ -23,12 +51,14 @@ class AoATester:
         locate_baudrate,
         locate_ctsrts,
         antenna_upside_down=False,
-        mock=False,
+        source=None,
         analyzer_only=False,
+        image_export_dir=None,
+        vector_report=False,
     ):
         if not analyzer_only:
             self.locate_controller = AoAController(
-                locate_port, locate_baudrate, locate_ctsrts, mock
+                locate_port, locate_baudrate, locate_ctsrts, source
             )
         else:
             self.locate_controller = None
@@ -40,12 +70,41 @@ class AoATester:
         self.azimuth_angle = 0
         self.tilt_angle = 0
         self.collecting_data = False
-        self.mock = mock
 
         self.figsize = (12, 10)
+        self.bootstrap_resamples = 1000
 
         self.collected_data = {}
-        self.created_images = []
+        # StreamingEstimator re-estimating the angles of collected samples
+        # from their IQs, None to keep the angles of the module
+        self.estimator = None
+        # FilterChain smoothing the angles of every tag and rejecting outliers
+        # before they are stored, None to keep the raw angles
+        self.filters = None
+        # Calibration the angles of the sample table were corrected with
+        self.calibration = None
+        # ArrayGeometry the IQ features are computed for, None for the default
+        self.array_geometry = None
+        # Columnar copy of collected_data and the statistics computed from it,
+        # created on demand and reset whenever new data is collected.
+        self.sample_table = None
+        self.statistics = None
+        # Figures are kept in memory until the report is written,
+        # only exported to disk if image_export_dir is given.
+        if vector_report:
+            self.report = VectorReport(image_export_dir)
+        else:
+            self.report = RasterReport(image_export_dir)
+
+    def set_estimator(self, estimator):
+        self.estimator = estimator
+
+    def set_filters(self, filters):
+        self.filters = filters
+
+    def set_array_geometry(self, geometry):
+        self.array_geometry = geometry
+        self.set_cached_results(self.sample_table, None)
 
     def start(self):
         if not self.analyzer_only:
@@ -58,9 +117,13 @@ class AoATester:
     def collect_angles(self, timeout_ms, do_plot, gt_azimuth, gt_elevation):
         if self.analyzer_only:
             raise Exception("Analyzer in analyzer_only mode, function not supported.")
-        if not self.mock:
-            self.locate_controller.flush_input_buffer()  # Make sure no old angles are in the serial buffer
-            self.locate_controller.enable_aoa()
+        self.locate_controller.flush_input_buffer()  # Make sure no old angles are in the serial buffer
+        self.locate_controller.enable_aoa()
+        # Simulated sources make up angles around where the antenna points
+        self.locate_controller.set_ground_truth(
+            -gt_azimuth if self.antenna_upside_down else gt_azimuth,
+            -gt_elevation if self.antenna_upside_down else gt_elevation,
+        )
         graph = None
         if do_plot:
             if self.antenna_upside_down:
@@ -68,6 +131,10 @@ class AoATester:
                 gt_elevation = -gt_elevation
             graph = LivePlot(self.figsize, gt_azimuth, gt_elevation)
 
+        if self.filters is not None:
+            # The tags are somewhere else relative to the antenna now
+            self.filters.reset()
+
         startTime = self.current_milli_time()
         raw_result = []
         parsed_result = {}
@@ -79,38 +146,63 @@ class AoATester:
             data = self.locate_controller.wait_for_aoa_event()
             if data[1] != None:
                 urc = data[0]
-                urc_dict = data[1]
                 # If we successfully parsed event then save it
                 raw_result.append(urc)
-                tag_id = urc_dict["instanceId"]
-                if tag_id in parsed_result:
-                    parsed_result[tag_id].append(urc_dict)
-                else:
-                    parsed_result[tag_id] = []
-                    parsed_result[tag_id].append(urc_dict)
-                if do_plot:
-                    graph.add_tag_sample(
-                        tag_id,
-                        urc_dict["azimuth"]
-                        if not self.antenna_upside_down
-                        else -urc_dict["azimuth"],
-                        urc_dict["elevation"]
-                        if not self.antenna_upside_down
-                        else -urc_dict["elevation"],
-                        gt_azimuth,
-                        gt_elevation,
-                    )
+                urc_dicts = [data[1]]
+                if self.estimator is not None:
+                    urc_dicts = self.estimator.add(data[1])
+                self.__store_samples(
+                    urc_dicts, parsed_result, graph, gt_azimuth, gt_elevation
+                )
+        if self.estimator is not None:
+            self.__store_samples(
+                self.estimator.flush(), parsed_result, graph, gt_azimuth, gt_elevation
+            )
         if do_plot:
-            img = graph.save_snapshot_png("{}_{}".format(gt_azimuth, gt_elevation))
-            self.created_images.append(img)
+            self.report.add_figure(
+                "{}_{}.png".format(gt_azimuth, gt_elevation), graph.fig
+            )
             graph.destroy()
         # Save the result in a map with a tuple of azimuth and tilt as key
         self.collected_data[(gt_azimuth, gt_elevation)] = (
             raw_result,
             parsed_result,
         )
+        self.set_cached_results(None, None)
         return (raw_result, parsed_result)
 
+    def __store_samples(
+        self, urc_dicts, parsed_result, graph, gt_azimuth, gt_elevation
+    ):
+        for urc_dict in urc_dicts:
+            if self.filters is not None:
+                self.filters.apply(urc_dict)
+            tag_id = urc_dict["instanceId"]
+            if tag_id in parsed_result:
+                parsed_result[tag_id].append(urc_dict)
+            else:
+                parsed_result[tag_id] = []
+                parsed_result[tag_id].append(urc_dict)
+            if LATENCY.enabled:
+                LATENCY.mark("store")
+                LATENCY.record("store", "parse", "store")
+            if graph is not None and not urc_dict.get("rejected", False):
+                graph.add_tag_sample(
+                    tag_id,
+                    urc_dict["azimuth"]
+                    if not self.antenna_upside_down
+                    else -urc_dict["azimuth"],
+                    urc_dict["elevation"]
+                    if not self.antenna_upside_down
+                    else -urc_dict["elevation"],
+                    gt_azimuth,
+                    gt_elevation,
+                )
+                if LATENCY.enabled:
+                    LATENCY.record("plot", "store")
+            if LATENCY.enabled:
+                LATENCY.record("total", "read")
+
     def analyze_logs(
         self,
         log_file,
@@ -130,7 +222,7 @@ class AoATester:
         tag_angles = {}
 
         for urc in log_file:
-            urc_dict = parse_uudf(urc)
+            urc_dict = parse_event(urc)
             if urc_dict == None:
                 continue
             if remove_90 and (
@@ -173,14 +265,16 @@ class AoATester:
                     gt_elevation,
                 )
 
-            img = graph.save_snapshot_png("{}_{}".format(gt_azimuth, gt_elevation))
-            self.created_images.append(img)
+            self.report.add_figure(
+                "{}_{}.png".format(gt_azimuth, gt_elevation), graph.fig
+            )
             graph.destroy()
         # Save the result in a map with a tuple of azimuth and tilt as key
         self.collected_data[(gt_azimuth, gt_elevation)] = (
             raw_result,
             parsed_result,
         )
+        self.set_cached_results(None, None)
         return (raw_result, parsed_result)
 
     def current_milli_time(self):
@@ -194,7 +288,8 @@ class AoATester:
 
     def clear_collected_data(self):
         self.collected_data = {}
-        self.created_images = []
+        self.set_cached_results(None, None)
+        self.report.clear()
 
     def plot_rssi_per_tag(self, all_rssi):
         # Plot dist for all rssi per tag
@@ -213,17 +308,131 @@ class AoATester:
         )
         for tag_id in all_rssi:
             plt.subplot(6, 1, plot_num)
-            self.__create_and_style_cdf(
-                all_rssi[tag_id], "RSSI {}".format(tag_id), distribution_plot=True
-            )
+            title = "RSSI {}".format(REGISTRY.tags.label(tag_id))
+            tx_power = REGISTRY.tags.get(tag_id, "tx_power")
+            if tx_power is not None:
+                title = title + ", TX {} dBm".format(tx_power)
+            self.__create_and_style_cdf(all_rssi[tag_id], title, distribution_plot=True)
             plot_num = plot_num + 1
 
         img_name = "combined_rssi_per_tag.png"
-        self.created_images.append(img_name)
-        plt.savefig(img_name)
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_rssi_errors(self, rssi_statistics):
+        # SPEC_PERCENTILE error per RSSI bin of every tag with the fitted error
+        # model, the errors of all tags per rssi and rssi2 bin and the RSSI
+        # where every tag gets out of spec according to its model
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Error vs RSSI")
+        plt.subplots_adjust(
+            left=0.08, right=0.97, top=0.92, bottom=0.08, hspace=0.35, wspace=0.2
+        )
+        plt.gcf().text(
+            0.38,
+            0.99,
+            "Error vs RSSI",
+            va="top",
+            fontsize=22,
+        )
+        percentile = "p{}".format(SPEC_PERCENTILE)
+        rssi = rssi_statistics["columns"]["rssi"]
+        centers = rssi["centers"]
+
+        def style_plot(ax, title):
+            ax.axhline(y=SPEC_ERROR, color="blue", linestyle="-")
+            ax.set_title(title)
+            ax.set_xlabel("RSSI", {"color": "white"})
+            ax.set_ylabel("Angle error", {"color": "white"})
+            ax.tick_params(axis="x", colors="white")
+            ax.tick_params(axis="y", colors="white")
+            ax.grid(alpha=0.4, color="#212F3D")
+            ax.legend(facecolor="#202124", fontsize=7)
+
+        for plot_num, axis in enumerate(["azimuth", "elevation"], 1):
+            ax = plt.subplot(2, 2, plot_num)
+            binned = rssi["tags"][axis]
+            for tag, tag_id in enumerate(rssi_statistics["tag_ids"]):
+                keep = binned["count"][tag] >= MIN_BIN_SAMPLES
+                if not np.any(keep):
+                    continue
+                line = ax.plot(
+                    centers[keep],
+                    binned[percentile][tag][keep],
+                    "o",
+                    markersize=3,
+                    label=REGISTRY.tags.label(tag_id),
+                )
+                model = rssi_statistics["models"][tag_id][axis]["model"]
+                if model is not None:
+                    x_values = np.linspace(centers[keep][0], centers[keep][-1], 50)
+                    ax.plot(
+                        x_values,
+                        model_errors(model, x_values),
+                        "--",
+                        color=line[0].get_color(),
+                    )
+            style_plot(ax, "{} {} error per tag".format(axis.capitalize(), percentile))
+
+        ax = plt.subplot(2, 2, 3)
+        for column, values in rssi_statistics["columns"].items():
+            for axis in ["azimuth", "elevation"]:
+                binned = values["all"][axis]
+                keep = binned["count"] >= MIN_BIN_SAMPLES
+                for metric, style in [("mean", "-"), (percentile, "--")]:
+                    ax.plot(
+                        values["centers"][keep],
+                        binned[metric][keep],
+                        style,
+                        label="{} {} {}".format(axis, metric, column),
+                    )
+        style_plot(ax, "All tags")
+
+        ax = plt.subplot(2, 2, 4)
+        ax.axis("off")
+        lines = [
+            "{} = a + b * 10^((-60 - RSSI) / 20)".format(percentile),
+            "",
+            "{:<14}{:>8}{:>8}{:>10}{:>8}{:>8}{:>10}".format(
+                "tag", "az a", "az b", "az spec", "el a", "el b", "el spec"
+            ),
+        ]
+        for tag_id, models in rssi_statistics["models"].items():
+            line = "{:<14}".format(REGISTRY.tags.short_label(tag_id)[:13])
+            for axis in ["azimuth", "elevation"]:
+                model = models[axis]["model"]
+                if model is None:
+                    line = line + "{:>8}{:>8}".format("-", "-")
+                else:
+                    line = line + "{:>8.2f}{:>8.2f}".format(*model)
+                if models[axis]["spec_rssi"] is None:
+                    line = line + "{:>10}".format("-")
+                else:
+                    line = line + "{:>10.1f}".format(models[axis]["spec_rssi"])
+            lines.append(line)
+        lines.append("")
+        lines.append(
+            "spec: RSSI where the {} error reaches {} degrees".format(
+                percentile, SPEC_ERROR
+            )
+        )
+        ax.text(
+            0,
+            1,
+            "\n".join(lines),
+            va="top",
+            family="monospace",
+            fontsize=8,
+            color="white",
+            transform=ax.transAxes,
+        )
+
+        img_name = "error_vs_rssi.png"
+        self.report.add_figure(img_name)
         plt.show(block=False)
 
-    def plot_mean_err_angle(self, all_phi, all_theta):
+    def plot_mean_err_angle(self, all_phi, all_theta, intervals=None):
         # Plot dist for all rssi per tag
         plot_num = 1
         fig = plt.figure(figsize=self.figsize)
@@ -268,12 +477,32 @@ class AoATester:
             plt.gca().tick_params(axis="y", colors="white")
             plt.gca().grid(alpha=0.4, color="#212F3D")
 
+        def plot_confidence_bands(ax, angle_intervals, axis):
+            # Bootstrap confidence bands of the mean and the 90th percentile error
+            for metric, color in [("mean", "#1f77b4"), ("p90", "#f98941")]:
+                estimate, low, high = [
+                    [
+                        angle_intervals[angle][axis][metric][i]
+                        for angle in angles_x_values
+                    ]
+                    for i in range(3)
+                ]
+                if metric != "mean":
+                    ax.plot(angles_x_values, estimate, color=color, label=metric)
+                ax.fill_between(angles_x_values, low, high, color=color, alpha=0.3)
+
         ax = plt.subplot(2, 2, 1)
         style_plot("Azimuth mean error")
-        ax.plot(angles_x_values, error_phi_x_values)
+        ax.plot(angles_x_values, error_phi_x_values, label="mean")
+        if intervals is not None:
+            plot_confidence_bands(ax, intervals["angles_phi"], "azimuth")
+            ax.legend(facecolor="#202124")
         ax = plt.subplot(2, 2, 2)
         style_plot("Theta mean error")
-        ax.plot(angles_x_values, error_theta_x_values)
+        ax.plot(angles_x_values, error_theta_x_values, label="mean")
+        if intervals is not None:
+            plot_confidence_bands(ax, intervals["angles_theta"], "elevation")
+            ax.legend(facecolor="#202124")
 
         ax = plt.subplot(2, 2, 3)
         style_plot("Azimuth std error")
@@ -283,8 +512,531 @@ class AoATester:
         ax.plot(angles_x_values, std_error_theta_x_values)
 
         img_name = "mean_errors_per_angle.png"
-        self.created_images.append(img_name)
-        plt.savefig(img_name)
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_grid_heatmap(self, ax, values, grid, title, vmax):
+        # Heatmap of (azimuths, elevations) values, ground truth azimuth on x
+        # and tilt on y, empty cells left blank
+        image = ax.imshow(
+            np.ma.masked_invalid(values.T),
+            cmap="viridis",
+            vmin=0,
+            vmax=vmax,
+            origin="lower",
+            aspect="auto",
+            interpolation="nearest",
+        )
+        ax.set_title(title, fontsize=9)
+        for ticks, set_ticks, set_labels in [
+            (grid["azimuths"], ax.set_xticks, ax.set_xticklabels),
+            (grid["elevations"], ax.set_yticks, ax.set_yticklabels),
+        ]:
+            # About 10 labels per axis, fine grids have too many for all
+            stride = max(1, len(ticks) // 10)
+            set_ticks(np.arange(0, len(ticks), stride))
+            set_labels(ticks[::stride], fontsize=6)
+        ax.tick_params(axis="x", colors="white")
+        ax.tick_params(axis="y", colors="white")
+        return image
+
+    def plot_grid_statistics(self, grid):
+        # Mean and 90th percentile error per ground truth (azimuth, tilt) cell
+        # of all tags, then the same maps per tag as small multiples with
+        # GRID_TAGS_PER_PAGE tags per page. All maps of a metric share one
+        # color scale so tags can be compared.
+        limits = {
+            metric: max(
+                1,
+                np.nanmax(
+                    np.r_[
+                        grid["all"]["azimuth"][metric].ravel(),
+                        grid["all"]["elevation"][metric].ravel(),
+                        0,
+                    ]
+                ),
+            )
+            for metric in ["mean", "p90"]
+        }
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Error per azimuth and tilt")
+        plt.subplots_adjust(
+            left=0.08, right=0.97, top=0.92, bottom=0.08, hspace=0.35, wspace=0.2
+        )
+        plt.gcf().text(
+            0.28,
+            0.99,
+            "Error per azimuth and tilt",
+            va="top",
+            fontsize=22,
+        )
+        plot_num = 1
+        for axis in ["azimuth", "elevation"]:
+            for metric in ["mean", "p90"]:
+                ax = plt.subplot(2, 2, plot_num)
+                plot_num = plot_num + 1
+                image = self.plot_grid_heatmap(
+                    ax,
+                    grid["all"][axis][metric],
+                    grid,
+                    "{} {} error".format(axis.capitalize(), metric),
+                    limits[metric],
+                )
+                ax.set_xlabel("Azimuth", {"color": "white"})
+                ax.set_ylabel("Tilt", {"color": "white"})
+                colorbar = fig.colorbar(image, ax=ax)
+                colorbar.ax.tick_params(colors="white")
+        img_name = "error_per_azimuth_and_tilt.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+        tags = [
+            tag
+            for tag in range(len(grid["tag_ids"]))
+            if grid["tags"]["azimuth"]["count"][tag].sum() > 0
+        ]
+        for page, first in enumerate(range(0, len(tags), GRID_TAGS_PER_PAGE)):
+            page_tags = tags[first : first + GRID_TAGS_PER_PAGE]
+            fig = plt.figure(figsize=self.figsize)
+            fig.patch.set_facecolor("#202124")
+            fig.canvas.manager.set_window_title("Error per azimuth and tilt per tag")
+            plt.subplots_adjust(
+                left=0.05, right=0.88, top=0.9, bottom=0.05, hspace=0.3, wspace=0.25
+            )
+            plt.gcf().text(
+                0.22,
+                0.99,
+                "Error per azimuth and tilt per tag",
+                va="top",
+                fontsize=22,
+            )
+            # Two tags per row, azimuth and elevation next to each other
+            rows = (len(page_tags) + 1) // 2
+            for index, tag in enumerate(page_tags):
+                for column, axis in enumerate(["azimuth", "elevation"]):
+                    ax = plt.subplot(rows, 4, index * 2 + column + 1)
+                    image = self.plot_grid_heatmap(
+                        ax,
+                        grid["tags"][axis]["p90"][tag],
+                        grid,
+                        "{}\n{} p90 error".format(
+                            REGISTRY.tags.label(grid["tag_ids"][tag]), axis
+                        ),
+                        limits["p90"],
+                    )
+            colorbar = fig.colorbar(image, ax=fig.axes, fraction=0.03)
+            colorbar.ax.tick_params(colors="white")
+            img_name = "error_per_azimuth_and_tilt_per_tag_{}.png".format(page)
+            self.report.add_figure(img_name)
+            plt.show(block=False)
+
+    def plot_confidence_intervals(self, intervals):
+        # Bootstrap confidence intervals of the accuracy metrics per position
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Confidence intervals per position")
+        plt.subplots_adjust(
+            left=0.06, right=0.97, top=0.92, bottom=0.08, hspace=0.5, wspace=0.15
+        )
+        plt.gcf().text(
+            0.25,
+            0.99,
+            "Confidence intervals per position",
+            va="top",
+            fontsize=22,
+        )
+        positions = sorted(intervals["positions"].keys())
+        x_values = np.arange(len(positions))
+        plot_num = 1
+        for metric, title in [
+            ("mean", "mean error"),
+            ("p90", "p90 error"),
+            ("within_10", "errors <= 10"),
+        ]:
+            for axis in ["azimuth", "elevation"]:
+                estimate, low, high = [
+                    np.array(
+                        [intervals["positions"][p][axis][metric][i] for p in positions]
+                    )
+                    for i in range(3)
+                ]
+                ax = plt.subplot(3, 2, plot_num)
+                plot_num = plot_num + 1
+                ax.errorbar(
+                    x_values,
+                    estimate,
+                    yerr=[estimate - low, high - estimate],
+                    fmt="o",
+                    markersize=3,
+                    color="#1887AB",
+                    ecolor="#5DADE2",
+                )
+                if metric == "within_10":
+                    ax.axhline(y=0.9, color="blue", linestyle="-")
+                    ax.set_ylim(min(0.5, np.min(low) - 0.05), 1.02)
+                ax.set_title("{} {}".format(axis.capitalize(), title))
+                ax.set_xticks(x_values)
+                ax.set_xticklabels(
+                    ["{},{}".format(p[0], p[1]) for p in positions],
+                    rotation=90,
+                    fontsize=7,
+                )
+                ax.tick_params(axis="x", colors="white")
+                ax.tick_params(axis="y", colors="white")
+                ax.grid(alpha=0.4, color="#212F3D")
+
+        img_name = "confidence_intervals_per_position.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_channel_statistics(self, channel_statistics):
+        # Mean absolute error per position and BLE channel, mean RSSI per tag
+        # and channel and the mean error of every channel over all positions
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Accuracy per channel")
+        plt.subplots_adjust(
+            left=0.08, right=0.97, top=0.92, bottom=0.08, hspace=0.35, wspace=0.25
+        )
+        plt.gcf().text(
+            0.32,
+            0.99,
+            "Accuracy per channel",
+            va="top",
+            fontsize=22,
+        )
+        channels = channel_statistics["channels"]
+        per_position = channel_statistics["per_position"]
+        per_tag = channel_statistics["per_tag"]
+        # Positions and tags without samples, like positions where the
+        # filters rejected everything, are left out
+        positions = [
+            i
+            for i in sorted(
+                range(len(channel_statistics["positions"])),
+                key=lambda i: channel_statistics["positions"][i],
+            )
+            if per_position["count"][i].sum() > 0
+        ]
+        tags = [
+            i
+            for i in range(len(channel_statistics["tag_ids"]))
+            if per_tag["count"][i].sum() > 0
+        ]
+        position_labels = [
+            "{},{}".format(*channel_statistics["positions"][i]) for i in positions
+        ]
+        heatmaps = [
+            (
+                per_position["azimuth_error"][positions],
+                "Azimuth mean error",
+                position_labels,
+            ),
+            (
+                per_position["elevation_error"][positions],
+                "Elevation mean error",
+                position_labels,
+            ),
+            (
+                per_tag["rssi"][tags],
+                "Mean RSSI",
+                [REGISTRY.tags.label(channel_statistics["tag_ids"][i]) for i in tags],
+            ),
+        ]
+        error_limit = max(
+            1,
+            np.nanmax(
+                np.r_[
+                    per_position["azimuth_error"].ravel(),
+                    per_position["elevation_error"].ravel(),
+                    0,
+                ]
+            ),
+        )
+        for plot_num, (values, title, labels) in enumerate(heatmaps, 1):
+            ax = plt.subplot(2, 2, plot_num)
+            image = ax.imshow(
+                np.ma.masked_invalid(values),
+                cmap="viridis",
+                vmin=0 if plot_num < 3 else None,
+                vmax=error_limit if plot_num < 3 else None,
+                aspect="auto",
+                interpolation="nearest",
+            )
+            colorbar = fig.colorbar(image, ax=ax)
+            colorbar.ax.tick_params(colors="white")
+            ax.set_title(title)
+            ax.set_xlabel("Channel", {"color": "white"})
+            ax.set_xticks(np.arange(len(channels)))
+            ax.set_xticklabels(channels, rotation=90, fontsize=6)
+            # At most about 40 labels, fine sweeps have too many positions
+            stride = max(1, len(labels) // 40)
+            ax.set_yticks(np.arange(0, len(labels), stride))
+            ax.set_yticklabels(labels[::stride], fontsize=6)
+            ax.tick_params(axis="x", colors="white")
+            ax.tick_params(axis="y", colors="white")
+
+        # Mean over all positions, weighted with the samples of every cell
+        ax = plt.subplot(2, 2, 4)
+        count = per_position["count"].sum(axis=0)
+        for name, label in [
+            ("azimuth_error", "azimuth"),
+            ("elevation_error", "elevation"),
+        ]:
+            total = np.nansum(per_position[name] * per_position["count"], axis=0)
+            ax.plot(
+                channels, total / np.maximum(count, 1), "o-", markersize=3, label=label
+            )
+        ax.set_title("Mean error per channel")
+        ax.set_xlabel("Channel", {"color": "white"})
+        ax.set_ylabel("Mean error", {"color": "white"})
+        ax.tick_params(axis="x", colors="white")
+        ax.tick_params(axis="y", colors="white")
+        ax.grid(alpha=0.4, color="#212F3D")
+        ax.legend(facecolor="#202124")
+
+        img_name = "accuracy_per_channel.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_iq_features(self, features):
+        # Per element phase error, amplitude imbalance and phase coherence and
+        # the CFO per position, from the IQs of the raw IQ debug mode
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("IQ features per position")
+        plt.subplots_adjust(
+            left=0.08, right=0.97, top=0.92, bottom=0.08, hspace=0.35, wspace=0.25
+        )
+        plt.gcf().text(
+            0.30,
+            0.99,
+            "IQ features per position",
+            va="top",
+            fontsize=22,
+        )
+        order = sorted(
+            range(len(features["positions"])), key=lambda i: features["positions"][i]
+        )
+        labels = ["{},{}".format(*features["positions"][i]) for i in order]
+        y_values = np.arange(len(labels))
+        phase_limit = max(1, np.max(np.abs(features["phase_error"])))
+        for plot_num, (name, title, colormap, vmin, vmax) in enumerate(
+            [
+                (
+                    "phase_error",
+                    "Phase error (deg)",
+                    "coolwarm",
+                    -phase_limit,
+                    phase_limit,
+                ),
+                ("amplitude_db", "Amplitude imbalance (dB)", "viridis", None, None),
+                ("coherence", "Phase coherence", "viridis", 0, 1),
+            ],
+            1,
+        ):
+            ax = plt.subplot(2, 2, plot_num)
+            image = ax.imshow(
+                features[name][order],
+                cmap=colormap,
+                vmin=vmin,
+                vmax=vmax,
+                aspect="auto",
+                interpolation="nearest",
+            )
+            colorbar = fig.colorbar(image, ax=ax)
+            colorbar.ax.tick_params(colors="white")
+            ax.set_title(title)
+            ax.set_xlabel("Element", {"color": "white"})
+            ax.set_yticks(y_values)
+            ax.set_yticklabels(labels, fontsize=6)
+            ax.tick_params(axis="x", colors="white")
+            ax.tick_params(axis="y", colors="white")
+
+        ax = plt.subplot(2, 2, 4)
+        ax.errorbar(
+            features["cfo_hz"][order] / 1000,
+            y_values,
+            xerr=features["cfo_hz_std"][order] / 1000,
+            fmt="o",
+            markersize=3,
+            color="#1887AB",
+            ecolor="#5DADE2",
+        )
+        ax.set_ylim(len(labels) - 0.5, -0.5)
+        ax.set_title("CFO (kHz)")
+        ax.set_yticks(y_values)
+        ax.set_yticklabels(labels, fontsize=6)
+        ax.tick_params(axis="x", colors="white")
+        ax.tick_params(axis="y", colors="white")
+        ax.grid(alpha=0.4, color="#212F3D")
+
+        img_name = "iq_features_per_position.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_latency(self):
+        # Latency of every live stage of the collected samples, as percentile
+        # distributions on a 1/(1 - percentile) axis so the tail is visible
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Latency per stage")
+        plt.subplots_adjust(left=0.08, right=0.95, top=0.92, bottom=0.3)
+        plt.gcf().text(
+            0.35,
+            0.99,
+            "Latency per stage",
+            va="top",
+            fontsize=22,
+        )
+        ax = plt.subplot(1, 1, 1)
+        for stage, histogram in LATENCY.histograms.items():
+            fractions, values = histogram.percentile_distribution()
+            # The last bucket holds the max, 1/(1 - 1) has no place on the axis
+            keep = fractions < 1
+            ax.step(
+                1 / (1 - fractions[keep]),
+                values[keep] / 1e6,
+                where="post",
+                label=stage,
+            )
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ticks = [1, 2, 10, 100, 1000, 10000]
+        ax.set_xticks(ticks)
+        ax.set_xticklabels(["0%", "50%", "90%", "99%", "99.9%", "99.99%"])
+        ax.set_xlabel("Percentile", {"color": "white"})
+        ax.set_ylabel("Latency (ms)", {"color": "white"})
+        ax.tick_params(axis="x", colors="white")
+        ax.tick_params(axis="y", colors="white")
+        ax.grid(alpha=0.4, color="#212F3D")
+        ax.legend(facecolor="#202124")
+        plt.gcf().text(
+            0.08, 0.2, LATENCY.summary(), va="top", family="monospace", fontsize=10
+        )
+
+        img_name = "latency_per_stage.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_error_cdfs(self, ax, title, curves):
+        # Step CDFs of the absolute errors of every (errors, label, color) in
+        # curves on ax, with the share within 10 degrees and the 90th
+        # percentile in the legend
+        for errors, label, color in curves:
+            errors = np.sort(np.abs(errors))
+            if len(errors) == 0:
+                continue
+            ax.step(
+                errors,
+                np.arange(1, len(errors) + 1) / len(errors),
+                where="post",
+                color=color,
+                label="{}  <=10: {:.0f}%  p90: {:.0f}".format(
+                    label,
+                    100 * np.mean(errors <= 10),
+                    np.percentile(errors, 90),
+                ),
+            )
+        ax.axvline(x=10, color="blue", linestyle="-")
+        ax.axhline(y=0.9, color="blue", linestyle="-")
+        ax.set_xlim(0)
+        ax.set_ylim(0, 1)
+        ax.set_title(title)
+        ax.set_xlabel("Angle error", {"color": "white"})
+        ax.set_ylabel("Percent", {"color": "white"})
+        ax.tick_params(axis="x", colors="white")
+        ax.tick_params(axis="y", colors="white")
+        ax.grid(alpha=0.4, color="#212F3D")
+        ax.legend(facecolor="#202124")
+
+    def plot_filter_cdfs(self, filter_statistics):
+        # CDFs of the absolute errors before and after the filters, over all
+        # tags and positions. The raw CDF has every sample, the filtered one
+        # only the samples the filters kept.
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Raw and filtered CDFs")
+        plt.subplots_adjust(left=0.08, right=0.95, top=0.88, bottom=0.08, hspace=0.35)
+        plt.gcf().text(
+            0.30,
+            0.99,
+            "Raw and filtered CDF",
+            va="top",
+            fontsize=22,
+        )
+        total = len(filter_statistics["raw_azimuth_errors"])
+        plt.gcf().text(
+            0.30,
+            0.94,
+            "Filters {}, rejected {} of {} samples ({:.1f}%)".format(
+                filter_statistics["spec"] or "",
+                filter_statistics["rejected"],
+                total,
+                100 * filter_statistics["rejected"] / max(total, 1),
+            ),
+            va="top",
+            fontsize=12,
+        )
+        for plot_num, axis in enumerate(["azimuth", "elevation"], 1):
+            self.plot_error_cdfs(
+                plt.subplot(2, 1, plot_num),
+                axis.capitalize(),
+                [
+                    (filter_statistics["raw_" + axis + "_errors"], "raw", "#f98941"),
+                    (filter_statistics[axis + "_errors"], "filtered", "#1887AB"),
+                ],
+            )
+
+        img_name = "raw_and_filtered_cdf.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+    def plot_calibration_cdfs(self, calibration_statistics):
+        # CDFs of the absolute errors of the measured and the calibrated
+        # angles, over all tags and positions and before any filter
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title("Calibration CDFs")
+        plt.subplots_adjust(left=0.08, right=0.95, top=0.88, bottom=0.06, hspace=0.45)
+        plt.gcf().text(
+            0.30,
+            0.99,
+            "Before and after calibration CDF",
+            va="top",
+            fontsize=22,
+        )
+        parameters = calibration_statistics["parameters"]
+        if parameters is not None:
+            plt.gcf().text(
+                0.30,
+                0.94,
+                "Yaw {:.2f}, pitch {:.2f}, roll {:.2f} degrees, "
+                "azimuth scale {:.3f}, elevation scale {:.3f}".format(
+                    parameters["yaw"],
+                    parameters["pitch"],
+                    parameters["roll"],
+                    parameters["azimuth_scale"],
+                    parameters["elevation_scale"],
+                ),
+                va="top",
+                fontsize=12,
+            )
+        uncalibrated = calibration_statistics["uncalibrated"]
+        calibrated = calibration_statistics["calibrated"]
+        for plot_num, axis in enumerate(["azimuth", "elevation", "angular"], 1):
+            self.plot_error_cdfs(
+                plt.subplot(3, 1, plot_num),
+                axis.capitalize(),
+                [
+                    (uncalibrated[axis], "measured", "#f98941"),
+                    (calibrated[axis], "calibrated", "#1887AB"),
+                ],
+            )
+
+        img_name = "calibration_cdf.png"
+        self.report.add_figure(img_name)
         plt.show(block=False)
 
     def plot_boxplot(self, all_phi, all_theta):
@@ -330,18 +1082,18 @@ class AoATester:
         plt.xticks(list(range(1, len(angles_x_values) + 1)), angles_x_values)
 
         img_name = "boxplot_errors_per_angle.png"
-        self.created_images.append(img_name)
-        plt.savefig(img_name)
+        self.report.add_figure(img_name)
         plt.show(block=False)
 
-    def __create_and_style_cdf(self, data, title, distribution_plot=False):
+    def __create_and_style_cdf(self, data, title, distribution_plot=False, ci=None):
+        data = np.asarray(data)
         if not distribution_plot:
-            data = list(map(lambda angle: abs(angle), data))
+            data = np.abs(data)
         cdf_color = "green"
-        if sum(i <= 10 for i in data) / len(data) < 0.9:
+        if np.mean(data <= 10) < 0.9:
             cdf_color = "red"
 
-        bins = range(min(data), max(data) + 1, 1)  # Equally distributed
+        bins = range(int(np.min(data)), int(np.max(data)) + 1, 1)  # Equally distributed
 
         plt.hist(
             data,
@@ -354,6 +1106,20 @@ class AoATester:
             color=cdf_color,
         )
 
+        if ci is not None and not distribution_plot:
+            # ci is {metric: (estimate, low, high)}
+            within_10, low, high = ci["within_10"]
+            title = "{}  <=10: {:.0f}% [{:.0f}, {:.0f}]".format(
+                title, within_10 * 100, low * 100, high * 100
+            )
+            plt.axvspan(ci["p90"][1], ci["p90"][2], color="#5DADE2", alpha=0.3)
+            plt.errorbar(
+                [10],
+                [within_10],
+                yerr=[[within_10 - low], [high - within_10]],
+                color="yellow",
+                capsize=3,
+            )
         plt.title(title)
         if not distribution_plot:
             plt.axvline(x=10, color="blue", linestyle="-")
@@ -369,56 +1135,309 @@ class AoATester:
         plt.gca().tick_params(axis="y", colors="white")
         plt.gca().grid(alpha=0.4, color="#212F3D")
 
+    def get_sample_table(self):
+        if self.sample_table is None:
+            self.sample_table = SampleTable.from_collected_data(self.collected_data)
+        return self.sample_table
+
+    def set_cached_results(self, sample_table, statistics):
+        self.sample_table = sample_table
+        self.statistics = statistics
+
+    def get_errors(self, prefix=""):
+        # Azimuth and elevation error of every sample in the sample table, of
+        # the angles before filtering with prefix "raw_" and of the measured
+        # angles before a calibration with "uncalibrated_"
+        samples = self.get_sample_table()
+        gt_sign = -1 if self.antenna_upside_down else 1
+        azimuth_errors = samples[prefix + "azimuth"].astype(np.int32) - (
+            gt_sign * samples.gt_azimuth()
+        )
+        elevation_errors = samples[prefix + "elevation"].astype(np.int32) - (
+            gt_sign * samples.gt_elevation()
+        )
+        return (azimuth_errors, elevation_errors)
+
+    def get_angular_errors(self, prefix=""):
+        # Great circle angle between the estimated and the ground truth
+        # direction of every sample in the sample table, with the same ground
+        # truth sign and prefix as get_errors. Swapped angles were swapped
+        # when parsed.
+        samples = self.get_sample_table()
+        gt_sign = -1 if self.antenna_upside_down else 1
+        return great_circle_errors(
+            samples[prefix + "azimuth"],
+            samples[prefix + "elevation"],
+            gt_sign * samples.gt_azimuth(),
+            gt_sign * samples.gt_elevation(),
+        )
+
+    def get_antenna_serial(self):
+        # Anchor id of the antenna the collected samples came from, None
+        # before the first sample
+        for _, parsed_result in self.collected_data.values():
+            for urc_dicts in parsed_result.values():
+                if len(urc_dicts) > 0:
+                    return urc_dicts[0]["anchor_id"]
+        return None
+
+    def apply_calibration(self, calibration=None):
+        # Corrects the angles of the sample table with calibration, or with
+        # one fitted on the sample table if None. Returns the calibration.
+        samples = self.get_sample_table()
+        if calibration is None:
+            calibration = Calibration.fit_table(
+                samples, -1 if self.antenna_upside_down else 1
+            )
+        self.calibration = calibration
+        self.set_cached_results(calibration.apply(samples), None)
+        return calibration
+
+    def compute_statistics(self):
+        samples = self.get_sample_table()
+        azimuth_errors, elevation_errors = self.get_errors()
+        angular_errors = self.get_angular_errors()
+        calibration_statistics = None
+        if "uncalibrated_azimuth" in samples.columns:
+            # Errors of all samples before and after the calibration, both
+            # before any filter
+            calibration_statistics = {"parameters": None}
+            if self.calibration is not None:
+                calibration_statistics["parameters"] = self.calibration.options()
+            for name, prefix in [
+                ("uncalibrated", "uncalibrated_"),
+                ("calibrated", "raw_" if "raw_azimuth" in samples.columns else ""),
+            ]:
+                calibration_statistics[name] = dict(
+                    zip(["azimuth", "elevation"], self.get_errors(prefix)),
+                    angular=self.get_angular_errors(prefix),
+                )
+        filter_statistics = None
+        if "rejected" in samples.columns:
+            # Raw errors of all samples, the statistics below are of the
+            # samples the filters kept
+            raw_azimuth_errors, raw_elevation_errors = self.get_errors("raw_")
+            kept = ~samples["rejected"]
+            filter_statistics = {
+                "spec": None if self.filters is None else self.filters.spec,
+                "raw_azimuth_errors": raw_azimuth_errors,
+                "raw_elevation_errors": raw_elevation_errors,
+                "azimuth_errors": azimuth_errors[kept],
+                "elevation_errors": elevation_errors[kept],
+                "rejected": int(np.count_nonzero(samples["rejected"])),
+            }
+            samples = samples.select(kept)
+            azimuth_errors = azimuth_errors[kept]
+            elevation_errors = elevation_errors[kept]
+            angular_errors = angular_errors[kept]
+        statistics = {
+            "tags_errors": {gt_key: {} for gt_key in samples.positions},
+            "all_errors_phi": {},
+            "all_errors_theta": {},
+            "all_errors_angular": {},
+            "all_rssi": {},
+            "errors_per_angle_phi": {},
+            "errors_per_angle_theta": {},
+        }
+        keys, groups = group_indices(samples["position"], samples["tag"])
+        for (position, tag), indexes in zip(keys, groups):
+            statistics["tags_errors"][samples.positions[position]][
+                samples.tag_ids[tag]
+            ] = {
+                "azimuth_errors": azimuth_errors[indexes],
+                "elevation_errors": elevation_errors[indexes],
+            }
+        keys, groups = group_indices(samples["tag"])
+        for (tag,), indexes in zip(keys, groups):
+            tag_id = samples.tag_ids[tag]
+            statistics["all_errors_phi"][tag_id] = azimuth_errors[indexes]
+            statistics["all_errors_theta"][tag_id] = elevation_errors[indexes]
+            statistics["all_errors_angular"][tag_id] = angular_errors[indexes]
+            statistics["all_rssi"][tag_id] = samples["rssi"][indexes]
+        keys, groups = group_indices(samples.gt_azimuth())
+        for (angle,), indexes in zip(keys, groups):
+            statistics["errors_per_angle_phi"][int(angle)] = azimuth_errors[indexes]
+        keys, groups = group_indices(samples.gt_elevation())
+        for (angle,), indexes in zip(keys, groups):
+            statistics["errors_per_angle_theta"][int(angle)] = elevation_errors[indexes]
+        statistics["confidence_intervals"] = self.compute_confidence_intervals(
+            samples, azimuth_errors, elevation_errors
+        )
+        statistics["channels"] = self.compute_channel_statistics(
+            samples, azimuth_errors, elevation_errors
+        )
+        statistics["grid"] = self.compute_grid_statistics(
+            samples, azimuth_errors, elevation_errors
+        )
+        statistics["rssi_errors"] = rssi_errors(
+            samples, azimuth_errors, elevation_errors
+        )
+        statistics["iq_features"] = iq_features(
+            samples,
+            self.array_geometry,
+            azimuth_errors,
+            elevation_errors,
+            -1 if self.antenna_upside_down else 1,
+        )
+        statistics["filters"] = filter_statistics
+        statistics["calibration"] = calibration_statistics
+        return statistics
+
+    def compute_channel_statistics(self, samples, azimuth_errors, elevation_errors):
+        # Mean absolute errors and RSSI per (tag, position, channel) from one
+        # lexsort of the samples, then summed up per (position, channel) and
+        # (tag, channel) for the heatmaps. Cells without samples are NaN.
+        if len(samples) == 0:
+            return None
+        keys, order, starts = group_starts(
+            samples["tag"], samples["position"], samples["channel"]
+        )
+        count = np.diff(np.r_[starts, len(order)])
+        sums = {
+            "azimuth_error": np.add.reduceat(
+                np.abs(azimuth_errors[order]).astype(np.int64), starts
+            ),
+            "elevation_error": np.add.reduceat(
+                np.abs(elevation_errors[order]).astype(np.int64), starts
+            ),
+            "rssi": np.add.reduceat(samples["rssi"][order].astype(np.int64), starts),
+        }
+        channels, channel_index = np.unique(keys[:, 2], return_inverse=True)
+        channel_index = channel_index.ravel()
+        statistics = {
+            "channels": channels,
+            "positions": samples.positions,
+            "tag_ids": samples.tag_ids,
+            "groups": {
+                "tag": keys[:, 0],
+                "position": keys[:, 1],
+                "channel": keys[:, 2],
+            },
+        }
+        statistics["groups"]["count"] = count
+        for name, values in sums.items():
+            statistics["groups"][name] = values / count
+        for grouping, column, rows in [
+            ("per_position", 1, len(samples.positions)),
+            ("per_tag", 0, len(samples.tag_ids)),
+        ]:
+            cells = (keys[:, column], channel_index)
+            grid_count = np.zeros((rows, len(channels)), dtype=np.int64)
+            np.add.at(grid_count, cells, count)
+            statistics[grouping] = {"count": grid_count}
+            for name, values in sums.items():
+                grid = np.zeros((rows, len(channels)))
+                np.add.at(grid, cells, values)
+                with np.errstate(invalid="ignore"):
+                    statistics[grouping][name] = grid / grid_count
+        return statistics
+
+    def compute_grid_statistics(self, samples, azimuth_errors, elevation_errors):
+        # Count, mean and percentiles of the absolute errors per (ground truth
+        # azimuth, tilt) cell, of all tags together as (azimuths, elevations)
+        # arrays and per tag as (tags, azimuths, elevations) arrays. NaN for
+        # cells without samples.
+        if len(samples) == 0:
+            return None
+        azimuths = np.unique([p[0] for p in samples.positions])
+        elevations = np.unique([p[1] for p in samples.positions])
+        position_cells = np.array(
+            [
+                np.searchsorted(azimuths, p[0]) * len(elevations)
+                + np.searchsorted(elevations, p[1])
+                for p in samples.positions
+            ],
+            dtype=np.int64,
+        )
+        cells = position_cells[samples["position"]]
+        shape = (len(azimuths), len(elevations))
+        statistics = {
+            "azimuths": azimuths,
+            "elevations": elevations,
+            "tag_ids": samples.tag_ids,
+            "all": {},
+            "tags": {},
+        }
+        everything = np.zeros(len(samples), dtype=np.int64)
+        for axis, errors in [
+            ("azimuth", azimuth_errors),
+            ("elevation", elevation_errors),
+        ]:
+            binned = binned_errors(everything, cells, errors, 1, shape[0] * shape[1])
+            statistics["all"][axis] = {
+                name: values.reshape(shape) for name, values in binned.items()
+            }
+            binned = binned_errors(
+                samples["tag"], cells, errors, len(samples.tag_ids), shape[0] * shape[1]
+            )
+            statistics["tags"][axis] = {
+                name: values.reshape((len(samples.tag_ids),) + shape)
+                for name, values in binned.items()
+            }
+        return statistics
+
+    def compute_confidence_intervals(self, samples, azimuth_errors, elevation_errors):
+        # Returns {grouping: {key: {axis: {metric: (estimate, low, high)}}}}
+        intervals = {
+            "tags": {},
+            "positions": {},
+            "angles_phi": {},
+            "angles_theta": {},
+        }
+        if len(samples) == 0:
+            return intervals
+
+        # Every grouping is bootstrapped in the same call, groups may overlap
+        groupings = []
+        keys, groups = group_indices(samples["tag"])
+        for (tag,), indexes in zip(keys, groups):
+            groupings.append(("tags", samples.tag_ids[tag], indexes))
+        keys, groups = group_indices(samples["position"])
+        for (position,), indexes in zip(keys, groups):
+            groupings.append(("positions", samples.positions[position], indexes))
+        keys, groups = group_indices(samples.gt_azimuth())
+        for (angle,), indexes in zip(keys, groups):
+            groupings.append(("angles_phi", int(angle), indexes))
+        keys, groups = group_indices(samples.gt_elevation())
+        for (angle,), indexes in zip(keys, groups):
+            groupings.append(("angles_theta", int(angle), indexes))
+
+        for axis, errors in [
+            ("azimuth", azimuth_errors),
+            ("elevation", elevation_errors),
+        ]:
+            result = bootstrap(
+                np.abs(errors),
+                [indexes for _, _, indexes in groupings],
+                CI_METRICS,
+                self.bootstrap_resamples,
+            )
+            for metric in CI_METRICS:
+                low, high = confidence_interval(result[metric]["resampled"])
+                for i, (grouping, key, _) in enumerate(groupings):
+                    intervals[grouping].setdefault(key, {}).setdefault(axis, {})[
+                        metric
+                    ] = (result[metric]["estimate"][i], low[i], high[i])
+        return intervals
+
+    def get_statistics(self):
+        if self.statistics is None:
+            self.statistics = self.compute_statistics()
+        return self.statistics
+
     def create_plots(
         self, show_plots=True, summary_only=False, distribution_plot=False
     ):
-        all_errors_phi = {}
-        all_errors_theta = {}
-        tags_errors = {}
-        all_rssi = {}
-        errors_per_angle_phi = {}
-        errors_per_angle_theta = {}
+        statistics = self.get_statistics()
+        all_errors_phi = statistics["all_errors_phi"]
+        all_errors_theta = statistics["all_errors_theta"]
+        all_errors_angular = statistics["all_errors_angular"]
+        all_rssi = statistics["all_rssi"]
+        errors_per_angle_phi = statistics["errors_per_angle_phi"]
+        errors_per_angle_theta = statistics["errors_per_angle_theta"]
+        intervals = statistics["confidence_intervals"]
         # gt_key is a tuple (azimuth_gt, elevation_gt)
-        for gt_key, logs_from_location in self.collected_data.items():
-            # For each sample in location
-            for tag_id, urcs in logs_from_location[1].items():
-                azimuth_error = list(
-                    map(
-                        lambda urc: urc["azimuth"]
-                        - (gt_key[0] if not self.antenna_upside_down else -gt_key[0]),
-                        urcs,
-                    )
-                )
-                theta_error = list(
-                    map(
-                        lambda urc: urc["elevation"]
-                        - (gt_key[1] if not self.antenna_upside_down else -gt_key[1]),
-                        urcs,
-                    )
-                )
-                all_rssi[tag_id] = (
-                    all_rssi[tag_id] if tag_id in all_rssi else []
-                ) + list(map(lambda urc: urc["rssi"], urcs))
-                errors_per_angle_phi[gt_key[0]] = (
-                    errors_per_angle_phi[gt_key[0]]
-                    if gt_key[0] in errors_per_angle_phi
-                    else []
-                ) + azimuth_error
-                errors_per_angle_theta[gt_key[1]] = (
-                    errors_per_angle_theta[gt_key[1]]
-                    if gt_key[1] in errors_per_angle_theta
-                    else []
-                ) + theta_error
-                all_errors_phi[tag_id] = (
-                    all_errors_phi[tag_id] if tag_id in all_errors_phi else []
-                ) + azimuth_error
-                all_errors_theta[tag_id] = (
-                    all_errors_theta[tag_id] if tag_id in all_errors_theta else []
-                ) + theta_error
-                tags_errors[tag_id] = {
-                    "azimuth_errors": azimuth_error,
-                    "elevation_errors": theta_error,
-                }
+        for gt_key, tags_errors in statistics["tags_errors"].items():
             plot_num = 1
 
             if not summary_only:
@@ -443,7 +1462,7 @@ class AoATester:
                     plt.subplot(6, 2, plot_num)
                     self.__create_and_style_cdf(
                         errors["azimuth_errors"],
-                        "Azimuth {}".format(tag_id),
+                        "Azimuth {}".format(REGISTRY.tags.label(tag_id)),
                         distribution_plot,
                     )
                     plot_num = plot_num + 1
@@ -451,7 +1470,7 @@ class AoATester:
                     plt.subplot(6, 2, plot_num)
                     self.__create_and_style_cdf(
                         errors["elevation_errors"],
-                        "Elevation {}".format(tag_id),
+                        "Elevation {}".format(REGISTRY.tags.label(tag_id)),
                         distribution_plot,
                     )
                     plot_num = plot_num + 1
@@ -459,8 +1478,7 @@ class AoATester:
                     img_name = "{}_{}_dist.png".format(gt_key[0], gt_key[1])
                 else:
                     img_name = "{}_{}_cdf.png".format(gt_key[0], gt_key[1])
-                self.created_images.append(img_name)
-                plt.savefig(img_name)
+                self.report.add_figure(img_name)
                 if show_plots:
                     plt.show()
                 else:
@@ -485,31 +1503,86 @@ class AoATester:
             fontsize=22,
         )
         for tag_id in all_errors_phi:
+            tag_intervals = intervals["tags"][tag_id]
             plt.subplot(6, 2, plot_num)
             self.__create_and_style_cdf(
-                all_errors_phi[tag_id], "Azimuth {}".format(tag_id), distribution_plot
+                all_errors_phi[tag_id],
+                "Azimuth {}".format(REGISTRY.tags.label(tag_id)),
+                distribution_plot,
+                tag_intervals["azimuth"],
             )
             plot_num = plot_num + 1
 
             plt.subplot(6, 2, plot_num)
             self.__create_and_style_cdf(
                 all_errors_theta[tag_id],
-                "Elevation {}".format(tag_id),
+                "Elevation {}".format(REGISTRY.tags.label(tag_id)),
+                distribution_plot,
+                tag_intervals["elevation"],
+            )
+            plot_num = plot_num + 1
+        if distribution_plot:
+            img_name = "combined_dist_per_tag.png"
+        else:
+            img_name = "combined_cdf_per_tag.png"
+        self.report.add_figure(img_name)
+        plt.show(block=False)
+
+        # Plot angular error for all positions per tag, the great circle angle
+        # between estimated and ground truth direction
+        plot_num = 1
+        fig = plt.figure(figsize=self.figsize)
+        fig.patch.set_facecolor("#202124")
+        fig.canvas.manager.set_window_title(
+            "Distribution" if distribution_plot else "CDFs"
+        )
+        fig.subplots_adjust(wspace=0.15)
+        plt.subplots_adjust(left=0.05, right=0.95, top=0.94, bottom=0.05, hspace=0.7)
+        plt.gcf().text(
+            0.30,
+            0.99,
+            "Per tag angular error {}".format(
+                "distribution" if distribution_plot else "CDF"
+            ),
+            va="top",
+            fontsize=22,
+        )
+        for tag_id in all_errors_angular:
+            plt.subplot(6, 2, plot_num)
+            self.__create_and_style_cdf(
+                all_errors_angular[tag_id],
+                "Angular {}".format(REGISTRY.tags.label(tag_id)),
                 distribution_plot,
             )
             plot_num = plot_num + 1
         if distribution_plot:
-            img_name = "combined_dist_per_tag.png".format(gt_key[0], gt_key[1])
+            img_name = "angular_dist_per_tag.png"
         else:
-            img_name = "combined_cdf_per_tag.png".format(gt_key[0], gt_key[1])
-        self.created_images.append(img_name)
-        plt.savefig(img_name)
+            img_name = "angular_cdf_per_tag.png"
+        self.report.add_figure(img_name)
         plt.show(block=False)
 
         if distribution_plot:
             self.plot_rssi_per_tag(all_rssi)
-            self.plot_mean_err_angle(errors_per_angle_phi, errors_per_angle_theta)
+            if statistics["rssi_errors"] is not None:
+                self.plot_rssi_errors(statistics["rssi_errors"])
+            self.plot_mean_err_angle(
+                errors_per_angle_phi, errors_per_angle_theta, intervals
+            )
+            if statistics["grid"] is not None:
+                self.plot_grid_statistics(statistics["grid"])
             self.plot_boxplot(errors_per_angle_phi, errors_per_angle_theta)
+            self.plot_confidence_intervals(intervals)
+            if statistics["channels"] is not None:
+                self.plot_channel_statistics(statistics["channels"])
+            if statistics["iq_features"] is not None:
+                self.plot_iq_features(statistics["iq_features"])
+            if LATENCY.enabled and len(LATENCY.histograms) > 0:
+                self.plot_latency()
+        if not distribution_plot and statistics["filters"] is not None:
+            self.plot_filter_cdfs(statistics["filters"])
+        if not distribution_plot and statistics["calibration"] is not None:
+            self.plot_calibration_cdfs(statistics["calibration"])
 
         # Plot CDF for all tags combined
         fig = plt.figure(figsize=self.figsize)
@@ -526,46 +1599,35 @@ class AoATester:
             va="top",
             fontsize=22,
         )
-        plt.subplot(2, 1, 1)
-        all_errors_phi_combined = [
-            item for sublist in list(all_errors_phi.values()) for item in sublist
-        ]
-        all_errors_theta_combined = [
-            item for sublist in list(all_errors_theta.values()) for item in sublist
-        ]
+        plt.subplot(3, 1, 1)
+        all_errors_phi_combined = np.concatenate(list(all_errors_phi.values()))
+        all_errors_theta_combined = np.concatenate(list(all_errors_theta.values()))
+        all_errors_angular_combined = np.concatenate(list(all_errors_angular.values()))
         self.__create_and_style_cdf(
             all_errors_phi_combined, "For all tags azimuth", distribution_plot
         )
-        plt.subplot(2, 1, 2)
+        plt.subplot(3, 1, 2)
         self.__create_and_style_cdf(
             all_errors_theta_combined, "For all tags theta", distribution_plot
         )
+        plt.subplot(3, 1, 3)
+        self.__create_and_style_cdf(
+            all_errors_angular_combined, "For all tags angular", distribution_plot
+        )
 
         if distribution_plot:
             img_name = "dist_all_tags.png"
         else:
             img_name = "cdf_all_tags.png"
-        plt.savefig(img_name)
-        self.created_images.append(img_name)
+        self.report.add_figure(img_name)
 
         plt.show()
 
     def create_pdf_report(self, name):
-        pdf = FPDF()
-        for image in self.created_images:
-            pdf.add_page()
-            # 210 is width of A4 page to keep aspect ratio
-            # of figures created with plt.figure(figsize=(12, 10))
-            # TODO should probbaly just check aspect ratio of the images instead
-            pdf.image(image, 0, 0, 210, int(210 * self.figsize[1] / self.figsize[0]))
-        pdf.output("{}.pdf".format(name), "F")
-
-        return "{}.pdf".format(name)
+        return self.report.save("{}.pdf".format(name))
 
     def delete_created_images(self):
-        for img in self.created_images:
-            os.remove(img)
-        self.created_images = []
+        self.report.clear()
 
 
 if __name__ == "__main__":
@@ -623,8 +1685,65 @@ if __name__ == "__main__":
         default="",
         help="Name identifying the measurement",
     )
+    parser.add_argument(
+        "--latency",
+        dest="latency",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Measure the latency of reading, parsing, storing and plotting every sample. Added to the report, kill -USR1 prints it.",
+    )
+    parser.add_argument(
+        "--estimator",
+        dest="estimator",
+        default="module",
+        choices=["module"] + ESTIMATOR_METHODS,
+        required=False,
+        help="Re-estimate the angles from the IQs on the host, the module must output raw IQ debug lines.",
+    )
+    parser.add_argument(
+        "--array",
+        dest="array",
+        default=None,
+        required=False,
+        help="Json file with the antenna array geometry for --estimator, default a 4x4 array.",
+    )
+    parser.add_argument(
+        "--filters",
+        dest="filters",
+        default=None,
+        required=False,
+        help="Filters run per tag on the angles before they are stored, like hampel:7:3,median:5 or kalman:0.5:3. One of median:size, hampel:size:n_sigmas, ema:alpha, kalman:process_std:measurement_std.",
+    )
+    parser.add_argument(
+        "--calibrate",
+        dest="calibrate",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Fit the mounting offset (yaw, pitch, roll) and angle scales of the antenna on the sweep, correct the report with it and save it for the antenna in --calibration_file.",
+    )
+    parser.add_argument(
+        "--calibration_file",
+        dest="calibration_file",
+        default=CALIBRATION_FILE,
+        required=False,
+        help="Json file with the calibrations of every antenna serial. The calibration of the antenna is applied to the report when it has one.",
+    )
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        default=REGISTRY_FILE,
+        required=False,
+        help="Json file with the friendly name, expected position and TX power of tags and the name of anchors, default tags.json next to the scripts if it exists.",
+    )
 
     args = parser.parse_args()
+    load_registry(args.tags)
+
+    if args.latency:
+        LATENCY.enable()
+        LATENCY.install_signal_handler()
 
     # Cleanup if there are some old .log files
     for file in glob.glob("*.log"):
@@ -641,6 +1760,11 @@ if __name__ == "__main__":
         args.locate_baudrate,
         args.ctsrts,
     )
+    estimator = load_estimator(args.estimator, args.array)
+    if estimator is not None:
+        tester.set_estimator(StreamingEstimator(estimator))
+    if args.filters is not None:
+        tester.set_filters(FilterChain.from_spec(args.filters))
 
     if args.webcam:
         webcam_window = tk.Tk()
@@ -687,6 +1811,16 @@ if __name__ == "__main__":
         )
 
     tester.save_collected_data()
+    serial = tester.get_antenna_serial()
+    if args.calibrate:
+        calibration = tester.apply_calibration()
+        save_calibration(serial, calibration, args.calibration_file)
+        print("Saved the calibration of antenna", serial, calibration.options())
+    else:
+        calibration = load_calibration(serial, args.calibration_file)
+        if calibration is not None:
+            print("Applying the calibration of antenna", serial)
+            tester.apply_calibration(calibration)
     tester.create_plots(show_plots=False, summary_only=True)
     tester.create_plots(show_plots=False, summary_only=True, distribution_plot=True)
 
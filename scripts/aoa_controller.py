@@ -1,71 +1,78 @@
-from serial_helpers import (
-    open_port,
-    close_port,
-    send_command_and_wait_rsp,
-    read_line,
-    flush_input_buffer,
-)
-import numpy as np
-import time
+from sample_sources import SerialSource
+from latency import LATENCY
+from tag_registry import REGISTRY
 import json
 import base64
+import re
+import numpy as np
+
+# IQ samples per packet in the raw IQ debug format, one I and one Q byte each
+IQ_SAMPLES = 82
+# The raw IQ debug lines as the module writes them. Matching this is a lot
+# faster than json.loads, lines in any other layout fall back to json.
+DEBUG_JSON_PATTERN = re.compile(
+    r'\{"id":"([^"]*)","rssi":(-?\d+),"est":\[([^,\]]*),([^\]]*)\],'
+    r'"est_raw":\[([^,\]]*),([^\]]*)\],"ch":(\d+),"a_id":"([^"]*)",'
+    r'"ms":(\d+),"iq_b64":"([^"]*)"\}'
+)
 
 
 class AoAController:
-    def __init__(self, port, baudrate, ctsrts, mock=False):
-        self.port = port
-        self.baudrate = baudrate
-        self.ctsrts = ctsrts
-        self.mock = mock
-        self.mock_value = 0
+    # Reads angles from a u-connectLocate module on a serial port, or from
+    # any other SampleSource like the simulator or a log replay.
+    def __init__(self, port, baudrate, ctsrts, source=None):
+        if source is None:
+            source = SerialSource(port, baudrate, ctsrts)
+        self.source = source
 
     def start(self):
-        if self.mock:
-            return
-        self.ser_locate = open_port(self.port, self.baudrate, self.ctsrts)
+        self.source.start()
         # Turn off everything while also checking that communication is working
         self.disable_aoa()
 
+    def stop(self):
+        self.source.stop()
+
     def enable_aoa(self):
-        if not self.mock:
-            return
-        res = send_command_and_wait_rsp(self.ser_locate, "AT+UDFENABLE=1")
+        res = self.source.send_command("AT+UDFENABLE=1")
         if res == -1:
             raise Exception("Failed enabling u-connectLocate!")
 
     def disable_aoa(self):
-        if not self.mock:
-            return
-        res = send_command_and_wait_rsp(self.ser_locate, "AT+UDFENABLE=1")
+        res = self.source.send_command("AT+UDFENABLE=0")
         if res == -1:
             raise Exception("Failed disabling u-connectLocate!")
 
     def flush_input_buffer(self):
-        if self.mock:
-            return
-        flush_input_buffer(self.ser_locate)
+        self.source.flush()
 
-    def wait_for_aoa_event(self):
-        if self.mock:
-            time.sleep(0.1)
-            self.mock_value = self.mock_value + 1
-            line = '+UUDF:F4CE5FC91A6A,-50,{},{},0,20,"CD84C98B935D","",238777,40871'.format(
-                int(np.sin(self.mock_value) * 60), int(20 + np.sin(self.mock_value) * 1)
-            )
-            return (line, parse_uudf(line))
-        else:
-            try:
-                line = read_line(self.ser_locate)
-                if len(line) > 0:
-                    if "+STARTUP" in line:
-                        raise Exception("Module crash detected")
-                    return (line, parse_event(line))
-            except Exception as e:
-                print(e)
-                return ("", None)
+    def set_ground_truth(self, azimuth, elevation):
+        self.source.set_ground_truth(azimuth, elevation)
 
+    def wait_for_aoa_event(self):
+        try:
+            if LATENCY.enabled:
+                LATENCY.mark("read_start")
+            line = self.source.read_line()
+            if len(line) > 0:
+                if LATENCY.enabled:
+                    # Time spent waiting for the line, close to 0 means lines
+                    # are queueing up in the source
+                    LATENCY.mark("read")
+                    LATENCY.record("read_wait", "read_start", "read")
+                if "+STARTUP" in line:
+                    raise Exception("Module crash detected")
+                parsed = parse_event(line)
+                if LATENCY.enabled:
+                    LATENCY.mark("parse")
+                    LATENCY.record("parse", "read", "parse")
+                return (line, parsed)
+        except Exception as e:
+            print(e)
             return ("", None)
 
+        return ("", None)
+
 
 def parse_event(line):
     if line.startswith("+UUDF"):
@@ -86,49 +93,183 @@ def parse_uudf(urc_str):
     if len(instanceId) != 12:
         return None
 
+    # Ids are interned, every sample of a tag shares one string
     urc_dict = {
-        "instanceId": instanceId,
+        "instanceId": REGISTRY.tags.intern(instanceId),
         "rssi": int(urc_params[1]),
         "azimuth": int(urc_params[2]),
         "elevation": int(urc_params[3]),
         "rssi2": int(urc_params[4]),
         "channel": int(urc_params[5]),
-        "anchor_id": urc_params[6].replace('"', ""),
+        "anchor_id": REGISTRY.anchors.intern(urc_params[6].replace('"', "")),
         "user_defined_str": urc_params[7].replace('"', ""),
         "timestamp_ms": int(urc_params[8]),
     }
     return urc_dict
 
 
-def parse_debug_json(dbg_json):
+UUDF_COLUMNS = [
+    "instanceId",
+    "rssi",
+    "azimuth",
+    "elevation",
+    "rssi2",
+    "channel",
+    "anchor_id",
+    "user_defined_str",
+    "timestamp_ms",
+]
+
+
+def parse_uudf_batch(urc_strs):
+    # Parses many +UUDF URCs at once into columns, one list per field in
+    # UUDF_COLUMNS plus the stripped URC itself in "urc". Ids are interned,
+    # "tag" and "anchor" are their integers in REGISTRY.
+    # Returns the columns and the number of URCs that could not be parsed.
+    rows = []
+    errors = 0
+    tags = REGISTRY.tags
+    anchors = REGISTRY.anchors
+    for urc_str in urc_strs:
+        urc_str = urc_str.strip()
+        if urc_str[:6].upper() != "+UUDF:":
+            errors = errors + 1
+            continue
+        urc_params = urc_str[6:].split(",")
+        if len(urc_params) < 9 or len(urc_params[0]) != 12:
+            errors = errors + 1
+            continue
+        try:
+            tag = tags.index(urc_params[0])
+            anchor = anchors.index(urc_params[6].replace('"', ""))
+            rows.append(
+                (
+                    tags.ids[tag],
+                    int(urc_params[1]),
+                    int(urc_params[2]),
+                    int(urc_params[3]),
+                    int(urc_params[4]),
+                    int(urc_params[5]),
+                    anchors.ids[anchor],
+                    urc_params[7].replace('"', ""),
+                    int(urc_params[8]),
+                    urc_str,
+                    tag,
+                    anchor,
+                )
+            )
+        except ValueError:
+            errors = errors + 1
+    names = UUDF_COLUMNS + ["urc", "tag", "anchor"]
+    if len(rows) == 0:
+        return {name: [] for name in names}, errors
+    return dict(zip(names, map(list, zip(*rows)))), errors
+
+
+def debug_json_fields(dbg_json):
+    # Raw fields of a debug line: id, rssi, est azimuth and elevation, est_raw
+    # azimuth and elevation, ch, a_id, ms and iq_b64. The ids are strings
+    # without quotes whichever way the line is read.
+    dbg_json = dbg_json.strip()
+    match = DEBUG_JSON_PATTERN.fullmatch(dbg_json)
+    if match is not None:
+        return match.groups()
     dbg_evt = json.loads(dbg_json)
-    instanceId = dbg_evt["id"].replace('"', "")
-    if len(instanceId) != 12:
+    return (
+        str(dbg_evt["id"]).replace('"', ""),
+        dbg_evt["rssi"],
+        dbg_evt["est"][0],
+        dbg_evt["est"][1],
+        dbg_evt["est_raw"][0],
+        dbg_evt["est_raw"][1],
+        dbg_evt["ch"],
+        str(dbg_evt["a_id"]).replace('"', ""),
+        dbg_evt["ms"],
+        dbg_evt["iq_b64"],
+    )
+
+
+def parse_debug_json(dbg_json):
+    # None for a line that is not a complete debug line, like the last line
+    # of a log cut off when collecting was stopped. Accepts the same lines as
+    # parse_debug_json_batch.
+    try:
+        fields = debug_json_fields(dbg_json)
+        if len(fields[0]) != 12:
+            return None
+        # Ids are interned, every sample of a tag shares one string
+        urc_dict = {
+            "instanceId": REGISTRY.tags.intern(fields[0]),
+            "rssi": int(fields[1]),
+            "azimuth": round(float(fields[2])),
+            "elevation": round(float(fields[3])),
+            "azimuth_raw": round(float(fields[4])),
+            "elevation_raw": round(float(fields[5])),
+            "rssi2": 0,  # N/A for now
+            "channel": int(fields[6]),
+            "anchor_id": REGISTRY.anchors.intern(fields[7]),
+            "user_defined_str": "",
+            "timestamp_ms": int(fields[8]),
+            "iqs": parse_iqs(fields[9]),
+        }
+    except (ValueError, KeyError, IndexError, TypeError):
         return None
-    urc_dict = {
-        "instanceId": dbg_evt["id"],
-        "rssi": int(dbg_evt["rssi"]),
-        "azimuth": round(float(dbg_evt["est"][0])),
-        "elevation": round(float(dbg_evt["est"][1])),
-        "azimuth_raw": round(float(dbg_evt["est_raw"][0])),
-        "elevation_raw": round(float(dbg_evt["est_raw"][1])),
-        "rssi2": 0,  # N/A for now
-        "channel": int(dbg_evt["ch"]),
-        "anchor_id": dbg_evt["a_id"].replace('"', ""),
-        "user_defined_str": "",
-        "timestamp_ms": int(dbg_evt["ms"]),
-        "iqs": parse_iqs(dbg_evt["iq_b64"]),
-    }
     return urc_dict
 
 
-def parse_iqs(self, iq_b64):
-    decoded = base64.b64decode(iq_b64)
-    decoded = list(
-        map(lambda val: str(val if val < 127 else (256 - val) * (-1)), decoded)
-    )
+def parse_iqs(iq_b64):
+    # The IQ samples of one packet as IQ_SAMPLES complex values. The bytes are
+    # signed I, Q pairs, as float32 pairs they are complex64 as is.
+    decoded = np.frombuffer(base64.b64decode(iq_b64), dtype=np.int8)
     # Make sure we got correct amount of I+Qs. 82 samples, I+Q for each sample.
-    if len(decoded) != 82 * 2:
-        raise Exception("Wrong amount of IQs")
-    decoded = ",".join(decoded)
-    return decoded
+    if len(decoded) != IQ_SAMPLES * 2:
+        raise ValueError("Wrong amount of IQs")
+    return decoded.astype(np.float32).view(np.complex64)
+
+
+def parse_debug_json_batch(dbg_jsons):
+    # Parses many raw IQ debug lines at once. Returns columns like
+    # parse_uudf_batch, with tag and anchor as arrays, plus azimuth_raw and
+    # elevation_raw, the IQs of all
+    # parsed lines as one (N, IQ_SAMPLES) complex64 array and the number of
+    # lines that could not be parsed.
+    rows = []
+    iq_bytes = []
+    errors = 0
+    for dbg_json in dbg_jsons:
+        try:
+            fields = debug_json_fields(dbg_json)
+            iq = base64.b64decode(fields[9])
+            if len(fields[0]) != 12 or len(iq) != IQ_SAMPLES * 2:
+                errors = errors + 1
+                continue
+        except (ValueError, KeyError, IndexError, TypeError):
+            errors = errors + 1
+            continue
+        rows.append(fields[:9])
+        iq_bytes.append(iq)
+    iqs = (
+        np.frombuffer(b"".join(iq_bytes), dtype=np.int8)
+        .astype(np.float32)
+        .view(np.complex64)
+        .reshape(len(rows), IQ_SAMPLES)
+    )
+    fields = list(zip(*rows)) if len(rows) > 0 else [[]] * 9
+    tags = [REGISTRY.tags.index(tag_id) for tag_id in fields[0]]
+    anchors = [REGISTRY.anchors.index(anchor_id) for anchor_id in fields[7]]
+    columns = {
+        "instanceId": [REGISTRY.tags.ids[tag] for tag in tags],
+        "rssi": np.array(fields[1], dtype=np.int64),
+        "azimuth": np.round(np.array(fields[2], dtype=np.float64)).astype(np.int64),
+        "elevation": np.round(np.array(fields[3], dtype=np.float64)).astype(np.int64),
+        "azimuth_raw": np.round(np.array(fields[4], dtype=np.float64)).astype(np.int64),
+        "elevation_raw": np.round(np.array(fields[5], dtype=np.float64)).astype(
+            np.int64
+        ),
+        "channel": np.array(fields[6], dtype=np.int64),
+        "anchor_id": [REGISTRY.anchors.ids[anchor] for anchor in anchors],
+        "timestamp_ms": np.array(fields[8], dtype=np.int64),
+        "tag": np.array(tags, dtype=np.int64),
+        "anchor": np.array(anchors, dtype=np.int64),
+    }
+    return columns, iqs, errors
@@ -0,0 +1,362 @@
+import json
+import time
+import numpy as np
+from aoa_controller import IQ_SAMPLES
+from sample_table import SampleTable, group_indices
+
+SPEED_OF_LIGHT = 299792458.0
+# The first IQ samples are taken in the reference period, 1 us apart on the
+# reference antenna, the rest in the switch slots.
+REFERENCE_SAMPLES = 8
+ESTIMATOR_METHODS = ["bartlett", "music"]
+# Directions are first searched on a grid with COARSE_STEP degrees between
+# points, then on REFINE_POINTS x REFINE_POINTS grids around the best point
+# so far with half the step every time, until the step is REFINE_STEP
+COARSE_STEP = 2.0
+REFINE_STEP = 0.25
+REFINE_POINTS = 5
+# Packets per matrix product, limits memory to about CHUNK_PACKETS times
+# the number of coarse grid points complex values
+CHUNK_PACKETS = 512
+# Angles are searched within [-MAX_ANGLE, MAX_ANGLE]
+MAX_ANGLE = 90
+
+
+def channel_frequency(channels):
+    # Center frequency in Hz of BLE channel indexes, 37-39 are the primary
+    # advertising channels
+    channels = np.asarray(channels, dtype=np.int64)
+    mhz = np.where(channels <= 10, 2404 + 2 * channels, 2428 + 2 * (channels - 11))
+    mhz = np.where(channels == 37, 2402, mhz)
+    mhz = np.where(channels == 38, 2426, mhz)
+    mhz = np.where(channels == 39, 2480, mhz)
+    return mhz * 1e6
+
+
+def directions(azimuth, elevation):
+    # x and y of the unit vectors pointing at (azimuth, elevation) in degrees,
+    # the antenna board is the xy plane and 0, 0 is straight out of it
+    azimuth = np.radians(azimuth)
+    elevation = np.radians(elevation)
+    return np.stack([np.sin(azimuth) * np.cos(elevation), np.sin(elevation)], -1)
+
+
+def reference_rotation(iqs):
+    # Phase rotation in radians per us over the reference period, from the
+    # carrier frequency offset between tag and anchor
+    reference = iqs[:, :REFERENCE_SAMPLES]
+    return np.angle(np.sum(reference[:, 1:] * np.conj(reference[:, :-1]), axis=1))
+
+
+class ArrayGeometry:
+    # Antenna elements of the board and the order they are switched in.
+    # positions are the (x, y) of every element in meters, x to the right and
+    # y up when looking at the front of the board. switch_pattern is the
+    # element every switch slot sample is taken on, repeated until all IQs
+    # are used. Sample times are in us after the first reference sample.
+    def __init__(
+        self,
+        positions,
+        switch_pattern,
+        reference_element=None,
+        first_slot_us=10,
+        slot_us=2,
+    ):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.switch_pattern = [int(element) for element in switch_pattern]
+        if reference_element is None:
+            reference_element = self.switch_pattern[0]
+        self.reference_element = int(reference_element)
+        self.first_slot_us = first_slot_us
+        self.slot_us = slot_us
+
+    @staticmethod
+    def rectangular(rows=4, columns=4, spacing=0.05):
+        # rows x columns elements spacing meters apart, switched row by row
+        y, x = np.mgrid[rows - 1 : -1 : -1, 0:columns] * spacing
+        positions = np.stack([x.ravel(), y.ravel()], -1)
+        positions = positions - positions.mean(axis=0)
+        return ArrayGeometry(positions, range(rows * columns))
+
+    @staticmethod
+    def load(file):
+        # Json with the arguments of ArrayGeometry, see options()
+        with open(file) as fp:
+            config = json.load(fp)
+        return ArrayGeometry(**config)
+
+    def options(self):
+        return {
+            "positions": self.positions.tolist(),
+            "switch_pattern": self.switch_pattern,
+            "reference_element": self.reference_element,
+            "first_slot_us": self.first_slot_us,
+            "slot_us": self.slot_us,
+        }
+
+    def num_elements(self):
+        return len(self.positions)
+
+    def slot_times(self):
+        # Time of every switch slot sample
+        slots = np.arange(IQ_SAMPLES - REFERENCE_SAMPLES)
+        return self.first_slot_us + slots * self.slot_us
+
+    def slot_elements(self):
+        # Element of every switch slot sample
+        pattern = np.array(self.switch_pattern)
+        return pattern[np.arange(IQ_SAMPLES - REFERENCE_SAMPLES) % len(pattern)]
+
+    def snapshots(self, iqs):
+        # CFO compensated snapshots, one per repetition of the switch pattern
+        # with the mean of the samples of every element, shape (packets,
+        # repetitions, elements). The CFO is first measured on the reference
+        # period, what is left of it after that shows as a phase drift between
+        # repetitions, which are a lot further apart.
+        times = self.slot_times()
+        slots = iqs[:, REFERENCE_SAMPLES:] * np.exp(
+            -1j * reference_rotation(iqs)[:, None] * times
+        ).astype(np.complex64)
+        pattern_length = len(self.switch_pattern)
+        repetitions = slots.shape[1] // pattern_length
+        slots = slots[:, : repetitions * pattern_length].reshape(
+            len(iqs), repetitions, pattern_length
+        )
+        if repetitions > 1:
+            drift = np.angle(
+                np.sum(slots[:, 1:] * np.conj(slots[:, :-1]), axis=(1, 2))
+            ) / (pattern_length * self.slot_us)
+            slot_times = times[: repetitions * pattern_length].reshape(repetitions, -1)
+            slots = slots * np.exp(-1j * drift[:, None, None] * slot_times).astype(
+                np.complex64
+            )
+        selection = np.zeros((pattern_length, self.num_elements()), np.complex64)
+        selection[np.arange(pattern_length), self.switch_pattern] = 1
+        return slots @ (selection / np.maximum(selection.real.sum(axis=0), 1))
+
+    def steering(self, azimuth, elevation, frequency):
+        # Response of every element to a signal from (azimuth, elevation),
+        # shape (..., elements) with the leading shape of azimuth/elevation
+        wavenumber = 2 * np.pi * np.asarray(frequency) / SPEED_OF_LIGHT
+        phase = directions(azimuth, elevation) @ self.positions.T
+        phase = (wavenumber[..., None] * phase).astype(np.float32)
+        return np.exp(1j * phase)
+
+    def synthesize_iqs(self, azimuth, elevation, channels, snr_db, rng):
+        # IQs of packets from (azimuth, elevation) as the module would sample
+        # them, with a random phase and carrier frequency offset per packet,
+        # white noise at snr_db and quantized to int8. Shape (packets, 82).
+        num_packets = len(channels)
+        frequency = channel_frequency(channels)
+        response = self.steering(azimuth, elevation, frequency)
+        times = np.r_[np.arange(REFERENCE_SAMPLES), self.slot_times()]
+        elements = np.r_[
+            [self.reference_element] * REFERENCE_SAMPLES, self.slot_elements()
+        ]
+        cfo = rng.uniform(-50e3, 50e3, num_packets) * 2 * np.pi * 1e-6
+        phase = rng.uniform(0, 2 * np.pi, num_packets)
+        iqs = response[:, elements] * np.exp(
+            1j * (phase[:, None] + cfo[:, None] * times)
+        )
+        noise_std = 10 ** (-np.asarray(snr_db, dtype=np.float64) / 20) / np.sqrt(2)
+        noise_std = np.broadcast_to(noise_std, (num_packets,))[:, None]
+        iqs = iqs + noise_std * (
+            rng.normal(size=iqs.shape) + 1j * rng.normal(size=iqs.shape)
+        )
+        iqs = np.clip(np.round(iqs * 60), -128, 127)
+        return iqs.astype(np.complex64)
+
+
+class AoAEstimator:
+    # Estimates azimuth and elevation from the IQs of many packets at once.
+    # The carrier frequency offset is measured on the reference period and
+    # removed, every repetition of the switch pattern is one snapshot of the
+    # array. bartlett picks the direction with the most power over all
+    # snapshots, music the direction best matching the signal subspace (the
+    # principal eigenvector of the snapshot covariance, one signal assumed).
+    def __init__(
+        self,
+        geometry,
+        method="music",
+        coarse_step=COARSE_STEP,
+        refine_step=REFINE_STEP,
+    ):
+        if method not in ESTIMATOR_METHODS:
+            raise ValueError("Unknown estimator method {}".format(method))
+        self.geometry = geometry
+        self.method = method
+        self.coarse_step = coarse_step
+        self.refine_step = refine_step
+        grid = np.arange(-MAX_ANGLE, MAX_ANGLE + coarse_step / 2, coarse_step)
+        azimuth, elevation = np.meshgrid(grid, grid, indexing="ij")
+        self.grid_azimuth = azimuth.ravel()
+        self.grid_elevation = elevation.ravel()
+        offsets = np.arange(REFINE_POINTS) - REFINE_POINTS // 2
+        azimuth, elevation = np.meshgrid(offsets, offsets, indexing="ij")
+        self.refine_azimuth = azimuth.ravel()
+        self.refine_elevation = elevation.ravel()
+        # Conjugated coarse grid steering matrices per channel, (elements, grid)
+        self.grid_steering = {}
+
+    def options(self):
+        return {
+            "method": self.method,
+            "coarse_step": self.coarse_step,
+            "refine_step": self.refine_step,
+            "geometry": self.geometry.options(),
+        }
+
+    def signal_vectors(self, iqs):
+        # The vectors the spectrum is computed from, (packets, vectors,
+        # elements), power in a direction is the sum of |a^H v|^2 over them
+        snapshots = self.geometry.snapshots(iqs)
+        if self.method == "bartlett":
+            return snapshots
+        covariance = np.conj(snapshots).transpose(0, 2, 1) @ snapshots
+        _, vectors = np.linalg.eigh(covariance)
+        return np.conj(vectors[:, None, :, -1])
+
+    def coarse_steering(self, channel):
+        if channel not in self.grid_steering:
+            self.grid_steering[channel] = np.conj(
+                self.geometry.steering(
+                    self.grid_azimuth,
+                    self.grid_elevation,
+                    np.full(len(self.grid_azimuth), channel_frequency(channel)),
+                )
+            ).T.copy()
+        return self.grid_steering[channel]
+
+    def estimate_channel(self, iqs, channel):
+        vectors = self.signal_vectors(iqs)
+        num_packets, num_vectors, num_elements = vectors.shape
+        # Coarse search, one matrix product for all packets
+        power = (
+            np.abs(vectors.reshape(-1, num_elements) @ self.coarse_steering(channel))
+            ** 2
+        )
+        power = power.reshape(num_packets, num_vectors, -1).sum(axis=1)
+        best = np.argmax(power, axis=1)
+        azimuth = self.grid_azimuth[best]
+        elevation = self.grid_elevation[best]
+        # Refined search, small grids around the best direction per packet
+        frequency = channel_frequency(channel)
+        rows = np.arange(num_packets)
+        step = self.coarse_step
+        while step > self.refine_step:
+            step = step / 2
+            local_azimuth = np.clip(
+                azimuth[:, None] + self.refine_azimuth * step, -MAX_ANGLE, MAX_ANGLE
+            )
+            local_elevation = np.clip(
+                elevation[:, None] + self.refine_elevation * step,
+                -MAX_ANGLE,
+                MAX_ANGLE,
+            )
+            steering = self.geometry.steering(
+                local_azimuth, local_elevation, np.full(local_azimuth.shape, frequency)
+            )
+            power = np.abs(vectors @ np.conj(steering).transpose(0, 2, 1)) ** 2
+            best = np.argmax(power.sum(axis=1), axis=1)
+            azimuth = local_azimuth[rows, best]
+            elevation = local_elevation[rows, best]
+        return azimuth, elevation
+
+    def estimate(self, iqs, channels):
+        # Azimuth and elevation in degrees of every packet, iqs is (packets,
+        # 82) complex64 and channels the BLE channel of every packet
+        channels = np.asarray(channels)
+        azimuth = np.zeros(len(iqs))
+        elevation = np.zeros(len(iqs))
+        keys, groups = group_indices(channels)
+        for (channel,), indexes in zip(keys, groups):
+            for start in range(0, len(indexes), CHUNK_PACKETS):
+                chunk = indexes[start : start + CHUNK_PACKETS]
+                azimuth[chunk], elevation[chunk] = self.estimate_channel(
+                    iqs[chunk], int(channel)
+                )
+        return azimuth, elevation
+
+    def name(self):
+        return self.method
+
+
+class StreamingEstimator:
+    # Re-estimates the angles of live samples in batches, so the estimation
+    # still runs over many packets at once. add() returns the samples that
+    # are done, with the host estimate in azimuth/elevation and the module
+    # estimate moved to module_azimuth/module_elevation. A batch is estimated
+    # when batch_size samples are waiting or the oldest waited max_wait
+    # seconds. Samples without IQs are passed on right away.
+    def __init__(self, estimator, batch_size=256, max_wait=0.1):
+        self.estimator = estimator
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.iqs = np.empty((batch_size, IQ_SAMPLES), dtype=np.complex64)
+        self.channels = np.empty(batch_size, dtype=np.int64)
+        self.pending = []
+        self.oldest = 0
+
+    def add(self, urc_dict):
+        if urc_dict.get("iqs") is None:
+            return [urc_dict]
+        if len(self.pending) == 0:
+            self.oldest = time.time()
+        self.iqs[len(self.pending)] = urc_dict["iqs"]
+        self.channels[len(self.pending)] = urc_dict["channel"]
+        self.pending.append(urc_dict)
+        if (
+            len(self.pending) == self.batch_size
+            or time.time() - self.oldest > self.max_wait
+        ):
+            return self.flush()
+        return []
+
+    def flush(self):
+        pending = self.pending
+        if len(pending) == 0:
+            return []
+        azimuth, elevation = self.estimator.estimate(
+            self.iqs[: len(pending)], self.channels[: len(pending)]
+        )
+        for urc_dict, host_azimuth, host_elevation in zip(
+            pending, np.round(azimuth).astype(int), np.round(elevation).astype(int)
+        ):
+            urc_dict["module_azimuth"] = urc_dict["azimuth"]
+            urc_dict["module_elevation"] = urc_dict["elevation"]
+            urc_dict["azimuth"] = int(host_azimuth)
+            urc_dict["elevation"] = int(host_elevation)
+        self.pending = []
+        return pending
+
+
+def estimate_table(samples, estimator, swap_angles=False):
+    # Copy of a sample table with the angles re-estimated from the IQs,
+    # samples without IQs are left out
+    if samples.iqs is None:
+        rows = np.zeros(0, dtype=np.int64)
+        iqs = np.zeros((0, IQ_SAMPLES), dtype=np.complex64)
+    else:
+        rows = np.flatnonzero(~np.isnan(samples.iqs[:, 0]))
+        iqs = samples.iqs[rows]
+    azimuth, elevation = estimator.estimate(iqs, samples["channel"][rows])
+    if swap_angles:
+        azimuth, elevation = elevation, azimuth
+    columns = {name: column[rows] for name, column in samples.columns.items()}
+    columns["azimuth"] = np.round(azimuth).astype(columns["azimuth"].dtype)
+    columns["elevation"] = np.round(elevation).astype(columns["elevation"].dtype)
+    return SampleTable(
+        samples.positions, samples.tag_ids, columns, iqs, samples.anchor_ids
+    )
+
+
+def load_estimator(method, array_file=None):
+    # None for the module estimate, otherwise an AoAEstimator for the array
+    # in array_file or the default 4x4 array
+    if method is None or method == "module":
+        return None
+    if array_file is None:
+        geometry = ArrayGeometry.rectangular()
+    else:
+        geometry = ArrayGeometry.load(array_file)
+    return AoAEstimator(geometry, method)
@@ -0,0 +1,102 @@
+import argparse, os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from aoa_estimator import (
+    ESTIMATOR_METHODS,
+    AoAEstimator,
+    ArrayGeometry,
+    StreamingEstimator,
+)
+from sample_sources import SECONDARY_CHANNELS
+from aoa_controller import IQ_SAMPLES
+
+
+def streaming_rate(estimator, iqs, channels, batch_size):
+    # Samples/s through StreamingEstimator, one urc dict at a time like
+    # collect_angles adds them
+    streaming = StreamingEstimator(estimator, batch_size, max_wait=1e9)
+    urc_dicts = [
+        {"azimuth": 0, "elevation": 0, "channel": int(channel), "iqs": iq}
+        for channel, iq in zip(channels, iqs)
+    ]
+    done = 0
+    start = time.perf_counter()
+    for urc_dict in urc_dicts:
+        done = done + len(streaming.add(urc_dict))
+    done = done + len(streaming.flush())
+    return done / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks speed and accuracy of the host AoA estimators on simulated IQs"
+    )
+    parser.add_argument(
+        "--packets",
+        dest="packets",
+        default=10000,
+        type=int,
+        help="Packets per estimator and SNR.",
+    )
+    parser.add_argument(
+        "--snrs",
+        dest="snrs",
+        nargs="+",
+        default=[10, 20, 30],
+        type=float,
+        help="SNRs in dB of the simulated IQs.",
+    )
+    parser.add_argument(
+        "--array",
+        dest="array",
+        default=None,
+        help="Json file with the antenna array geometry, default a 4x4 array.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        dest="batch_size",
+        default=256,
+        type=int,
+        help="Batch size of the streaming estimator.",
+    )
+    args = parser.parse_args()
+
+    geometry = ArrayGeometry.rectangular()
+    if args.array is not None:
+        geometry = ArrayGeometry.load(args.array)
+    rng = np.random.default_rng(0)
+    azimuth = rng.uniform(-60, 60, args.packets)
+    elevation = rng.uniform(-60, 60, args.packets)
+    channels = rng.integers(0, SECONDARY_CHANNELS, args.packets)
+
+    print(
+        "{:<10}{:>6}{:>14}{:>14}{:>12}{:>12}".format(
+            "method", "snr", "packets/s", "streaming/s", "median err", "p90 err"
+        )
+    )
+    for method in ESTIMATOR_METHODS:
+        estimator = AoAEstimator(geometry, method)
+        # Steering matrices of every channel are made on first use
+        estimator.estimate(
+            np.zeros((SECONDARY_CHANNELS, IQ_SAMPLES), dtype=np.complex64),
+            np.arange(SECONDARY_CHANNELS),
+        )
+        for snr in args.snrs:
+            iqs = geometry.synthesize_iqs(azimuth, elevation, channels, snr, rng)
+            start = time.perf_counter()
+            estimated_azimuth, estimated_elevation = estimator.estimate(iqs, channels)
+            rate = args.packets / (time.perf_counter() - start)
+            errors = np.hypot(
+                estimated_azimuth - azimuth, estimated_elevation - elevation
+            )
+            print(
+                "{:<10}{:>6g}{:>14.0f}{:>14.0f}{:>12.2f}{:>12.2f}".format(
+                    method,
+                    snr,
+                    rate,
+                    streaming_rate(estimator, iqs, channels, args.batch_size),
+                    np.median(errors),
+                    np.percentile(errors, 90),
+                )
+            )
@@ -0,0 +1,101 @@
+import argparse, os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from sample_fusion import WindowFuser
+
+
+def synthetic_batches(num_anchors, num_tags, rate, duration, batch_rate, rng):
+    # Batches as read by udp_plotter, from anchors with their own clock offset
+    # and drift and a random network delay. Yields the batch, the host time it
+    # is read at and the true sample times.
+    offsets = rng.uniform(-1000, 1000, num_anchors)
+    drifts = rng.uniform(-50e-6, 50e-6, num_anchors)
+    host_start = time.time()
+    batch_size = int(rate / batch_rate)
+    tag_ids = np.array(["CCF9578E{:04X}".format(tag) for tag in range(num_tags)])
+    anchor_ids = np.array(["CD84C98B{:04X}".format(a) for a in range(num_anchors)])
+    for step in range(int(duration * batch_rate)):
+        true_time = host_start + (step + rng.uniform(0, 1, batch_size)) / batch_rate
+        anchors = rng.integers(0, num_anchors, batch_size)
+        anchor_time = (true_time - host_start - offsets[anchors]) * (
+            1 + drifts[anchors]
+        ) + 5000
+        delay = rng.exponential(0.005, batch_size) + 0.001
+        batch = {
+            "anchor_id": anchor_ids[anchors],
+            "instanceId": tag_ids[rng.integers(0, num_tags, batch_size)],
+            "timestamp_ms": np.round(anchor_time * 1000).astype(np.int64),
+            "host_time": true_time + delay,
+            "azimuth": rng.integers(-90, 90, batch_size),
+            "elevation": rng.integers(-90, 90, batch_size),
+        }
+        yield batch, host_start + (step + 1) / batch_rate, true_time, drifts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks clock alignment and windowing of sample_fusion"
+    )
+    parser.add_argument("--anchors", dest="anchors", default=8, type=int)
+    parser.add_argument("--tags", dest="tags", default=20, type=int)
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        default=8000,
+        type=int,
+        help="Samples per second from all anchors together.",
+    )
+    parser.add_argument(
+        "--duration",
+        dest="duration",
+        default=120,
+        type=float,
+        help="Seconds of simulated samples.",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    fuser = WindowFuser()
+    busy = 0
+    num_samples = 0
+    num_windows = 0
+    errors = []
+    first_time = None
+    for batch, now, true_time, drifts in synthetic_batches(
+        args.anchors, args.tags, args.rate, args.duration, 30, rng
+    ):
+        start = time.perf_counter()
+        fuser.add(batch)
+        num_windows = num_windows + len(fuser.pop_windows(now))
+        busy = busy + time.perf_counter() - start
+        num_samples = num_samples + len(true_time)
+        if first_time is None:
+            first_time = now
+        if now - first_time > args.duration / 2:
+            aligned = fuser.clocks.to_host_time(
+                batch["anchor_id"], batch["timestamp_ms"]
+            )
+            errors.append(np.abs(aligned - true_time))
+
+    errors = np.concatenate(errors) * 1000
+    drift_errors = [
+        abs(fuser.clocks.get_clock("CD84C98B{:04X}".format(a))[1] - drifts[a] * 1e6)
+        for a in range(args.anchors)
+    ]
+    print(
+        "{} samples in {} windows, {:.0f} samples/s ({:.1f}% of one core at {} samples/s)".format(
+            num_samples,
+            num_windows,
+            num_samples / busy,
+            busy / args.duration * 100,
+            args.rate,
+        )
+    )
+    print(
+        "Alignment error in the second half: mean {:.2f} ms, p99 {:.2f} ms".format(
+            np.mean(errors), np.percentile(errors, 99)
+        )
+    )
+    print("Max drift error: {:.2f} ppm".format(max(drift_errors)))
+    print("Late samples: {}".format(fuser.late_samples))
@@ -0,0 +1,153 @@
+import argparse, os, sys, tempfile, threading, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from sample_sources import FileReplaySource, SimulatorSource
+from aoa_controller import AoAController
+from analyzer import AoATester
+from collect_logs import AngleCollector
+from udp_plotter import UDPPlotter
+
+
+def simulated_session(folder, num_anchors, num_tags, rate, duration):
+    # One log file per anchor, like udp_plotter writes them
+    source = SimulatorSource(num_tags, num_anchors, rate)
+    lines = source.generate(int(duration * rate / (num_anchors * num_tags)))
+    log_files = []
+    for anchor_id in source.anchor_ids:
+        log_file = os.path.join(folder, "{}.log".format(anchor_id))
+        with open(log_file, "w") as fp:
+            fp.writelines(line + "\n" for line in lines if anchor_id in line)
+        log_files.append(log_file)
+    return log_files
+
+
+def replay_parse(log_files, duration):
+    controller = AoAController(None, None, None, FileReplaySource(log_files, 0, True))
+    controller.start()
+    count = 0
+    start = time.time()
+    while time.time() - start < duration:
+        if controller.wait_for_aoa_event()[1] is not None:
+            count = count + 1
+    return count / (time.time() - start)
+
+
+def replay_collect_angles(log_files, duration, do_plot):
+    tester = AoATester(None, None, None, False, FileReplaySource(log_files, 0, True))
+    tester.start()
+    start = time.time()
+    tester.collect_angles(duration * 1000, do_plot, 0, 0)
+    parsed = tester.collected_data[(0, 0)][1]
+    return sum(len(samples) for samples in parsed.values()) / (time.time() - start)
+
+
+def replay_angle_collector(log_files, duration):
+    # One collector thread per log file, like one per antenna
+    sources = [FileReplaySource([log_file], 0, True) for log_file in log_files]
+    collector = AngleCollector(
+        [None] * len(log_files), None, None, False, sources=sources
+    )
+    collector.start()
+    start = time.time()
+    collector.collect_angles(duration * 1000, False, 0, 0)
+    count = 0
+    for collected_data in collector.collected_data:
+        parsed = collected_data[(0, 0)][1]
+        count = count + sum(len(samples) for samples in parsed.values())
+    return count / (time.time() - start)
+
+
+def replay_udp_plotter(log_files, duration):
+    plotter = UDPPlotter(
+        [("127.0.0.1", 0)],
+        None,
+        len(log_files),
+        replay_source=FileReplaySource(log_files, 0, True),
+    )
+    timer = threading.Timer(duration, setattr, (plotter, "running", False))
+    timer.start()
+    start = time.time()
+    plotter.run()
+    elapsed = time.time() - start
+    plotter.close()
+    # Samples that made it into the plot buffers, not the ones still queued
+    return int(np.sum(plotter.buffers.counts)) / elapsed
+
+
+COMPONENTS = {
+    "parse": lambda log_files, duration: replay_parse(log_files, duration),
+    "collect_angles": lambda log_files, duration: replay_collect_angles(
+        log_files, duration, False
+    ),
+    "collect_angles_plot": lambda log_files, duration: replay_collect_angles(
+        log_files, duration, True
+    ),
+    "angle_collector": replay_angle_collector,
+    "udp_plotter": replay_udp_plotter,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays logs as fast as possible through the live components and reports the rate each sustains"
+    )
+    parser.add_argument(
+        "--logs",
+        dest="logs",
+        nargs="+",
+        default=None,
+        help="Log files to replay, a simulated session is used if not given.",
+    )
+    parser.add_argument("--anchors", dest="anchors", default=4, type=int)
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        default=5,
+        type=int,
+        help="Tags in the simulated session, the LivePlot of collect_angles fits at most 5.",
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        default=2000,
+        type=int,
+        help="Samples per second of the simulated session.",
+    )
+    parser.add_argument(
+        "--duration",
+        dest="duration",
+        default=5,
+        type=float,
+        help="Seconds every component is replayed for.",
+    )
+    parser.add_argument(
+        "--components",
+        dest="components",
+        nargs="+",
+        default=list(COMPONENTS),
+        choices=list(COMPONENTS),
+    )
+    args = parser.parse_args()
+
+    # Simulated logs are removed when done
+    with tempfile.TemporaryDirectory() as folder:
+        log_files = args.logs
+        if log_files is None:
+            log_files = simulated_session(
+                folder, args.anchors, args.tags, args.rate, 4 * args.duration
+            )
+        session = FileReplaySource(log_files)
+        recorded_rate = len(session.lines) / max(session.duration(), 1e-3)
+        print(
+            "{} lines over {:.1f} s as recorded, {:.0f} lines/s".format(
+                len(session.lines), session.duration(), recorded_rate
+            )
+        )
+        for name in args.components:
+            rate = COMPONENTS[name](log_files, args.duration)
+            print(
+                "{:<20} {:>10.0f} samples/s  max replay speed {:.2f}x".format(
+                    name, rate, rate / recorded_rate
+                )
+            )
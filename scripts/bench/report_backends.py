@@ -0,0 +1,85 @@
+import argparse, os, sys, time
+import tempfile
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from analyzer import AoATester
+
+TAGS = ["CCF9578E0D8A", "CCF9578E0D8B", "CCF9578E0D8C"]
+
+
+def synthetic_log(gt_azimuth, gt_elevation, num_samples, rng):
+    lines = []
+    for i in range(num_samples):
+        lines.append(
+            '+UUDF:{},{},{},{},{},{},"CD84C98B935D","",{},{}'.format(
+                TAGS[i % len(TAGS)],
+                int(rng.normal(-55, 5)),
+                int(rng.normal(gt_azimuth, 5)),
+                int(rng.normal(gt_elevation, 5)),
+                int(rng.normal(-60, 5)),
+                37 + i % 3,
+                i * 20,
+                i,
+            )
+        )
+    return lines
+
+
+def run_backend(vector_report, positions, num_samples, out_dir):
+    rng = np.random.default_rng(0)
+    tester = AoATester(None, None, None, False, None, True, vector_report=vector_report)
+    for gt_azimuth, gt_elevation in positions:
+        tester.analyze_logs(
+            synthetic_log(gt_azimuth, gt_elevation, num_samples, rng),
+            False,
+            gt_azimuth,
+            gt_elevation,
+        )
+    start = time.perf_counter()
+    tester.create_plots(show_plots=False, summary_only=False)
+    tester.create_plots(show_plots=False, summary_only=True, distribution_plot=True)
+    plots_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    name = tester.create_pdf_report(
+        os.path.join(out_dir, "vector" if vector_report else "raster")
+    )
+    report_time = time.perf_counter() - start
+    return len(tester.report), plots_time, report_time, os.path.getsize(name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare size and speed of the raster and vector PDF reports"
+    )
+    parser.add_argument(
+        "--samples",
+        dest="samples",
+        default=300,
+        type=int,
+        help="Number of samples per position.",
+    )
+    args = parser.parse_args()
+
+    # Standard 5x5 sweep, -40 to 40 in 20 degree steps
+    positions = [(az, el) for az in range(-40, 41, 20) for el in range(-40, 41, 20)]
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        for vector_report in [False, True]:
+            pages, plots_time, report_time, size = run_backend(
+                vector_report, positions, args.samples, out_dir
+            )
+            print(
+                "{}: {} pages, plots {:.2f} s, pdf {:.2f} s, total {:.2f} s, {:.0f} kB".format(
+                    "vector" if vector_report else "raster",
+                    pages,
+                    plots_time,
+                    report_time,
+                    plots_time + report_time,
+                    size / 1024,
+                )
+            )
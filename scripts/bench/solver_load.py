@@ -0,0 +1,113 @@
+import argparse, os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from position_solver import PositionSolver, AlphaBetaFilter, rotation_matrix
+
+
+def ceiling_anchors(num_anchors, room_size, height, rng):
+    # Anchors spread over the ceiling, facing down
+    poses = {}
+    for i in range(num_anchors):
+        position = np.array(
+            [rng.uniform(0, room_size), rng.uniform(0, room_size), height]
+        )
+        poses["CD84C98B{:04X}".format(i)] = (
+            position,
+            rotation_matrix(rng.uniform(0, 360), 90, 0),
+        )
+    return poses
+
+
+def synthetic_window(poses, tag_positions, samples_per_pair, noise, rng):
+    # Angles every anchor measures to every tag, with gaussian noise in degrees
+    anchor_ids = []
+    tag_ids = []
+    azimuth = []
+    elevation = []
+    for anchor_id, (position, rotation) in poses.items():
+        directions = (tag_positions - position) @ rotation
+        directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        true_azimuth = np.degrees(np.arctan2(directions[:, 1], directions[:, 0]))
+        true_elevation = np.degrees(np.arcsin(directions[:, 2]))
+        for tag, (az, el) in enumerate(zip(true_azimuth, true_elevation)):
+            anchor_ids.extend([anchor_id] * samples_per_pair)
+            tag_ids.extend(["CCF9578E{:04X}".format(tag)] * samples_per_pair)
+            azimuth.extend(np.round(rng.normal(az, noise, samples_per_pair)))
+            elevation.extend(np.round(rng.normal(el, noise, samples_per_pair)))
+    return anchor_ids, tag_ids, np.array(azimuth), np.array(elevation)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks latency, throughput and accuracy of the position solver"
+    )
+    parser.add_argument("--anchors", dest="anchors", default=8, type=int)
+    parser.add_argument("--tags", dest="tags", default=20, type=int)
+    parser.add_argument(
+        "--samples",
+        dest="samples",
+        default=25,
+        type=int,
+        help="Samples per anchor and tag in one window.",
+    )
+    parser.add_argument("--noise", dest="noise", default=5.0, type=float)
+    parser.add_argument("--windows", dest="windows", default=200, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    poses = ceiling_anchors(args.anchors, 10, 3, rng)
+    solver = PositionSolver(poses)
+    position_filter = AlphaBetaFilter()
+    tag_positions = np.column_stack(
+        (rng.uniform(1, 9, (args.tags, 2)), np.full(args.tags, 1.0))
+    )
+    tag_names = ["CCF9578E{:04X}".format(tag) for tag in range(args.tags)]
+    windows = [
+        synthetic_window(poses, tag_positions, args.samples, args.noise, rng)
+        for i in range(args.windows)
+    ]
+
+    latencies = []
+    errors = []
+    filtered_errors = []
+    for i, window in enumerate(windows):
+        start = time.perf_counter()
+        positions = solver.solve_window(*window)
+        latencies.append(time.perf_counter() - start)
+        for tag, name in enumerate(tag_names):
+            if name not in positions:
+                continue
+            position = positions[name][0]
+            filtered = position_filter.update(name, position, i * 0.5)
+            errors.append(np.linalg.norm(position - tag_positions[tag]))
+            filtered_errors.append(np.linalg.norm(filtered - tag_positions[tag]))
+
+    latencies = np.array(latencies) * 1000
+    samples_per_window = len(windows[0][0])
+    print(
+        "{} anchors, {} tags, {} samples per window".format(
+            args.anchors, args.tags, samples_per_window
+        )
+    )
+    print(
+        "Latency per update: median {:.2f} ms, p99 {:.2f} ms".format(
+            np.median(latencies), np.percentile(latencies, 99)
+        )
+    )
+    print(
+        "Throughput: {:.0f} samples/s, {:.0f} updates/s".format(
+            samples_per_window / np.mean(latencies) * 1000,
+            1000 / np.mean(latencies),
+        )
+    )
+    print(
+        "Position error: mean {:.3f} m, p90 {:.3f} m".format(
+            np.mean(errors), np.percentile(errors, 90)
+        )
+    )
+    print(
+        "Filtered position error: mean {:.3f} m, p90 {:.3f} m".format(
+            np.mean(filtered_errors), np.percentile(filtered_errors, 90)
+        )
+    )
@@ -0,0 +1,549 @@
+import argparse, base64, json, os, platform, sys, tempfile, threading, time, tty
+from datetime import datetime
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from serial_helpers import open_port, close_port, read_line
+from aoa_controller import IQ_SAMPLES, parse_event, parse_debug_json_batch
+from sample_sources import SimulatorSource
+from analyzer import AoATester
+from collect_logs import AngleCollector
+from live_plot import LivePlot
+from report_backends import synthetic_log
+from aoa_estimator import ArrayGeometry
+from iq_features import iq_features
+from sample_filters import FilterChain
+from rssi_errors import rssi_errors
+from angular_error import great_circle_errors
+from calibration import Calibration
+from sample_table import COLUMNS, SampleTable
+
+# Reference results of every host, by host name. A run is compared against
+# the results of the host it runs on, a host without any is not compared.
+# Written with --update_baseline.
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "baseline.json"
+)
+# A throughput metric is a regression when it drops by more than this
+# fraction of the baseline, a time when it grows by more than it
+DEFAULT_TOLERANCE = 0.2
+# Sample counts create_plots is timed with, spread over a 5x5 sweep
+PLOT_SAMPLE_COUNTS = [1000, 10000, 100000]
+# Packets of the IQ sweep iq_features is timed with, over a 9x9 sweep
+IQ_SWEEP_PACKETS = 100000
+# Samples the per channel, per RSSI and per azimuth and tilt statistics are
+# timed with
+SWEEP_SAMPLES = 1000000
+# Samples the great circle errors are timed with
+ANGULAR_SAMPLES = 10000000
+# Filter chains timed per sample, one metric each
+FILTER_SPECS = {
+    "median": "median:5",
+    "hampel": "hampel:7:3",
+    "ema": "ema:0.3",
+    "kalman": "kalman:0.5:3",
+    "chain": "hampel:7:3,median:5,kalman:0.5:3",
+}
+# Sweeps create_pdf_report is timed with, one page per position
+REPORT_SWEEPS = [3, 5, 7]
+
+
+class PtyModule:
+    # One end of a pseudo terminal pair acting like a u-connectLocate module.
+    # It answers OK to every AT command and streams the given lines over and
+    # over, the other end is opened like any serial port.
+    def __init__(self, lines, chunk_lines=64):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        data = [line.encode() + b"\r\n" for line in lines]
+        self.chunks = [
+            b"".join(data[i : i + chunk_lines])
+            for i in range(0, len(data), chunk_lines)
+        ]
+        # Chunks and responses are written whole, never inside each other
+        self.write_lock = threading.Lock()
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.stream),
+            threading.Thread(target=self.respond),
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stream(self):
+        while self.running:
+            for chunk in self.chunks:
+                with self.write_lock:
+                    os.write(self.master, chunk)
+
+    def respond(self):
+        while self.running:
+            if b"AT" in os.read(self.master, 1024):
+                with self.write_lock:
+                    os.write(self.master, b"\r\nOK\r\n")
+
+    def close(self):
+        # The threads are daemons blocked in os.read/write, they end with the
+        # process
+        self.running = False
+
+
+def simulated_lines(num_tags, num_lines):
+    source = SimulatorSource(num_tags, 1, 1000)
+    return source.generate(num_lines // num_tags)
+
+
+def bench_pty_parse(duration):
+    module = PtyModule(simulated_lines(3, 10000))
+    ser = open_port(module.port, 115200, False)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if parse_event(read_line(ser)) is not None:
+            count = count + 1
+    elapsed = time.perf_counter() - start
+    close_port(ser)
+    module.close()
+    return {"pty_read_parse": (count / elapsed, "lines/s", True)}
+
+
+def debug_lines(num_lines):
+    # Raw IQ debug lines as the module writes them, random IQs
+    rng = np.random.default_rng(0)
+    iqs = rng.integers(-128, 128, (num_lines, IQ_SAMPLES * 2)).astype(np.int8)
+    return [
+        '{{"id":"CCF9578E0D8A","rssi":-55,"est":[12.5,-3.25],"est_raw":[11.0,-4.0],'
+        '"ch":{},"a_id":"CD84C98B935D","ms":{},"iq_b64":"{}"}}'.format(
+            i % 40, i * 20, base64.b64encode(iqs[i].tobytes()).decode()
+        )
+        for i in range(num_lines)
+    ]
+
+
+def bench_iq_parse(duration):
+    lines = debug_lines(10000)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for line in lines:
+            parse_event(line)
+        count = count + len(lines)
+    line_rate = count / (time.perf_counter() - start)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        count = count + len(parse_debug_json_batch(lines)[1])
+    batch_rate = count / (time.perf_counter() - start)
+    return {
+        "iq_parse_event": (line_rate, "lines/s", True),
+        "iq_parse_batch": (batch_rate, "lines/s", True),
+    }
+
+
+def bench_iq_features(duration):
+    geometry = ArrayGeometry.rectangular()
+    rng = np.random.default_rng(0)
+    positions = [(a, e) for a in range(-40, 41, 10) for e in range(-40, 41, 10)]
+    position = rng.integers(0, len(positions), IQ_SWEEP_PACKETS)
+    channels = rng.integers(0, 37, IQ_SWEEP_PACKETS)
+    gt = np.array(positions)[position]
+    columns = {
+        name: np.zeros(IQ_SWEEP_PACKETS, dtype=dtype) for name, dtype in COLUMNS.items()
+    }
+    columns["position"] = position.astype(np.int32)
+    columns["channel"] = channels.astype(np.int8)
+    samples = SampleTable(
+        positions,
+        ["CCF9578E0D8A"],
+        columns,
+        geometry.synthesize_iqs(gt[:, 0], gt[:, 1], channels, 20, rng),
+    )
+    errors = np.zeros(IQ_SWEEP_PACKETS)
+    start = time.perf_counter()
+    iq_features(samples, geometry, errors, errors)
+    return {
+        "iq_features_{}_packets".format(IQ_SWEEP_PACKETS): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+    }
+
+
+def sweep_table(num_samples, step=20, max_angle=40):
+    # Samples of 10 tags on a grid of positions step degrees apart up to
+    # max_angle, on all 37 secondary advertising channels with random RSSIs,
+    # and random angle errors
+    rng = np.random.default_rng(0)
+    angles = range(-max_angle, max_angle + 1, step)
+    positions = [(a, e) for a in angles for e in angles]
+    columns = {
+        name: np.zeros(num_samples, dtype=dtype) for name, dtype in COLUMNS.items()
+    }
+    columns["tag"] = rng.integers(0, 10, num_samples).astype(np.int32)
+    columns["position"] = rng.integers(0, len(positions), num_samples).astype(np.int32)
+    columns["channel"] = rng.integers(0, 37, num_samples).astype(np.int8)
+    columns["rssi"] = rng.integers(-90, -40, num_samples).astype(np.int16)
+    columns["rssi2"] = rng.integers(-90, -40, num_samples).astype(np.int16)
+    samples = SampleTable(
+        positions, ["CCF9578E0D8{}".format(i) for i in range(10)], columns
+    )
+    return samples, rng.integers(-20, 20, num_samples).astype(np.int32)
+
+
+def bench_channel_statistics(duration):
+    samples, errors = sweep_table(SWEEP_SAMPLES)
+    tester = AoATester(None, None, None, analyzer_only=True)
+    start = time.perf_counter()
+    tester.compute_channel_statistics(samples, errors, errors)
+    return {
+        "channel_statistics_{}_samples".format(SWEEP_SAMPLES): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+    }
+
+
+def bench_rssi_errors(duration):
+    samples, errors = sweep_table(SWEEP_SAMPLES)
+    start = time.perf_counter()
+    rssi_errors(samples, errors, errors)
+    return {
+        "rssi_errors_{}_samples".format(SWEEP_SAMPLES): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+    }
+
+
+def bench_grid_statistics(duration):
+    # 5 degree steps over +-80, 1089 positions
+    samples, errors = sweep_table(SWEEP_SAMPLES, 5, 80)
+    tester = AoATester(None, None, None, analyzer_only=True)
+    start = time.perf_counter()
+    tester.compute_grid_statistics(samples, errors, errors)
+    return {
+        "grid_statistics_{}_samples".format(SWEEP_SAMPLES): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+    }
+
+
+def bench_angular_errors(duration):
+    rng = np.random.default_rng(0)
+    angles = [rng.integers(-90, 91, ANGULAR_SAMPLES).astype(np.int16) for _ in range(4)]
+    start = time.perf_counter()
+    great_circle_errors(*angles)
+    return {
+        "angular_errors_{}_samples".format(ANGULAR_SAMPLES): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+    }
+
+
+def bench_calibration(duration):
+    # Fit on the 1089 positions of a 5 degree sweep over +-80 and correct
+    # every sample
+    samples, errors = sweep_table(SWEEP_SAMPLES, 5, 80)
+    samples.columns["azimuth"] = (samples.gt_azimuth() + errors).astype(np.int16)
+    samples.columns["elevation"] = (samples.gt_elevation() + errors).astype(np.int16)
+    start = time.perf_counter()
+    calibration = Calibration.fit_table(samples)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    calibration.apply(samples)
+    return {
+        "calibration_fit_{}_samples".format(SWEEP_SAMPLES): (fit_time, "s", False),
+        "calibration_apply_{}_samples".format(SWEEP_SAMPLES): (
+            time.perf_counter() - start,
+            "s",
+            False,
+        ),
+    }
+
+
+def bench_filters(duration):
+    # Cost per sample of FilterChain.apply on three tags, at 1000 samples/s
+    # 1 us/sample is 0.1% of a core
+    rng = np.random.default_rng(0)
+    urc_dicts = [
+        {
+            "instanceId": "CCF9578E0D8{}".format(i % 3),
+            "anchor_id": "CD84C98B935D",
+            "azimuth": int(azimuth),
+            "elevation": int(elevation),
+        }
+        for i, (azimuth, elevation) in enumerate(rng.normal(0, 5, (10000, 2)))
+    ]
+    results = {}
+    for name, spec in FILTER_SPECS.items():
+        chain = FilterChain.from_spec(spec)
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration / len(FILTER_SPECS):
+            for urc_dict in urc_dicts:
+                chain.apply(urc_dict)
+            count = count + len(urc_dicts)
+        elapsed = time.perf_counter() - start
+        results["filter_" + name] = (elapsed / count * 1e6, "us/sample", False)
+    return results
+
+
+def collected_samples(collected_data):
+    return sum(len(samples) for samples in collected_data[(0, 0)][1].values())
+
+
+def bench_collect_angles(duration):
+    results = {}
+    module = PtyModule(simulated_lines(3, 10000))
+    for name, tester in [
+        ("collect_angles_pty", AoATester(module.port, 115200, False)),
+        (
+            "collect_angles_sim",
+            AoATester(None, None, None, False, SimulatorSource(3, 1, 0)),
+        ),
+    ]:
+        tester.start()
+        start = time.perf_counter()
+        tester.collect_angles(duration * 1000, False, 0, 0)
+        elapsed = time.perf_counter() - start
+        tester.locate_controller.stop()
+        results[name] = (
+            collected_samples(tester.collected_data) / elapsed,
+            "samples/s",
+            True,
+        )
+    module.close()
+    return results
+
+
+def bench_angle_collector(duration):
+    sources = [SimulatorSource(3, 1, 0, seed=i) for i in range(2)]
+    collector = AngleCollector([None, None], None, None, False, sources=sources)
+    collector.start()
+    start = time.perf_counter()
+    collector.collect_angles(duration * 1000, False, 0, 0)
+    elapsed = time.perf_counter() - start
+    count = sum(collected_samples(data) for data in collector.collected_data)
+    return {"angle_collector_sim": (count / elapsed, "samples/s", True)}
+
+
+def bench_live_plot(duration):
+    # Every 5th sample of a tag redraws, so the mean is one redraw per 5 calls
+    graph = LivePlot((12, 10), 0, 0)
+    tags = ["CCF9578E0D8A", "CCF9578E0D8B", "CCF9578E0D8C"]
+    for tag_id in tags:
+        graph.add_tag_sample(tag_id, 0, 0, 0, 0)
+    rng = np.random.default_rng(0)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        graph.add_tag_sample(
+            tags[count % len(tags)],
+            int(rng.normal(0, 5)),
+            int(rng.normal(0, 5)),
+            0,
+            0,
+        )
+        count = count + 1
+    elapsed = time.perf_counter() - start
+    graph.destroy()
+    return {"live_plot_add_tag_sample": (elapsed / count * 1000, "ms", False)}
+
+
+def sweep_tester(sweep, samples_per_position):
+    positions = np.linspace(-40, 40, sweep).round().astype(int).tolist()
+    rng = np.random.default_rng(0)
+    tester = AoATester(None, None, None, False, None, True)
+    for gt_azimuth in positions:
+        for gt_elevation in positions:
+            tester.analyze_logs(
+                synthetic_log(gt_azimuth, gt_elevation, samples_per_position, rng),
+                False,
+                gt_azimuth,
+                gt_elevation,
+            )
+    return tester
+
+
+def bench_create_plots(duration):
+    results = {}
+    for num_samples in PLOT_SAMPLE_COUNTS:
+        tester = sweep_tester(5, num_samples // 25)
+        start = time.perf_counter()
+        tester.create_plots(show_plots=False, summary_only=True)
+        results["create_plots_{}_samples".format(num_samples)] = (
+            time.perf_counter() - start,
+            "s",
+            False,
+        )
+        tester.delete_created_images()
+    return results
+
+
+def bench_create_pdf_report(duration):
+    results = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for sweep in REPORT_SWEEPS:
+            tester = sweep_tester(sweep, 100)
+            tester.create_plots(show_plots=False)
+            pages = len(tester.report)
+            start = time.perf_counter()
+            tester.create_pdf_report(os.path.join(out_dir, "report"))
+            results["create_pdf_report_{}_pages".format(pages)] = (
+                time.perf_counter() - start,
+                "s",
+                False,
+            )
+            tester.delete_created_images()
+    return results
+
+
+BENCHES = {
+    "pty_parse": bench_pty_parse,
+    "iq_parse": bench_iq_parse,
+    "iq_features": bench_iq_features,
+    "channel_statistics": bench_channel_statistics,
+    "rssi_errors": bench_rssi_errors,
+    "grid_statistics": bench_grid_statistics,
+    "angular_errors": bench_angular_errors,
+    "calibration": bench_calibration,
+    "filters": bench_filters,
+    "collect_angles": bench_collect_angles,
+    "angle_collector": bench_angle_collector,
+    "live_plot": bench_live_plot,
+    "create_plots": bench_create_plots,
+    "create_pdf_report": bench_create_pdf_report,
+}
+
+
+def compare(results, baseline, tolerance):
+    # Prints every metric against the baseline, returns the regressed ones
+    regressions = []
+    print(
+        "{:<36} {:>12} {:>12} {:>8}".format("metric", "baseline", "current", "change")
+    )
+    for name, result in results.items():
+        if name not in baseline:
+            print("{:<36} {:>12} {:>12.4g}".format(name, "-", result["value"]))
+            continue
+        base = baseline[name]["value"]
+        change = result["value"] / base - 1 if base != 0 else 0.0
+        worse = -change if result["higher_is_better"] else change
+        flag = ""
+        if worse > tolerance:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print(
+            "{:<36} {:>12.4g} {:>12.4g} {:>+7.0f}% {} {}".format(
+                name, base, result["value"], change * 100, result["unit"], flag
+            )
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Throughput and latency benchmarks of the acquisition and report pipeline"
+    )
+    parser.add_argument(
+        "--benches",
+        dest="benches",
+        nargs="+",
+        default=list(BENCHES),
+        choices=list(BENCHES),
+    )
+    parser.add_argument(
+        "--duration",
+        dest="duration",
+        default=2.0,
+        type=float,
+        help="Seconds every throughput benchmark runs for.",
+    )
+    parser.add_argument(
+        "--output",
+        dest="output",
+        default="bench_results.json",
+        help="Json file the results are written to.",
+    )
+    parser.add_argument(
+        "--baseline",
+        dest="baseline",
+        default=None,
+        help="Results of an earlier run to compare against, exits with 1 on a regression. Default the results of this host in baseline.json next to the suite, if it has any.",
+    )
+    parser.add_argument(
+        "--update_baseline",
+        dest="update_baseline",
+        action="store_true",
+        help="Write the results of the benches run into baseline.json as the baseline of this host instead of comparing, its other metrics are kept.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        default=DEFAULT_TOLERANCE,
+        type=float,
+        help="Fraction a metric may get worse than the baseline before it is a regression.",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for bench in args.benches:
+        print("Running", bench)
+        for name, (value, unit, higher_is_better) in BENCHES[bench](
+            args.duration
+        ).items():
+            results[name] = {
+                "value": value,
+                "unit": unit,
+                "higher_is_better": higher_is_better,
+            }
+            print("  {:<34} {:.4g} {}".format(name, value, unit))
+
+    run = {
+        "created": datetime.now().isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    with open(args.output, "w") as fp:
+        json.dump(run, fp, indent=4)
+    print("Results written to", args.output)
+
+    host = platform.node()
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as fp:
+            baselines = json.load(fp)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+    elif host in baselines:
+        baseline = baselines[host]["results"]
+
+    if args.update_baseline:
+        if host in baselines:
+            run["results"] = dict(baselines[host]["results"], **results)
+        baselines[host] = run
+        with open(BASELINE_FILE, "w") as fp:
+            json.dump(baselines, fp, indent=4)
+        print("Baseline of {} written to {}".format(host, BASELINE_FILE))
+    elif baseline is None:
+        print("No baseline of {}, nothing compared".format(host))
+    else:
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print("Regressions: {}".format(", ".join(regressions)))
+            sys.exit(1)
@@ -0,0 +1,125 @@
+import argparse, os, sys, time
+import socket
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from udp_receiver import UDPReceiver, DEFAULT_RCVBUF_SIZE
+
+
+def make_datagrams(num_anchors, num_tags):
+    # One +UUDF datagram per (anchor, tag), in the format the anchors forward.
+    # Returned without the timestamp, together with the offset of the anchor
+    # clock in ms, as every anchor counts from its own start.
+    datagrams = []
+    for anchor in range(num_anchors):
+        for tag in range(num_tags):
+            datagrams.append(
+                (
+                    '+UUDF:CCF9578E{:04X},-55,{},{},-60,37,"CD84C98B{:04X}","",'.format(
+                        tag,
+                        (anchor * 7 + tag) % 180 - 90,
+                        (anchor * 3 + tag) % 180 - 90,
+                        anchor,
+                    ).encode(),
+                    1000000 * (anchor + 1),
+                )
+            )
+    return datagrams
+
+
+def send(ip, port, datagrams, rate, duration):
+    # Sends the datagrams round robin at rate packets/s for duration seconds,
+    # rate 0 sends as fast as possible. Returns the number of packets sent.
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    address = (ip, port)
+    sent = 0
+    start = time.time()
+    end = start + duration
+    while True:
+        now = time.time()
+        if now >= end:
+            break
+        if rate > 0 and sent > (now - start) * rate:
+            time.sleep(min(0.001, end - now))
+            continue
+        now_ms = int(now * 1000)
+        for datagram, clock_offset in datagrams:
+            try:
+                sock.sendto(datagram + b"%d\r\n" % (now_ms - clock_offset), address)
+            except BlockingIOError:
+                continue
+            sent = sent + 1
+    sock.close()
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sends synthetic UDP angles, or benchmarks the UDP receiver with them"
+    )
+    parser.add_argument("--ip", dest="ip", default="127.0.0.1", required=False)
+    parser.add_argument(
+        "--port",
+        dest="port",
+        default=None,
+        type=int,
+        required=False,
+        help="Send to this port, if not given a receiver is started on a free port and benchmarked.",
+    )
+    parser.add_argument("--anchors", dest="anchors", default=8, type=int)
+    parser.add_argument("--tags", dest="tags", default=20, type=int)
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        default=0,
+        type=int,
+        help="Packets per second, default 0 (as fast as possible).",
+    )
+    parser.add_argument("--duration", dest="duration", default=5.0, type=float)
+    parser.add_argument(
+        "--rcvbuf", dest="rcvbuf", default=DEFAULT_RCVBUF_SIZE, type=int
+    )
+    args = parser.parse_args()
+
+    datagrams = make_datagrams(args.anchors, args.tags)
+    if args.port is not None:
+        sent = send(args.ip, args.port, datagrams, args.rate, args.duration)
+        print("Sent {} packets ({:.0f}/s)".format(sent, sent / args.duration))
+        sys.exit(0)
+
+    receiver = UDPReceiver([(args.ip, 0)], args.rcvbuf)
+    receiver.start()
+    print(
+        "Receiver on port {}, buffer {} bytes".format(
+            receiver.ports[0], receiver.rcvbuf_size
+        )
+    )
+    # Reads batches at the frame rate of udp_plotter
+    parsed = [0]
+    reading = True
+
+    def read_batches():
+        while reading:
+            time.sleep(1 / 30)
+            parsed[0] = parsed[0] + len(receiver.read_batch()["urc"])
+
+    reader = threading.Thread(target=read_batches)
+    reader.start()
+    sent = send(args.ip, receiver.ports[0], datagrams, args.rate, args.duration)
+    # Let the receiver drain what is still queued
+    time.sleep(0.5)
+    reading = False
+    reader.join()
+    parsed[0] = parsed[0] + len(receiver.read_batch()["urc"])
+    stats = receiver.get_stats()
+    receiver.stop()
+
+    print("Sent:           {} ({:.0f}/s)".format(sent, sent / args.duration))
+    print(
+        "Received:       {} ({:.0f}/s)".format(
+            stats["packets_received"], stats["packets_received"] / args.duration
+        )
+    )
+    print("Parsed samples: {}".format(parsed[0]))
+    print("Dropped:        {}".format(stats["packets_dropped"]))
+    print("Parse errors:   {}".format(stats["parse_errors"]))
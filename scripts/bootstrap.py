@@ -0,0 +1,124 @@
+import numpy as np
+
+# Keeps the resample matrices at around this many elements, larger campaigns
+# are resampled in chunks of rows instead.
+MAX_CHUNK_ELEMENTS = 4000000
+# Integer data with at most this many distinct values (like the angle errors
+# from the module) is resampled as histograms instead of sample by sample.
+MAX_HISTOGRAM_VALUES = 512
+
+
+def group_metric(metric, values, starts, counts, group_of):
+    # values holds all groups back to back along the last axis, group g is
+    # values[..., starts[g] : starts[g] + counts[g]].
+    if metric == "mean":
+        return np.add.reduceat(values, starts, axis=-1) / counts
+    if metric == "std":
+        mean = np.add.reduceat(values, starts, axis=-1) / counts
+        mean_sq = np.add.reduceat(values * values, starts, axis=-1) / counts
+        return np.sqrt(np.maximum(mean_sq - mean * mean, 0))
+    if metric == "within_10":
+        return np.add.reduceat(values <= 10, starts, axis=-1) / counts
+    if metric.startswith("p"):
+        # Sort every group in place by shifting each group into its own value
+        # range, then pick the nearest rank.
+        span = np.max(values) - np.min(values) + 1
+        shifted = np.sort(values + group_of * span, axis=-1) - group_of * span
+        rank = np.ceil(float(metric[1:]) / 100 * counts).astype(np.int64) - 1
+        return shifted[..., starts + np.maximum(rank, 0)]
+    raise ValueError("Unknown metric {}".format(metric))
+
+
+def histogram_metric(metric, distinct, counts, sizes):
+    # counts[..., g, v] is how many times distinct[v] is in group g
+    if metric == "mean":
+        return counts @ distinct / sizes
+    if metric == "std":
+        mean = counts @ distinct / sizes
+        mean_sq = counts @ (distinct * distinct) / sizes
+        return np.sqrt(np.maximum(mean_sq - mean * mean, 0))
+    if metric == "within_10":
+        return counts[..., distinct <= 10].sum(axis=-1) / sizes
+    if metric.startswith("p"):
+        rank = np.maximum(np.ceil(float(metric[1:]) / 100 * sizes), 1)
+        cumulative = np.cumsum(counts, axis=-1)
+        return distinct[np.argmax(cumulative >= rank[:, None], axis=-1)]
+    raise ValueError("Unknown metric {}".format(metric))
+
+
+def bootstrap_histograms(values, group_of, sizes, metrics, num_resamples, rng):
+    # Drawing a bootstrap resample of a group is the same as drawing how many
+    # times each distinct value is picked from a multinomial, which does not
+    # depend on the number of samples in the group.
+    distinct, inverse = np.unique(values, return_inverse=True)
+    counts = np.bincount(
+        group_of * len(distinct) + inverse, minlength=len(sizes) * len(distinct)
+    ).reshape(len(sizes), len(distinct))
+    probabilities = counts / sizes[:, None]
+
+    result = {}
+    for metric in metrics:
+        result[metric] = {
+            "estimate": histogram_metric(metric, distinct, counts, sizes),
+            "resampled": np.empty((num_resamples, len(sizes))),
+        }
+    chunk = max(1, MAX_CHUNK_ELEMENTS // (len(sizes) * len(distinct)))
+    for first in range(0, num_resamples, chunk):
+        rows = min(chunk, num_resamples - first)
+        resampled = rng.multinomial(sizes, probabilities, size=(rows, len(sizes)))
+        for metric in metrics:
+            result[metric]["resampled"][first : first + rows] = histogram_metric(
+                metric, distinct, resampled, sizes
+            )
+    return result
+
+
+def bootstrap(values, groups, metrics, num_resamples=1000, seed=0):
+    # Bootstrap of one or more metrics for every group of samples.
+    # groups is a list of index arrays into values, as given by
+    # sample_table.group_indices. Returns a dict with for each metric the
+    # point estimate per group and the (num_resamples, num_groups) matrix of
+    # resampled estimates.
+    counts = np.array([len(group) for group in groups], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    group_of = np.repeat(np.arange(len(groups)), counts)
+    values = np.asarray(values, dtype=np.float64)[np.concatenate(groups)]
+
+    rng = np.random.default_rng(seed)
+    if (
+        np.all(np.mod(values, 1) == 0)
+        and len(np.unique(values)) <= MAX_HISTOGRAM_VALUES
+    ):
+        return bootstrap_histograms(
+            values, group_of, counts, metrics, num_resamples, rng
+        )
+
+    result = {}
+    for metric in metrics:
+        result[metric] = {
+            "estimate": group_metric(metric, values, starts, counts, group_of),
+            "resampled": np.empty((num_resamples, len(groups))),
+        }
+
+    chunk = max(1, MAX_CHUNK_ELEMENTS // max(1, len(values)))
+    for first in range(0, num_resamples, chunk):
+        rows = min(chunk, num_resamples - first)
+        # One matrix of resample indexes for all groups at once, every column
+        # draws within the bounds of its own group.
+        indexes = starts[group_of] + (
+            rng.random((rows, len(values))) * counts[group_of]
+        ).astype(np.int64)
+        resampled = values[indexes]
+        for metric in metrics:
+            result[metric]["resampled"][first : first + rows] = group_metric(
+                metric, resampled, starts, counts, group_of
+            )
+    return result
+
+
+def confidence_interval(resampled, confidence=0.95):
+    tail = (1 - confidence) / 2 * 100
+    return (
+        np.percentile(resampled, tail, axis=0),
+        np.percentile(resampled, 100 - tail, axis=0),
+    )
@@ -0,0 +1,246 @@
+import json, os
+from datetime import datetime
+import numpy as np
+from aoa_controller import parse_event
+from angular_error import unit_vectors, vector_angles
+from sample_table import SampleTable, group_indices
+
+# Calibrations of every antenna, by serial
+CALIBRATION_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "antenna_calibrations.json"
+)
+# Parameters of a calibration in fitting order, offsets in degrees
+PARAMETERS = ["yaw", "pitch", "roll", "azimuth_scale", "elevation_scale"]
+# Gauss-Newton stops after MAX_ITERATIONS or when no parameter changes more
+# than CONVERGED
+MAX_ITERATIONS = 50
+CONVERGED = 1e-6
+# Step of the numeric derivatives, in degrees or scale
+DERIVATIVE_STEP = 1e-4
+# Positions needed for a fit, 2 residuals each for 5 parameters
+MIN_POSITIONS = 3
+
+
+def rotation_matrices(yaw, pitch, roll):
+    # (..., 3, 3) rotations by yaw around y (azimuth grows), then pitch
+    # around x (elevation grows), then roll around z (the boresight), for
+    # the unit vectors of angular_error.unit_vectors
+    yaw, pitch, roll = [
+        np.radians(np.asarray(a, dtype=np.float64)) for a in (yaw, pitch, roll)
+    ]
+    zeros = np.zeros_like(yaw)
+    ones = np.ones_like(yaw)
+    around_y = np.stack(
+        [
+            np.stack([np.cos(yaw), zeros, np.sin(yaw)], -1),
+            np.stack([zeros, ones, zeros], -1),
+            np.stack([-np.sin(yaw), zeros, np.cos(yaw)], -1),
+        ],
+        -2,
+    )
+    around_x = np.stack(
+        [
+            np.stack([ones, zeros, zeros], -1),
+            np.stack([zeros, np.cos(pitch), np.sin(pitch)], -1),
+            np.stack([zeros, -np.sin(pitch), np.cos(pitch)], -1),
+        ],
+        -2,
+    )
+    around_z = np.stack(
+        [
+            np.stack([np.cos(roll), -np.sin(roll), zeros], -1),
+            np.stack([np.sin(roll), np.cos(roll), zeros], -1),
+            np.stack([zeros, zeros, ones], -1),
+        ],
+        -2,
+    )
+    return around_z @ around_x @ around_y
+
+
+def measured_angles(parameters, gt_azimuth, gt_elevation):
+    # Angles the module measures for the ground truth directions with every
+    # row of (..., 5) parameters: the direction rotated by the mounting
+    # offset, then azimuth and elevation scaled. (..., samples) arrays.
+    parameters = np.asarray(parameters, dtype=np.float64)
+    rotations = rotation_matrices(
+        parameters[..., 0], parameters[..., 1], parameters[..., 2]
+    )
+    vectors = np.einsum(
+        "...ij,mj->...mi", rotations, unit_vectors(gt_azimuth, gt_elevation)
+    )
+    azimuth, elevation = vector_angles(vectors)
+    return (
+        azimuth * parameters[..., 3, None],
+        elevation * parameters[..., 4, None],
+    )
+
+
+def wrap(degrees):
+    # Angles in [-180, 180)
+    return (degrees + 180) % 360 - 180
+
+
+class Calibration:
+    # Mounting offset of an antenna in the rig and the scale of its angles:
+    # the module measures the ground truth direction rotated by yaw, pitch
+    # and roll degrees, with its azimuth times azimuth_scale and its elevation
+    # times elevation_scale. correct undoes that.
+    def __init__(
+        self, yaw=0.0, pitch=0.0, roll=0.0, azimuth_scale=1.0, elevation_scale=1.0
+    ):
+        self.yaw = float(yaw)
+        self.pitch = float(pitch)
+        self.roll = float(roll)
+        self.azimuth_scale = float(azimuth_scale)
+        self.elevation_scale = float(elevation_scale)
+
+    def parameters(self):
+        return np.array([getattr(self, name) for name in PARAMETERS])
+
+    def options(self):
+        # Everything that changes the corrected angles, for the report cache
+        return {name: getattr(self, name) for name in PARAMETERS}
+
+    def measure(self, gt_azimuth, gt_elevation):
+        return measured_angles(self.parameters(), gt_azimuth, gt_elevation)
+
+    def correct(self, azimuth, elevation):
+        # Ground truth directions of measured angles, in degrees
+        vectors = unit_vectors(
+            np.asarray(azimuth) / self.azimuth_scale,
+            np.asarray(elevation) / self.elevation_scale,
+        )
+        rotation = rotation_matrices(self.yaw, self.pitch, self.roll)
+        # Row vectors times the rotation is the inverse rotation
+        return vector_angles(vectors @ rotation)
+
+    def apply(self, samples):
+        # Copy of a sample table with corrected angles. The measured angles
+        # before any filter are kept in uncalibrated_azimuth and
+        # uncalibrated_elevation; the raw angles of a filtered table are
+        # corrected too, so they differ from the uncalibrated ones only by
+        # the calibration.
+        columns = dict(samples.columns)
+        prefixes = ["", "raw_"] if "raw_azimuth" in columns else [""]
+        columns["uncalibrated_azimuth"] = samples[prefixes[-1] + "azimuth"]
+        columns["uncalibrated_elevation"] = samples[prefixes[-1] + "elevation"]
+        for prefix in prefixes:
+            azimuth, elevation = self.correct(
+                samples[prefix + "azimuth"], samples[prefix + "elevation"]
+            )
+            columns[prefix + "azimuth"] = np.round(azimuth).astype(
+                samples[prefix + "azimuth"].dtype
+            )
+            columns[prefix + "elevation"] = np.round(elevation).astype(
+                samples[prefix + "elevation"].dtype
+            )
+        return SampleTable(
+            samples.positions, samples.tag_ids, columns, samples.iqs, samples.anchor_ids
+        )
+
+    @staticmethod
+    def fit(azimuth, elevation, gt_azimuth, gt_elevation, weights=None):
+        # Least squares fit of the measured angles of the ground truth
+        # directions to azimuth and elevation, Gauss-Newton with Levenberg
+        # damping. The Jacobian comes from forward differences with all
+        # parameters stepped in one vectorised model evaluation.
+        azimuth = np.asarray(azimuth, dtype=np.float64)
+        elevation = np.asarray(elevation, dtype=np.float64)
+        if weights is None:
+            weights = np.ones(len(azimuth))
+        weights = np.sqrt(np.r_[weights, weights])
+
+        def residuals(parameters):
+            # (..., 2 * samples) weighted residuals of every parameter row
+            model_azimuth, model_elevation = measured_angles(
+                parameters, gt_azimuth, gt_elevation
+            )
+            return (
+                np.concatenate(
+                    [wrap(azimuth - model_azimuth), elevation - model_elevation],
+                    -1,
+                )
+                * weights
+            )
+
+        parameters = Calibration().parameters()
+        steps = np.eye(len(PARAMETERS)) * DERIVATIVE_STEP
+        damping = 1e-3
+        current = residuals(parameters)
+        cost = np.sum(current**2)
+        for _ in range(MAX_ITERATIONS):
+            jacobian = (residuals(parameters + steps) - current).T / DERIVATIVE_STEP
+            normal = jacobian.T @ jacobian
+            gradient = jacobian.T @ current
+            while True:
+                change = np.linalg.solve(
+                    normal + damping * np.diag(np.diag(normal) + 1e-12), -gradient
+                )
+                candidate = residuals(parameters + change)
+                candidate_cost = np.sum(candidate**2)
+                if candidate_cost <= cost or damping > 1e8:
+                    break
+                damping = damping * 10
+            if candidate_cost > cost:
+                break
+            parameters = parameters + change
+            current = candidate
+            cost = candidate_cost
+            damping = max(damping / 10, 1e-9)
+            if np.max(np.abs(change)) < CONVERGED:
+                break
+        return Calibration(*parameters)
+
+    @staticmethod
+    def fit_table(samples, gt_sign=1):
+        # Fit on the median angles of every ground truth position, weighted
+        # by their sample counts. gt_sign is -1 for an upside down antenna
+        # like in AoATester.get_errors.
+        keys, groups = group_indices(samples["position"])
+        if len(keys) < MIN_POSITIONS:
+            raise ValueError(
+                "Calibration needs samples at {} positions or more, got {}".format(
+                    MIN_POSITIONS, len(keys)
+                )
+            )
+        positions = np.array([samples.positions[position] for (position,) in keys])
+        return Calibration.fit(
+            [np.median(samples["azimuth"][indexes]) for indexes in groups],
+            [np.median(samples["elevation"][indexes]) for indexes in groups],
+            gt_sign * positions[:, 0],
+            gt_sign * positions[:, 1],
+            [len(indexes) for indexes in groups],
+        )
+
+
+def antenna_serial(lines):
+    # Anchor id of the first sample in lines, the serial calibrations are
+    # kept under. None if no line is a sample.
+    for line in lines:
+        urc_dict = parse_event(line)
+        if urc_dict is not None:
+            return urc_dict["anchor_id"]
+    return None
+
+
+def load_calibration(serial, file=CALIBRATION_FILE):
+    # Calibration of the antenna with serial, None if it has none
+    if serial is None or not os.path.exists(file):
+        return None
+    with open(file) as fp:
+        calibrations = json.load(fp)
+    if serial not in calibrations:
+        return None
+    return Calibration(*[calibrations[serial][name] for name in PARAMETERS])
+
+
+def save_calibration(serial, calibration, file=CALIBRATION_FILE):
+    # Adds or replaces the calibration of the antenna with serial
+    calibrations = {}
+    if os.path.exists(file):
+        with open(file) as fp:
+            calibrations = json.load(fp)
+    calibrations[serial] = calibration.options()
+    calibrations[serial]["date"] = datetime.now().isoformat(timespec="seconds")
+    with open(file, "w") as fp:
+        json.dump(calibrations, fp, indent=2)
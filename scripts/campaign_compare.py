@@ -0,0 +1,326 @@
+import argparse, os, time
+from pathlib import Path
+from matplotlib import pyplot as plt
+
+plt.rcParams.update({"text.color": "white"})
+import numpy as np
+from analyzer import AoATester
+from log_analyser import load_log_dir
+from bootstrap import bootstrap, confidence_interval
+from report_writer import RasterReport
+from sample_table import group_indices
+from aoa_estimator import ESTIMATOR_METHODS, load_estimator
+
+METRICS = ["mean", "std", "within_10"]
+METRIC_TITLES = {
+    "mean": "mean error",
+    "std": "std error",
+    "within_10": "CDF@10",
+}
+# A regression is when the metric moves in this direction
+HIGHER_IS_WORSE = {"mean": True, "std": True, "within_10": False}
+AXES = ["azimuth", "elevation"]
+
+
+class Campaign:
+    def __init__(
+        self,
+        log_dir,
+        antenna_upside_down=False,
+        swap_angles=False,
+        remove_90=False,
+        max_angle=90,
+        estimator=None,
+    ):
+        self.name = Path(os.path.abspath(log_dir)).name
+        if estimator is not None:
+            self.name = "{}_{}".format(self.name, estimator.name())
+        analyzer = AoATester(None, None, None, antenna_upside_down, None, True)
+        # Goes through the report cache, so only the first load parses the logs
+        load_log_dir(
+            analyzer, log_dir, max_angle, remove_90, swap_angles, True, estimator
+        )
+        self.samples = analyzer.get_sample_table()
+        azimuth_errors, elevation_errors = analyzer.get_errors()
+        self.errors = {
+            "azimuth": np.abs(azimuth_errors),
+            "elevation": np.abs(elevation_errors),
+        }
+
+    def groups(self, per_tag=False):
+        # Sample indexes per ground truth position, or per (position, tag)
+        if per_tag:
+            keys, groups = group_indices(self.samples["position"], self.samples["tag"])
+            return {
+                (self.samples.positions[position], self.samples.tag_ids[tag]): indexes
+                for (position, tag), indexes in zip(keys, groups)
+            }
+        keys, groups = group_indices(self.samples["position"])
+        return {
+            self.samples.positions[position]: indexes
+            for (position,), indexes in zip(keys, groups)
+        }
+
+
+def key_label(key):
+    if isinstance(key[1], str):
+        return "{},{} {}".format(key[0][0], key[0][1], key[1])
+    return "{},{}".format(key[0], key[1])
+
+
+def compare_campaigns(
+    baseline, campaign, per_tag=False, num_resamples=1000, confidence=0.95
+):
+    baseline_groups = baseline.groups(per_tag)
+    campaign_groups = campaign.groups(per_tag)
+    keys = sorted(set(baseline_groups) & set(campaign_groups))
+    result = {"keys": keys}
+    if len(keys) == 0:
+        return result
+
+    for axis in AXES:
+        baseline_boot = bootstrap(
+            baseline.errors[axis],
+            [baseline_groups[key] for key in keys],
+            METRICS,
+            num_resamples,
+            seed=0,
+        )
+        campaign_boot = bootstrap(
+            campaign.errors[axis],
+            [campaign_groups[key] for key in keys],
+            METRICS,
+            num_resamples,
+            seed=1,
+        )
+        result[axis] = {}
+        for metric in METRICS:
+            # Both campaigns are resampled independently, so the difference of
+            # the resampled estimates is a bootstrap of the delta.
+            delta = (
+                campaign_boot[metric]["estimate"] - baseline_boot[metric]["estimate"]
+            )
+            low, high = confidence_interval(
+                campaign_boot[metric]["resampled"] - baseline_boot[metric]["resampled"],
+                confidence,
+            )
+            result[axis][metric] = {
+                "baseline": baseline_boot[metric]["estimate"],
+                "campaign": campaign_boot[metric]["estimate"],
+                "delta": delta,
+                "low": low,
+                "high": high,
+                "regression": low > 0 if HIGHER_IS_WORSE[metric] else high < 0,
+            }
+    return result
+
+
+def print_comparison(baseline, campaign, result, only_regressions=False):
+    print("\n{} compared to {}".format(campaign.name, baseline.name))
+    header = "{:<26}".format("Position")
+    for axis in AXES:
+        for metric in METRICS:
+            header = header + "{:>22}".format(
+                "{} {}".format(axis[:3], METRIC_TITLES[metric])
+            )
+    print(header)
+    print("-" * len(header))
+    for i, key in enumerate(result["keys"]):
+        regression = any(
+            result[axis][metric]["regression"][i] for axis in AXES for metric in METRICS
+        )
+        if only_regressions and not regression:
+            continue
+        line = "{:<26}".format(key_label(key))
+        for axis in AXES:
+            for metric in METRICS:
+                values = result[axis][metric]
+                line = line + "{:>22}".format(
+                    "{}{:+.2f} [{:+.2f},{:+.2f}]".format(
+                        "!" if values["regression"][i] else " ",
+                        values["delta"][i],
+                        values["low"][i],
+                        values["high"][i],
+                    )
+                )
+        print(line)
+
+
+def plot_comparison(baseline, campaign, result, figsize=(12, 10)):
+    fig = plt.figure(figsize=figsize)
+    fig.patch.set_facecolor("#202124")
+    fig.canvas.manager.set_window_title("Campaign comparison")
+    plt.subplots_adjust(
+        left=0.06, right=0.97, top=0.92, bottom=0.08, hspace=0.5, wspace=0.15
+    )
+    plt.gcf().text(
+        0.05,
+        0.99,
+        "{} vs {}".format(campaign.name, baseline.name),
+        va="top",
+        fontsize=18,
+    )
+    x_values = np.arange(len(result["keys"]))
+    plot_num = 1
+    for metric in METRICS:
+        for axis in AXES:
+            values = result[axis][metric]
+            ax = plt.subplot(len(METRICS), 2, plot_num)
+            plot_num = plot_num + 1
+            ax.errorbar(
+                x_values,
+                values["delta"],
+                yerr=[
+                    values["delta"] - values["low"],
+                    values["high"] - values["delta"],
+                ],
+                fmt="o",
+                markersize=3,
+                color="#1887AB",
+                ecolor="#5DADE2",
+            )
+            ax.scatter(
+                x_values[values["regression"]],
+                values["delta"][values["regression"]],
+                color="red",
+                zorder=3,
+                s=20,
+            )
+            ax.axhline(y=0, color="white", linewidth=0.5)
+            ax.set_title("{} {} delta".format(axis.capitalize(), METRIC_TITLES[metric]))
+            ax.set_xticks(x_values)
+            ax.set_xticklabels(
+                [key_label(key) for key in result["keys"]],
+                rotation=90,
+                fontsize=6,
+            )
+            ax.tick_params(axis="x", colors="white")
+            ax.tick_params(axis="y", colors="white")
+            ax.grid(alpha=0.4, color="#212F3D")
+    return fig
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare accuracy of two or more measurement campaigns"
+    )
+    parser.add_argument(
+        "--log_dirs",
+        dest="log_dirs",
+        nargs="+",
+        required=True,
+        help="Folders with log files, the first one is the baseline the others are compared to.",
+    )
+    parser.add_argument(
+        "--per_tag",
+        dest="per_tag",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Align on position and tag instead of only position.",
+    )
+    parser.add_argument(
+        "--resamples",
+        dest="resamples",
+        default=1000,
+        type=int,
+        required=False,
+        help="Number of bootstrap resamples used for the confidence intervals.",
+    )
+    parser.add_argument(
+        "--confidence",
+        dest="confidence",
+        default=0.95,
+        type=float,
+        required=False,
+        help="Confidence level of the intervals, a delta is flagged as regression if its interval does not include 0.",
+    )
+    parser.add_argument(
+        "--only_regressions",
+        dest="only_regressions",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Only print rows with at least one regression.",
+    )
+    parser.add_argument(
+        "--report",
+        dest="report",
+        default=None,
+        required=False,
+        help="Name of a pdf report with the deltas to create.",
+    )
+    parser.add_argument(
+        "--antenna_upsidedown",
+        dest="antenna_upsidedown",
+        action="store_true",
+        default=False,
+        required=False,
+        help="If antenna is upsidedown",
+    )
+    parser.add_argument(
+        "--swap_angles",
+        dest="swap_angles",
+        action="store_true",
+        default=False,
+        required=False,
+        help="If azimuth and elevation should be swapped",
+    )
+    parser.add_argument(
+        "--estimators",
+        dest="estimators",
+        nargs="+",
+        default=None,
+        choices=["module"] + ESTIMATOR_METHODS,
+        required=False,
+        help="Where the angles of every log dir come from, the module or re-estimated from the IQs on the host. Give the same log dir twice to compare estimators on one sweep.",
+    )
+    parser.add_argument(
+        "--array",
+        dest="array",
+        default=None,
+        required=False,
+        help="Json file with the antenna array geometry for --estimators, default a 4x4 array.",
+    )
+
+    args = parser.parse_args()
+    if len(args.log_dirs) < 2:
+        parser.error("At least two log dirs are needed for a comparison")
+    estimators = args.estimators
+    if estimators is None:
+        estimators = ["module"] * len(args.log_dirs)
+    if len(estimators) != len(args.log_dirs):
+        parser.error("--estimators needs one estimator per log dir")
+
+    start = time.time()
+    campaigns = [
+        Campaign(
+            log_dir,
+            args.antenna_upsidedown,
+            args.swap_angles,
+            estimator=load_estimator(estimator, args.array),
+        )
+        for log_dir, estimator in zip(args.log_dirs, estimators)
+    ]
+    print("Loaded {} campaigns in {:.2f} s".format(len(campaigns), time.time() - start))
+
+    report = RasterReport()
+    baseline = campaigns[0]
+    for campaign in campaigns[1:]:
+        result = compare_campaigns(
+            baseline, campaign, args.per_tag, args.resamples, args.confidence
+        )
+        if len(result["keys"]) == 0:
+            print(
+                "No common positions in {} and {}".format(baseline.name, campaign.name)
+            )
+            continue
+        print_comparison(baseline, campaign, result, args.only_regressions)
+        if args.report is not None:
+            plot_comparison(baseline, campaign, result)
+            report.add_figure("{}_vs_{}.png".format(campaign.name, baseline.name))
+            plt.close()
+
+    if args.report is not None:
+        print("Saved", report.save("{}.pdf".format(args.report)))
+    print("Finished in {:.2f} s".format(time.time() - start))
@@ -10,6 +10,8 @@ import os
 import glob
 from antenna_controller import AntennaController
 from aoa_controller import AoAController
+from latency import LATENCY
+from tag_registry import REGISTRY_FILE, load_registry
 import shutil
 import tkinter as tk
 from live_plot import LivePlot
@@ -24,12 +26,17 @@ class AngleCollector:
         locate_baudrate,
         locate_ctsrts,
         antenna_upside_down,
+        sources=None,
     ):
+        # sources replaces the serial ports with other SampleSources, like
+        # SimulatorSource to run without hardware
         self.locate_controllers = []
         self.collected_data = []
-        for port in locate_ports:
+        if sources is None:
+            sources = [None] * len(locate_ports)
+        for port, source in zip(locate_ports, sources):
             self.locate_controllers.append(
-                AoAController(port, locate_baudrate, locate_ctsrts, False)
+                AoAController(port, locate_baudrate, locate_ctsrts, source)
             )
             self.collected_data.append({})
 
@@ -58,6 +65,9 @@ class AngleCollector:
             if data[1] != None:
                 urc = data[0]
                 urc_dict = data[1]
+                # Receive time, to align the anchor timestamps of several
+                # anchors with sample_fusion
+                urc_dict["host_time"] = time.time()
                 # If we successfully parsed event then save it
                 raw_result.append(urc)
                 tag_id = urc_dict["instanceId"]
@@ -66,6 +76,8 @@ class AngleCollector:
                 else:
                     parsed_result[tag_id] = []
                     parsed_result[tag_id].append(urc_dict)
+                if LATENCY.enabled:
+                    LATENCY.record("store", "parse")
 
         # Save the result in a map with a tuple of azimuth and tilt as key
         self.collected_data[index][(gt_azimuth, gt_elevation)] = (
@@ -79,6 +91,10 @@ class AngleCollector:
         for idx, locate in enumerate(self.locate_controllers):
             locate.flush_input_buffer()
             locate.enable_aoa()
+            locate.set_ground_truth(
+                -gt_azimuth if self.antenna_upside_down else gt_azimuth,
+                -gt_elevation if self.antenna_upside_down else gt_elevation,
+            )
             thread = Thread(
                 target=self.__collect_angles,
                 args=(locate, timeout_ms, idx, gt_azimuth, gt_elevation),
@@ -170,7 +186,16 @@ if __name__ == "__main__":
         help="List of name identifying the measurements. Should be same length as --locate_ports",
     )
 
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        default=REGISTRY_FILE,
+        required=False,
+        help="Json file with the friendly name, expected position and TX power of tags and the name of anchors, default tags.json next to the scripts if it exists.",
+    )
+
     args = parser.parse_args()
+    load_registry(args.tags)
 
     # Cleanup if there are some old .log files
     for file in glob.glob("*.log"):
@@ -0,0 +1,101 @@
+import numpy as np
+from aoa_estimator import ArrayGeometry, channel_frequency, reference_rotation
+from sample_table import group_indices
+
+# Per element features, (packets, elements) per packet and (positions,
+# elements) per position
+ELEMENT_FEATURES = ["phase", "phase_error", "amplitude_db", "coherence"]
+
+
+def packet_features(iqs, geometry, channels, azimuth, elevation):
+    # Features of every packet from its (packets, 82) IQs:
+    #   cfo_hz        carrier frequency offset measured on the reference period
+    #   phase         phase in degrees of every element relative to the
+    #                 reference element
+    #   phase_error   phase minus the phase expected for a signal from
+    #                 (azimuth, elevation), the direction in antenna angles
+    #   amplitude_db  amplitude of every element relative to the mean over
+    #                 all elements of the packet
+    #   coherence     length of the mean over the switch pattern repetitions
+    #                 of the unit phasors of every element, 1 when the phase
+    #                 is the same in every repetition
+    snapshots = geometry.snapshots(iqs)
+    amplitude = np.abs(snapshots)
+    mean = snapshots.mean(axis=1)
+    reference = np.conj(mean[:, geometry.reference_element])[:, None]
+    expected = geometry.steering(azimuth, elevation, channel_frequency(channels))
+    expected = expected * np.conj(expected[:, geometry.reference_element])[:, None]
+    element_amplitude = np.maximum(amplitude.mean(axis=1), 1e-9)
+    phasors = snapshots / np.maximum(amplitude, 1e-9)
+    return {
+        "cfo_hz": (reference_rotation(iqs) / (2 * np.pi) * 1e6).astype(np.float32),
+        "phase": np.degrees(np.angle(mean * reference)).astype(np.float32),
+        "phase_error": np.degrees(
+            np.angle(mean * reference * np.conj(expected))
+        ).astype(np.float32),
+        "amplitude_db": (
+            20 * np.log10(element_amplitude / element_amplitude.mean(axis=1)[:, None])
+        ).astype(np.float32),
+        "coherence": np.abs(phasors.mean(axis=1)).astype(np.float32),
+    }
+
+
+def group_mean(values, starts):
+    # Mean and standard deviation of the rows from every start to the next
+    counts = np.diff(np.r_[starts, len(values)])
+    counts = counts.reshape((-1,) + (1,) * (values.ndim - 1))
+    mean = np.add.reduceat(values, starts, axis=0) / counts
+    squares = np.add.reduceat(values**2, starts, axis=0) / counts
+    return mean, np.sqrt(np.maximum(squares - mean**2, 0))
+
+
+def circular_mean(degrees, starts):
+    # Mean angle of the rows from every start to the next, the angle of their
+    # mean unit phasor, and their circular standard deviation
+    phasors = np.exp(1j * np.radians(degrees))
+    counts = np.diff(np.r_[starts, len(degrees)])[:, None]
+    mean = np.add.reduceat(phasors, starts, axis=0) / counts
+    length = np.clip(np.abs(mean), 1e-9, 1)
+    return np.degrees(np.angle(mean)), np.degrees(np.sqrt(-2 * np.log(length)))
+
+
+def iq_features(samples, geometry, azimuth_errors, elevation_errors, gt_sign=1):
+    # Features of every sample with IQs together with its angle errors, and
+    # their mean per ground truth position. None if no sample has IQs.
+    if samples.iqs is None:
+        return None
+    if geometry is None:
+        geometry = ArrayGeometry.rectangular()
+    rows = np.flatnonzero(~np.isnan(samples.iqs[:, 0]))
+    if len(rows) == 0:
+        return None
+    packets = packet_features(
+        samples.iqs[rows],
+        geometry,
+        samples["channel"][rows],
+        gt_sign * samples.gt_azimuth()[rows],
+        gt_sign * samples.gt_elevation()[rows],
+    )
+    packets["rows"] = rows
+    packets["azimuth_errors"] = azimuth_errors[rows]
+    packets["elevation_errors"] = elevation_errors[rows]
+
+    # Per position, over the packets sorted on position
+    keys, groups = group_indices(samples["position"][rows])
+    order = np.concatenate(groups)
+    counts = np.array([len(group) for group in groups])
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    features = {
+        "positions": [samples.positions[position] for (position,) in keys],
+        "count": counts,
+        "packets": packets,
+    }
+    for name in ["phase", "phase_error"]:
+        features[name], features[name + "_std"] = circular_mean(
+            packets[name][order], starts
+        )
+    for name in ["amplitude_db", "coherence", "cfo_hz"]:
+        features[name], features[name + "_std"] = group_mean(
+            packets[name][order].astype(np.float64), starts
+        )
+    return features
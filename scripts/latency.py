@@ -0,0 +1,138 @@
+import signal
+import sys
+import threading
+import time
+import numpy as np
+
+# Latencies below 2**SUB_BUCKET_BITS ns are kept exactly, every power of two
+# above is split into 2**(SUB_BUCKET_BITS - 1) buckets, so a recorded latency
+# is off by at most about 3%.
+SUB_BUCKET_BITS = 6
+# Latencies up to 2**MAX_BITS ns (about 18 minutes) are kept, longer ones are
+# counted in the last bucket.
+MAX_BITS = 40
+# Percentiles in the summary
+SUMMARY_PERCENTILES = [50, 90, 99, 99.9]
+
+
+class LatencyHistogram:
+    # Log-linear histogram of latencies in nanoseconds, like HdrHistogram:
+    # fixed memory and O(1) recording no matter how many samples.
+    def __init__(self):
+        self.counts = [0] * ((MAX_BITS - SUB_BUCKET_BITS + 2) << (SUB_BUCKET_BITS - 1))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        # ns must be an int >= 0, like the difference of two perf_counter_ns
+        shift = ns.bit_length() - SUB_BUCKET_BITS
+        index = ns if shift <= 0 else (shift << (SUB_BUCKET_BITS - 1)) + (ns >> shift)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count = self.count + 1
+        self.total = self.total + ns
+        if ns > self.max:
+            self.max = ns
+
+    def bucket_values(self):
+        # Lowest latency in ns of every bucket
+        index = np.arange(len(self.counts))
+        half = 1 << (SUB_BUCKET_BITS - 1)
+        shift = np.maximum(index // half - 1, 0)
+        mantissa = np.where(index < 2 * half, index, index % half + half)
+        return mantissa.astype(np.int64) << shift
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        cumulative = np.cumsum(self.counts)
+        index = np.searchsorted(cumulative, self.count * percent / 100)
+        return min(int(self.bucket_values()[index]), self.max)
+
+    def percentile_distribution(self):
+        # Fraction of samples at or below the top of every non empty bucket and
+        # the bucket latency, for plotting like HdrHistogram does
+        counts = np.array(self.counts)
+        used = np.flatnonzero(counts)
+        fractions = np.cumsum(counts[used]) / self.count
+        return fractions, self.bucket_values()[used]
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+
+class LatencyRecorder:
+    # Timestamps samples at every stage of the live pipeline, from reading a
+    # line to plotting it, and keeps a histogram per stage. Disabled it costs
+    # the callers a check of enabled, that is all:
+    #
+    #   if LATENCY.enabled:
+    #       LATENCY.mark("read")
+    #
+    # Marks are kept per thread, so every AngleCollector thread times its own
+    # samples.
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.marks = threading.local()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def mark(self, name):
+        # Time a sample reached stage name, in monotonic ns
+        setattr(self.marks, name, time.perf_counter_ns())
+
+    def record(self, stage, since, until=None):
+        # Records the time from mark since to mark until, or to now
+        start = getattr(self.marks, since, None)
+        if start is None:
+            return
+        end = time.perf_counter_ns() if until is None else getattr(self.marks, until)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(end - start)
+
+    def summary(self):
+        # One line per stage with the count, mean, percentiles and max in ms
+        lines = [
+            "{:<14}{:>9}{:>9}".format("stage", "count", "mean")
+            + "".join("{:>9}".format("p{:g}".format(p)) for p in SUMMARY_PERCENTILES)
+            + "{:>9}".format("max")
+        ]
+        with self.lock:
+            histograms = list(self.histograms.items())
+        for stage, histogram in histograms:
+            values = [histogram.mean()]
+            values += [histogram.percentile(p) for p in SUMMARY_PERCENTILES]
+            values += [histogram.max]
+            lines.append(
+                "{:<14}{:>9}".format(stage, histogram.count)
+                + "".join("{:>9.3f}".format(value / 1e6) for value in values)
+            )
+        return "\n".join(lines) + "\n(ms)"
+
+    def install_signal_handler(self, signum=getattr(signal, "SIGUSR1", None)):
+        # Prints the summary when the process gets signum, for example
+        # kill -USR1 <pid>. Not available on Windows.
+        if signum is None:
+            return
+
+        def dump(signum, frame):
+            print(self.summary())
+            sys.stdout.flush()
+
+        signal.signal(signum, dump)
+
+
+# The recorder all live components report to
+LATENCY = LatencyRecorder()
@@ -0,0 +1,97 @@
+from matplotlib import pyplot as plt
+import numpy as np
+from tag_registry import REGISTRY
+
+# Metrics that can be shown, cycled with the "m" key, with a fixed color range
+# so that updates only have to redraw the image.
+HEATMAP_METRICS = {
+    "rssi": ("Mean RSSI", "viridis", -100, -30),
+    "spread": ("Angle spread (std)", "magma", 0, 20),
+}
+
+
+class LiveHeatmap:
+    # Anchor x tag heatmap of one metric per (anchor, tag) pair. Only the image
+    # data is replaced on update, the axes are redrawn when anchors or tags
+    # are added.
+    def __init__(self, close_event_callback, tag_clicked_callback=None):
+        self.fig = plt.figure(figsize=(12, 5))
+        self.fig.patch.set_facecolor("#65494c")
+        self.fig.canvas.manager.set_window_title("Anchors x tags")
+        plt.subplots_adjust(left=0.12, right=0.97, top=0.88, bottom=0.3)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.ax.tick_params(axis="x", colors="white")
+        self.ax.tick_params(axis="y", colors="white")
+        self.anchor_ids = []
+        self.tag_ids = []
+        self.image = None
+        self.colorbar = None
+        self.selected_tag = None
+        self.tag_clicked_callback = tag_clicked_callback
+
+        def closed(event):
+            close_event_callback()
+
+        def clicked(event):
+            if event.inaxes != self.ax or self.tag_clicked_callback is None:
+                return
+            column = int(round(event.xdata))
+            if 0 <= column < len(self.tag_ids):
+                self.tag_clicked_callback(self.tag_ids[column])
+
+        self.fig.canvas.mpl_connect("close_event", closed)
+        self.fig.canvas.mpl_connect("button_press_event", clicked)
+        plt.show(block=False)
+
+    def set_data(self, metric, anchor_ids, tag_ids, values, selected_tag=None):
+        # values is a (len(anchor_ids), len(tag_ids)) array, nan where an
+        # anchor has not seen a tag.
+        title, colormap, vmin, vmax = HEATMAP_METRICS[metric]
+        relayout = (
+            self.image is None
+            or anchor_ids != self.anchor_ids
+            or tag_ids != self.tag_ids
+            or selected_tag != self.selected_tag
+            or self.image.get_cmap().name != colormap
+        )
+        if not plt.fignum_exists(self.fig.number):
+            return
+        masked = np.ma.masked_invalid(values)
+        if relayout:
+            self.anchor_ids = list(anchor_ids)
+            self.tag_ids = list(tag_ids)
+            self.selected_tag = selected_tag
+            self.ax.clear()
+            self.image = self.ax.imshow(
+                masked,
+                cmap=colormap,
+                vmin=vmin,
+                vmax=vmax,
+                aspect="auto",
+                interpolation="nearest",
+            )
+            if self.colorbar is None:
+                self.colorbar = self.fig.colorbar(self.image, ax=self.ax)
+                self.colorbar.ax.tick_params(colors="white")
+            else:
+                self.colorbar.update_normal(self.image)
+            self.ax.set_yticks(np.arange(len(anchor_ids)))
+            self.ax.set_yticklabels(
+                [REGISTRY.anchors.short_label(a) for a in anchor_ids], fontsize=8
+            )
+            self.ax.set_xticks(np.arange(len(tag_ids)))
+            self.ax.set_xticklabels(
+                [REGISTRY.tags.short_label(t) for t in tag_ids], rotation=90, fontsize=8
+            )
+            for tag_id, label in zip(tag_ids, self.ax.get_xticklabels()):
+                if tag_id == selected_tag:
+                    label.set_color("#ffd792")
+                    label.set_fontweight("bold")
+            self.ax.set_title("{} (click a tag to plot it)".format(title))
+            self.fig.canvas.draw()
+        else:
+            # The image covers the whole axes, no background to restore
+            self.image.set_data(masked)
+            self.ax.draw_artist(self.image)
+            self.fig.canvas.blit(self.ax.bbox)
+        self.fig.canvas.flush_events()
@@ -1,6 +1,8 @@
 import time
 from matplotlib import pyplot as plt
 import numpy as np
+from latency import LATENCY
+from tag_registry import REGISTRY
 
 
 class LivePlot:
@@ -59,6 +61,8 @@ class LivePlot:
             self.redraw_counter = self.redraw_counter + 1
             do_redraw = True if self.redraw_counter % 5 == 0 else False
 
+        if LATENCY.enabled and do_redraw:
+            LATENCY.mark("render")
         self.tags[tag_id].add_data(azimuth, elevation, do_redraw)
 
         if do_redraw:
@@ -70,7 +74,7 @@ class LivePlot:
                 stats_text = (
                     stats_text
                     + "{}\t{:.2f}({:.2f})\t\t{:.2f}({:.2f})\t\t\t{}\n".format(
-                        id,
+                        REGISTRY.tags.short_label(id),
                         round(np.mean(azim_data), 2),
                         round(abs(np.mean(azim_data) - azimith_gt), 2),
                         round(np.mean(elev_data), 2),
@@ -82,6 +86,8 @@ class LivePlot:
             self.text_stats.set_text(stats_text)
             self.stats_plt.draw_artist(self.text_stats)
             self.fig.canvas.blit(self.stats_plt.bbox)
+            if LATENCY.enabled:
+                LATENCY.record("render", "render")
 
     def save_snapshot_png(self, name):
         filename = "{}.png".format(name)
@@ -102,10 +108,16 @@ class LivePlot:
             self.max_data_len = max_data_len
 
             self.azim_plt = self.fig.add_subplot(
-                6, 2, index * 2 + 1, title="Azimuth {0} ".format(id)
+                6,
+                2,
+                index * 2 + 1,
+                title="Azimuth {0} ".format(REGISTRY.tags.label(id)),
             )
             self.elev_plt = self.fig.add_subplot(
-                6, 2, index * 2 + 2, title="Elevation {0} ".format(id)
+                6,
+                2,
+                index * 2 + 2,
+                title="Elevation {0} ".format(REGISTRY.tags.label(id)),
             )
 
             self.azim_plt.set_facecolor("#65494c")
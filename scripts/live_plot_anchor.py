@@ -1,6 +1,7 @@
 import time
 from matplotlib import pyplot as plt
 import numpy as np
+from tag_registry import REGISTRY
 
 
 class LivePlotAnchor:
@@ -15,6 +16,9 @@ class LivePlotAnchor:
         self.redraw_counter = 0
         self.max_anchors = max_anchors
         self.close_event_callback = close_event_callback
+        # Extra line shown below the anchor stats
+        self.status = ""
+        self.title = None
 
         # Adjust the padding around all subplots
         plt.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05, hspace=0.6)
@@ -57,31 +61,57 @@ class LivePlotAnchor:
             self.fig.canvas.draw()
         # Redrawing on every sample will cause delays.
         # This is a bit of a hack to just draw every 5 samples.
+        # A list of samples is already a batch, so it is always drawn.
         self.redraw_counter = self.redraw_counter + 1
-        do_redraw = True if self.redraw_counter % 5 == 0 else False
+        do_redraw = isinstance(azimuth, list) or self.redraw_counter % 5 == 0
         self.anchors[anchor_id].add_data(azimuth, elevation, do_redraw)
 
-        if do_redraw and plt.fignum_exists(self.fig.number):
+        if do_redraw:
+            self.draw_stats()
+
+    def set_anchor_data(self, anchor_id, azimuth, elevation, num_angles=None):
+        # Replaces the plotted history of an anchor, for data that is kept
+        # elsewhere, like in ring buffers.
+        if anchor_id not in self.anchors:
+            self.anchors[anchor_id] = self.TagGraphData(
+                anchor_id,
+                self.fig,
+                self.plot_hist_length,
+                len(self.anchors),
+                self.max_anchors,
+            )
+            self.fig.canvas.draw()
+        self.anchors[anchor_id].set_data(azimuth, elevation, num_angles)
+
+    def draw_stats(self):
+        if not plt.fignum_exists(self.fig.number):
+            return
+        stats_text = (
+            "Anchor\t\t\tMean Azimuth\tMean Elevation\tNum Angles\n".expandtabs()
+        )
+        stats_text = stats_text + "-" * 100 + "\n"
+        for id, tag in self.anchors.items():
+            azim_data = tag.get_azimuth_data()
+            elev_data = tag.get_elevation_data()
+            if len(azim_data) == 0:
+                continue
             stats_text = (
-                "Anchor\t\t\tMean Azimuth\tMean Elevation\tNum Angles\n".expandtabs()
+                stats_text
+                + "{}\t{:.2f}\t\t{:.2f}\t\t\t{}\n".format(
+                    REGISTRY.anchors.short_label(id),
+                    round(np.mean(azim_data), 2),
+                    round(np.mean(elev_data), 2),
+                    tag.get_num_angles(),
+                ).expandtabs()
             )
-            stats_text = stats_text + "-" * 100 + "\n"
-            for id, tag in self.anchors.items():
-                azim_data = tag.get_azimuth_data()
-                elev_data = tag.get_elevation_data()
-                stats_text = (
-                    stats_text
-                    + "{}\t{:.2f}\t\t{:.2f}\t\t\t{}\n".format(
-                        id,
-                        round(np.mean(azim_data), 2),
-                        round(np.mean(elev_data), 2),
-                        len(azim_data),
-                    ).expandtabs()
-                )
-            self.fig.canvas.restore_region(self.stats_pltbackground),
-            self.text_stats.set_text(stats_text)
-            self.stats_plt.draw_artist(self.text_stats)
-            self.fig.canvas.blit(self.stats_plt.bbox)
+        stats_text = stats_text + "\n" + self.status
+        self.fig.canvas.restore_region(self.stats_pltbackground),
+        self.text_stats.set_text(stats_text)
+        self.stats_plt.draw_artist(self.text_stats)
+        self.fig.canvas.blit(self.stats_plt.bbox)
+
+    def set_status(self, status):
+        self.status = status
 
     def save_snapshot_png(self, name):
         filename = "{}.png".format(name)
@@ -92,13 +122,16 @@ class LivePlotAnchor:
         plt.close()
 
     def set_title(self, title):
-        plt.gcf().text(
-            0.40,
-            0.99,
-            title,
-            va="top",
-            fontsize=14,
-        )
+        if self.title is None:
+            self.title = self.fig.text(
+                0.40,
+                0.99,
+                title,
+                va="top",
+                fontsize=14,
+            )
+        else:
+            self.title.set_text(title)
         self.fig.canvas.draw()
         self.fig.canvas.flush_events()
 
@@ -107,6 +140,7 @@ class LivePlotAnchor:
             self.id = id
             self.azimuth = []
             self.elevation = []
+            self.num_angles = None
             self.fig = fig
             self.max_data_len = max_data_len
 
@@ -116,12 +150,16 @@ class LivePlotAnchor:
             self.azim_plt.set_facecolor("#65494c")
             self.azim_plt.tick_params(axis="x", colors="white")
             self.azim_plt.tick_params(axis="y", colors="white")
-            self.azim_plt.set_title("Azimuth {0} ".format(id), fontsize=9)
+            self.azim_plt.set_title(
+                "Azimuth {0} ".format(REGISTRY.anchors.label(id)), fontsize=9
+            )
 
             self.elev_plt.set_facecolor("#65494c")
             self.elev_plt.tick_params(axis="x", colors="white")
             self.elev_plt.tick_params(axis="y", colors="white")
-            self.elev_plt.set_title("Elevation {0} ".format(id), fontsize=9)
+            self.elev_plt.set_title(
+                "Elevation {0} ".format(REGISTRY.anchors.label(id)), fontsize=9
+            )
 
             (self.azimuth_line,) = self.azim_plt.plot([], lw=2, color="#ffd792")
             (self.elevation_line,) = self.elev_plt.plot([], lw=2, color="#f98941")
@@ -173,15 +211,26 @@ class LivePlotAnchor:
             # Allow to input multiple data points at once.
             # Otherwise we would have to redraw for each individual sample which is slow.
             if isinstance(azimuth, list):
-                print("Is a list")
-                self.azimuth = self.azimuth + azimuth
-                self.elevation = self.elevation + elevation
-                azimuth = 0
-                elevation = 0
+                self.azimuth.extend(azimuth)
+                self.elevation.extend(elevation)
+                azimuth = self.azimuth[-1]
+                elevation = self.elevation[-1]
             else:
                 self.azimuth.append(azimuth)
                 self.elevation.append(elevation)
 
+            self.draw(azimuth, elevation, redraw)
+
+        def set_data(self, azimuth, elevation, num_angles=None):
+            self.azimuth = azimuth
+            self.elevation = elevation
+            self.num_angles = num_angles
+            if len(azimuth) == 0:
+                self.draw("", "")
+            else:
+                self.draw(azimuth[-1], elevation[-1])
+
+        def draw(self, azimuth, elevation, redraw=True):
             azim_to_plot = self.azimuth[-self.max_data_len :]
             elev_to_plot = self.elevation[-self.max_data_len :]
             self.x = np.linspace(0, len(azim_to_plot), num=len(azim_to_plot))
@@ -220,3 +269,8 @@ class LivePlotAnchor:
 
         def get_elevation_data(self):
             return self.elevation
+
+        def get_num_angles(self):
+            if self.num_angles is None:
+                return len(self.azimuth)
+            return self.num_angles
@@ -9,6 +9,110 @@ from pathlib import Path
 from antenna_controller import AntennaController
 from aoa_controller import AoAController
 from analyzer import AoATester
+from report_cache import ReportCache
+from sample_filters import FilterChain, filter_table
+from tag_registry import REGISTRY_FILE, load_registry
+from calibration import (
+    CALIBRATION_FILE,
+    Calibration,
+    antenna_serial,
+    load_calibration,
+    save_calibration,
+)
+from aoa_estimator import (
+    ESTIMATOR_METHODS,
+    ArrayGeometry,
+    estimate_table,
+    load_estimator,
+)
+
+
+def load_log_dir(
+    analyzer,
+    log_dir,
+    max_angle=90,
+    remove_90=False,
+    swap_angles=False,
+    use_cache=True,
+    estimator=None,
+    filters=None,
+    calibration=None,
+    calibrate=False,
+):
+    # Loads all <azimuth>_<tilt>.log files in log_dir into the analyzer, using the
+    # report cache when possible. Returns the total number of lines in the logs.
+    # Given an AoAEstimator the angles are re-estimated from the logged IQs,
+    # given a Calibration they are corrected with it, or with one fitted on
+    # them if calibrate, and given a FilterChain they are filtered per tag and
+    # position last.
+    logs = glob.glob(log_dir + "/*.log")
+    if len(logs) == 0:
+        print("No log files found in {}".format(log_dir))
+    logs_to_analyze = []
+    for logfile in logs:
+        filename = Path(logfile).name
+        ant_rotation = int(filename.split("_")[0])
+        antenna_tilt = int(filename.split("_")[1].split(".log")[0])
+        if abs(ant_rotation) <= int(max_angle) or abs(antenna_tilt) <= int(max_angle):
+            logs_to_analyze.append((logfile, ant_rotation, antenna_tilt))
+        else:
+            print("Skipping:", logfile)
+
+    cache = ReportCache(log_dir)
+    options = {
+        "antenna_upsidedown": analyzer.antenna_upside_down,
+        "swap_angles": swap_angles,
+        "remove_90": remove_90,
+    }
+    if estimator is not None:
+        options["estimator"] = estimator.options()
+    if filters is not None:
+        options["filters"] = filters.spec
+    if calibrate:
+        options["calibration"] = "fit"
+    elif calibration is not None:
+        options["calibration"] = calibration.options()
+    if analyzer.array_geometry is not None:
+        options["array"] = analyzer.array_geometry.options()
+    cache_key = cache.key([logfile for logfile, _, _ in logs_to_analyze], options)
+    cached = cache.load(cache_key) if use_cache else None
+    if cached is not None:
+        print("Using cached results from", cache.cache_dir)
+        sample_table, statistics, total_num_packets = cached
+        analyzer.set_cached_results(sample_table, statistics)
+        return total_num_packets
+
+    total_num_packets = 0
+    for logfile, ant_rotation, antenna_tilt in logs_to_analyze:
+        with open(logfile) as fp:
+            data = fp.readlines()
+            total_num_packets = total_num_packets + len(data)
+            analyzer.analyze_logs(
+                data,
+                False,
+                ant_rotation,
+                antenna_tilt,
+                remove_90,
+                swap_angles,
+            )
+    if estimator is not None:
+        analyzer.set_cached_results(
+            estimate_table(analyzer.get_sample_table(), estimator, swap_angles), None
+        )
+    if calibrate or calibration is not None:
+        analyzer.apply_calibration(None if calibrate else calibration)
+    if filters is not None:
+        analyzer.set_cached_results(
+            filter_table(analyzer.get_sample_table(), filters), None
+        )
+    cache.store(
+        cache_key,
+        analyzer.get_sample_table(),
+        analyzer.get_statistics(),
+        total_num_packets,
+    )
+    return total_num_packets
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="AoA Analyzer ")
@@ -55,41 +159,163 @@ if __name__ == "__main__":
         help="If azimuth and elevation should be swapped",
     )
 
+    parser.add_argument(
+        "--export_images",
+        dest="export_images",
+        default=None,
+        required=False,
+        help="Also save all report figures as PNGs in this folder.",
+    )
+
+    parser.add_argument(
+        "--vector_report",
+        dest="vector_report",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Write the report as vector graphics instead of PNG images. Exported figures are saved as SVG.",
+    )
+
+    parser.add_argument(
+        "--no_cache",
+        dest="no_cache",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Parse all logs again instead of using results cached in LOG_DIR/.report_cache.",
+    )
+
+    parser.add_argument(
+        "--estimator",
+        dest="estimator",
+        default="module",
+        choices=["module"] + ESTIMATOR_METHODS,
+        required=False,
+        help="Re-estimate the angles from the logged IQs on the host instead of using the angles of the module. Samples without IQs are left out.",
+    )
+
+    parser.add_argument(
+        "--array",
+        dest="array",
+        default=None,
+        required=False,
+        help="Json file with the antenna array geometry for --estimator and the IQ features, default a 4x4 array.",
+    )
+
+    parser.add_argument(
+        "--filters",
+        dest="filters",
+        default=None,
+        required=False,
+        help="Filters run per tag and position on the logged angles, like hampel:7:3,median:5 or kalman:0.5:3. One of median:size, hampel:size:n_sigmas, ema:alpha, kalman:process_std:measurement_std.",
+    )
+
+    parser.add_argument(
+        "--calibrate",
+        dest="calibrate",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Fit the mounting offset (yaw, pitch, roll) and angle scales of the antenna on this sweep, correct the angles with it and save it for the antenna in --calibration_file.",
+    )
+
+    parser.add_argument(
+        "--calibration_file",
+        dest="calibration_file",
+        default=CALIBRATION_FILE,
+        required=False,
+        help="Json file with the calibrations of every antenna serial. The calibration of the antenna in the logs is applied when it has one.",
+    )
+
+    parser.add_argument(
+        "--antenna_serial",
+        dest="antenna_serial",
+        default=None,
+        required=False,
+        help="Serial the calibration is saved and looked up under, default the anchor id in the logs.",
+    )
+
+    parser.add_argument(
+        "--no_calibration",
+        dest="no_calibration",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Do not apply the saved calibration of the antenna.",
+    )
+
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        default=REGISTRY_FILE,
+        required=False,
+        help="Json file with the friendly name, expected position and TX power of tags and the name of anchors, default tags.json next to the scripts if it exists.",
+    )
+
     args = parser.parse_args()
+    load_registry(args.tags)
     print("Max angle:", args.max_angle)
     print("Log dir:", args.log_dir)
 
-    analyzer = AoATester(None, None, None, args.antenna_upsidedown, False, True)
-    logs = glob.glob(args.log_dir + "/*.log")
-    if len(logs) == 0:
-        print("No log files found in {}".format(args.log_dir))
-    total_num_packets = 0
-    for logfile in logs:
-        filename = Path(logfile).name
-        ant_rotation = int(filename.split("_")[0])
-        antenna_tilt = int(filename.split("_")[1].split(".log")[0])
-        if abs(ant_rotation) <= int(args.max_angle) or abs(antenna_tilt) <= int(
-            args.max_angle
-        ):
-            with open(logfile) as fp:
-                data = fp.readlines()
-                total_num_packets = total_num_packets + len(data)
-                analyzer.analyze_logs(
-                    data,
-                    False,
-                    ant_rotation,
-                    antenna_tilt,
-                    args.remove_90,
-                    args.swap_angles,
-                )
-        else:
-            print("Skipping:", logfile)
+    analyzer = AoATester(
+        None,
+        None,
+        None,
+        args.antenna_upsidedown,
+        None,
+        True,
+        args.export_images,
+        args.vector_report,
+    )
+    if args.array is not None:
+        analyzer.set_array_geometry(ArrayGeometry.load(args.array))
+    filters = None
+    if args.filters is not None:
+        filters = FilterChain.from_spec(args.filters)
+        analyzer.set_filters(filters)
+    serial = args.antenna_serial
+    for logfile in sorted(glob.glob(args.log_dir + "/*.log")):
+        if serial is not None:
+            break
+        with open(logfile) as fp:
+            serial = antenna_serial(fp)
+    if args.calibrate and serial is None:
+        parser.error("No anchor id in the logs, give --antenna_serial to calibrate")
+    calibration = None
+    if not args.calibrate and not args.no_calibration:
+        calibration = load_calibration(serial, args.calibration_file)
+        if calibration is not None:
+            print("Applying the calibration of antenna", serial)
+    total_num_packets = load_log_dir(
+        analyzer,
+        args.log_dir,
+        args.max_angle,
+        args.remove_90,
+        args.swap_angles,
+        not args.no_cache,
+        load_estimator(args.estimator, args.array),
+        filters,
+        calibration,
+        args.calibrate,
+    )
+    if args.calibrate:
+        calibration = Calibration(
+            **analyzer.get_statistics()["calibration"]["parameters"]
+        )
+        save_calibration(serial, calibration, args.calibration_file)
+        print("Saved the calibration of antenna", serial, calibration.options())
     analyzer.create_plots(show_plots=False, summary_only=True)
     analyzer.create_plots(show_plots=False, summary_only=True, distribution_plot=True)
 
     analyzer.create_pdf_report(
         os.path.join(
-            args.log_dir, "log_analyzis_report_{}_packets".format(total_num_packets)
+            args.log_dir,
+            "log_analyzis_report_{}_packets{}{}{}".format(
+                total_num_packets,
+                "" if args.estimator == "module" else "_" + args.estimator,
+                "" if calibration is None else "_calibrated",
+                "" if filters is None else "_filtered",
+            ),
         )
     )
     analyzer.delete_created_images()
@@ -0,0 +1,168 @@
+import os
+import queue
+import re
+import threading
+import time
+
+# Buffered lines are written to the file when they reach this size, or when
+# the oldest of them is this old.
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+# A log file is rotated to <name>.log.<n> when it grows past this size
+DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+# Anchor ids are the 12 hex digits of a MAC address. They come from the
+# network and become file names, URCs with any other anchor id are logged to
+# INVALID_ANCHOR_NAME instead so a crafted id cannot write outside the folder.
+ANCHOR_ID_PATTERN = re.compile(r"[0-9A-Fa-f]{12}")
+INVALID_ANCHOR_NAME = "invalid_anchor"
+# Batches kept waiting for the writer thread before new ones are dropped
+DEFAULT_MAX_PENDING_BATCHES = 2000
+
+
+class RotatingLogWriter:
+    # Appends lines to <folder_path>/<name>.log through a small in-memory
+    # buffer. Full files are renamed to <name>.log.1, <name>.log.2, ... and a
+    # new <name>.log is started, nothing is ever deleted.
+    def __init__(
+        self,
+        folder_path,
+        name,
+        flush_bytes=DEFAULT_FLUSH_BYTES,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_file_bytes=DEFAULT_MAX_FILE_BYTES,
+    ):
+        self.path = os.path.join(folder_path, "{}.log".format(name))
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.file = open(self.path, "a")
+        self.file_bytes = self.file.tell()
+        self.num_rotated = 0
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.buffer_since = None
+
+    def write_lines(self, lines):
+        if len(lines) == 0:
+            return
+        if self.buffer_since is None:
+            self.buffer_since = time.time()
+        self.buffer.extend(lines)
+        self.buffer_bytes = self.buffer_bytes + sum(len(line) for line in lines)
+        if self.buffer_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush_if_due(self, now=None):
+        now = time.time() if now is None else now
+        if (
+            self.buffer_since is not None
+            and now - self.buffer_since >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            if self.file_bytes + self.buffer_bytes > self.max_file_bytes:
+                self.rotate()
+            self.file.write("".join(self.buffer))
+            self.file_bytes = self.file_bytes + self.buffer_bytes
+            self.buffer = []
+            self.buffer_bytes = 0
+            self.buffer_since = None
+        # Hand the data to the OS, so it survives a crash of the script
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        self.num_rotated = self.num_rotated + 1
+        while os.path.exists("{}.{}".format(self.path, self.num_rotated)):
+            self.num_rotated = self.num_rotated + 1
+        os.rename(self.path, "{}.{}".format(self.path, self.num_rotated))
+        self.file = open(self.path, "a")
+        self.file_bytes = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class AnchorLogWriters:
+    # One RotatingLogWriter per anchor in folder_path, opened on the first URC
+    # from that anchor. Can be written from the receiver thread while another
+    # thread calls flush_if_due.
+    def __init__(self, folder_path, **writer_options):
+        self.folder_path = folder_path
+        self.writer_options = writer_options
+        os.makedirs(folder_path, exist_ok=True)
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def write_batch(self, anchor_ids, urcs):
+        lines = {}
+        for anchor_id, urc in zip(anchor_ids, urcs):
+            if ANCHOR_ID_PATTERN.fullmatch(anchor_id) is None:
+                anchor_id = INVALID_ANCHOR_NAME
+            if anchor_id not in lines:
+                lines[anchor_id] = []
+            lines[anchor_id].append(urc + "\n")
+        with self.lock:
+            for anchor_id, anchor_lines in lines.items():
+                if anchor_id not in self.writers:
+                    self.writers[anchor_id] = RotatingLogWriter(
+                        self.folder_path, anchor_id, **self.writer_options
+                    )
+                self.writers[anchor_id].write_lines(anchor_lines)
+
+    def flush_if_due(self):
+        now = time.time()
+        with self.lock:
+            for writer in self.writers.values():
+                writer.flush_if_due(now)
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = {}
+
+
+class QueuedLogWriters:
+    # AnchorLogWriters written on a thread of its own. write_batch only
+    # queues the batch, so the thread receiving packets never waits for a
+    # flush, rotate or a slow disk. At most max_pending batches are queued,
+    # when the disk does not keep up new ones are dropped and counted in
+    # dropped.
+    def __init__(
+        self, folder_path, max_pending=DEFAULT_MAX_PENDING_BATCHES, **writer_options
+    ):
+        self.writers = AnchorLogWriters(folder_path, **writer_options)
+        self.batches = queue.Queue(maxsize=max_pending)
+        # URCs not logged because the queue was full
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write_batch(self, anchor_ids, urcs):
+        try:
+            self.batches.put_nowait((anchor_ids, urcs))
+        except queue.Full:
+            self.dropped = self.dropped + len(urcs)
+
+    def __run(self):
+        while True:
+            try:
+                batch = self.batches.get(timeout=DEFAULT_FLUSH_INTERVAL / 4)
+            except queue.Empty:
+                batch = ()
+            if batch is None:
+                break
+            if len(batch) > 0:
+                self.writers.write_batch(*batch)
+            self.writers.flush_if_due()
+
+    def close(self):
+        # Writes everything queued before returning
+        self.batches.put(None)
+        self.thread.join()
+        self.writers.close()
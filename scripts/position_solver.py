@@ -0,0 +1,183 @@
+import json
+import numpy as np
+
+# Rays closer to parallel than this (sine of the angle between them) do not
+# fix a position.
+MIN_RAY_ANGLE_SIN = 1e-3
+
+
+def rotation_matrix(yaw, pitch, roll):
+    # Rotation from the anchor frame to the world frame, angles in degrees.
+    # Applied as roll around x, then pitch around y, then yaw around z.
+    yaw, pitch, roll = np.radians([yaw, pitch, roll])
+    rz = np.array(
+        [
+            [np.cos(yaw), -np.sin(yaw), 0],
+            [np.sin(yaw), np.cos(yaw), 0],
+            [0, 0, 1],
+        ]
+    )
+    ry = np.array(
+        [
+            [np.cos(pitch), 0, np.sin(pitch)],
+            [0, 1, 0],
+            [-np.sin(pitch), 0, np.cos(pitch)],
+        ]
+    )
+    rx = np.array(
+        [
+            [1, 0, 0],
+            [0, np.cos(roll), -np.sin(roll)],
+            [0, np.sin(roll), np.cos(roll)],
+        ]
+    )
+    return rz @ ry @ rx
+
+
+def load_anchor_poses(path):
+    # Anchor poses from a json file like
+    # {"CD84C98B935D": {"position": [0, 0, 2.5], "yaw": 0, "pitch": 90, "roll": 0}}
+    # Positions are in meters, angles in degrees, missing angles are 0.
+    with open(path) as fp:
+        config = json.load(fp)
+    poses = {}
+    for anchor_id, pose in config.items():
+        poses[anchor_id] = (
+            np.array(pose["position"], dtype=np.float64),
+            rotation_matrix(
+                pose.get("yaw", 0), pose.get("pitch", 0), pose.get("roll", 0)
+            ),
+        )
+    return poses
+
+
+def angles_to_directions(azimuth, elevation):
+    # Unit vectors in the anchor frame. The antenna boresight is +x, azimuth
+    # turns towards +y and elevation towards +z, both in degrees.
+    azimuth = np.radians(np.asarray(azimuth, dtype=np.float64))
+    elevation = np.radians(np.asarray(elevation, dtype=np.float64))
+    cos_elevation = np.cos(elevation)
+    return np.stack(
+        (
+            cos_elevation * np.cos(azimuth),
+            cos_elevation * np.sin(azimuth),
+            np.sin(elevation),
+        ),
+        axis=-1,
+    )
+
+
+def intersect_rays(origins, directions, groups, num_groups):
+    # Least squares intersection of the rays in every group, all groups at
+    # once. The point p closest to rays (a, d) solves
+    # sum(I - d d^T) p = sum((I - d d^T) a).
+    # directions must be unit vectors, groups gives the group of every ray.
+    # Returns the (num_groups, 3) points, the rms distance from each point to
+    # its rays and which groups could be solved.
+    projections = np.eye(3) - directions[:, :, None] * directions[:, None, :]
+    lhs = np.zeros((num_groups, 3, 3))
+    rhs = np.zeros((num_groups, 3))
+    np.add.at(lhs, groups, projections)
+    np.add.at(rhs, groups, np.einsum("nij,nj->ni", projections, origins))
+    num_rays = np.bincount(groups, minlength=num_groups)
+
+    # With two or more non parallel rays the smallest eigenvalue of lhs is
+    # clearly above 0.
+    solvable = (num_rays >= 2) & (np.linalg.eigvalsh(lhs)[:, 0] > MIN_RAY_ANGLE_SIN**2)
+    points = np.full((num_groups, 3), np.nan)
+    if np.any(solvable):
+        solved = np.linalg.solve(lhs[solvable], rhs[solvable][:, :, None])
+        points[solvable] = solved[:, :, 0]
+
+    offsets = np.einsum("nij,nj->ni", projections, points[groups] - origins)
+    squared = np.bincount(
+        groups, weights=np.sum(offsets * offsets, axis=1), minlength=num_groups
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        residuals = np.sqrt(squared / num_rays)
+    return points, residuals, solvable
+
+
+class PositionSolver:
+    # Estimates tag positions from the angles a tag is seen at by several
+    # anchors within a time window.
+    def __init__(self, anchor_poses):
+        # anchor_poses is a dict of anchor_id to (position, rotation), as
+        # given by load_anchor_poses
+        self.anchor_ids = list(anchor_poses)
+        self.anchor_index = {
+            anchor_id: i for i, anchor_id in enumerate(self.anchor_ids)
+        }
+        self.anchor_positions = np.array([anchor_poses[a][0] for a in self.anchor_ids])
+        self.anchor_rotations = np.array([anchor_poses[a][1] for a in self.anchor_ids])
+
+    def solve_window(self, anchor_ids, tag_ids, azimuth, elevation):
+        # Samples of one time window, one entry per sample. Samples from
+        # anchors without a pose are ignored. The directions from an anchor to
+        # a tag are averaged to one ray, then the rays of every tag are
+        # intersected. Returns a dict of tag, as given in tag_ids, to
+        # (position, rms distance to the rays, number of anchors).
+        anchors = np.fromiter(
+            (self.anchor_index.get(anchor_id, -1) for anchor_id in anchor_ids),
+            np.int64,
+            len(anchor_ids),
+        )
+        known = anchors >= 0
+        if not np.any(known):
+            return {}
+        tag_names, tags = np.unique(np.asarray(tag_ids)[known], return_inverse=True)
+        anchors = anchors[known]
+        directions = np.einsum(
+            "nij,nj->ni",
+            self.anchor_rotations[anchors],
+            angles_to_directions(
+                np.asarray(azimuth)[known], np.asarray(elevation)[known]
+            ),
+        )
+
+        # One ray per (tag, anchor) with the mean direction
+        pairs, rays = np.unique(
+            tags * len(self.anchor_ids) + anchors, return_inverse=True
+        )
+        mean_directions = np.zeros((len(pairs), 3))
+        np.add.at(mean_directions, rays, directions)
+        mean_directions = mean_directions / np.linalg.norm(
+            mean_directions, axis=1, keepdims=True
+        )
+        ray_tags = pairs // len(self.anchor_ids)
+        ray_anchors = pairs % len(self.anchor_ids)
+
+        points, residuals, solvable = intersect_rays(
+            self.anchor_positions[ray_anchors],
+            mean_directions,
+            ray_tags,
+            len(tag_names),
+        )
+        num_anchors = np.bincount(ray_tags, minlength=len(tag_names))
+        return {
+            tag_names[i].item(): (points[i], residuals[i], int(num_anchors[i]))
+            for i in np.flatnonzero(solvable)
+        }
+
+
+class AlphaBetaFilter:
+    # Constant velocity alpha-beta filter per tag, smooths the solved positions
+    # between windows.
+    def __init__(self, alpha=0.5, beta=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        # tag_id -> (position, velocity, time)
+        self.states = {}
+
+    def update(self, tag_id, position, time):
+        if tag_id not in self.states:
+            self.states[tag_id] = (position, np.zeros(3), time)
+            return position
+        last_position, velocity, last_time = self.states[tag_id]
+        dt = max(time - last_time, 1e-3)
+        predicted = last_position + velocity * dt
+        residual = position - predicted
+        filtered = predicted + self.alpha * residual
+        velocity = velocity + self.beta * residual / dt
+        self.states[tag_id] = (filtered, velocity, time)
+        return filtered
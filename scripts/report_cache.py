@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+from sample_table import SampleTable
+
+CACHE_DIR_NAME = ".report_cache"
+# Bump when the content of the cached statistics changes
+CACHE_VERSION = 11
+
+
+class ReportCache:
+    # Caches the parsed samples and the statistics computed from them next to
+    # the logs, so that re-running a report only has to redo the plotting.
+    # Entries are named after a hash of the log contents and the analysis
+    # options, any change to either gives a new key.
+    def __init__(self, log_dir):
+        self.cache_dir = os.path.join(log_dir, CACHE_DIR_NAME)
+        self.manifest_path = os.path.join(self.cache_dir, "files.json")
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as manifest_file:
+                    self.manifest = json.load(manifest_file)
+            except ValueError:
+                self.manifest = {}
+
+    def __file_hash(self, log_file):
+        # Content hashing is skipped for files with the same size and mtime as
+        # last time, that is what makes a cache hit cheap.
+        name = Path(log_file).name
+        stat = os.stat(log_file)
+        entry = self.manifest.get(name)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return entry["sha1"]
+        with open(log_file, "rb") as fp:
+            sha1 = hashlib.sha1(fp.read()).hexdigest()
+        self.manifest[name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha1": sha1,
+        }
+        return sha1
+
+    def __logs_key(self, log_files):
+        logs_hash = hashlib.sha1()
+        for log_file in sorted(log_files):
+            logs_hash.update(Path(log_file).name.encode())
+            logs_hash.update(self.__file_hash(log_file).encode())
+        return logs_hash.hexdigest()[:16]
+
+    def key(self, log_files, options):
+        options_hash = hashlib.sha1(
+            json.dumps([CACHE_VERSION, options], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        return "{}_{}".format(self.__logs_key(log_files), options_hash)
+
+    def load(self, key):
+        samples_path = os.path.join(self.cache_dir, "{}.npz".format(key))
+        statistics_path = os.path.join(self.cache_dir, "{}.pickle".format(key))
+        if not os.path.exists(samples_path) or not os.path.exists(statistics_path):
+            return None
+        try:
+            sample_table = SampleTable.load(samples_path)
+            with open(statistics_path, "rb") as fp:
+                entry = pickle.load(fp)
+        except Exception as e:
+            print("Ignoring broken cache entry {}: {}".format(key, e))
+            return None
+        return (sample_table, entry["statistics"], entry["num_packets"])
+
+    def store(self, key, sample_table, statistics, num_packets):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Entries made from other log contents can never be hit again
+        logs_key = key.split("_")[0]
+        for file in os.listdir(self.cache_dir):
+            if file != "files.json" and not file.startswith(logs_key):
+                os.remove(os.path.join(self.cache_dir, file))
+
+        sample_table.save(os.path.join(self.cache_dir, "{}.npz".format(key)))
+        with open(os.path.join(self.cache_dir, "{}.pickle".format(key)), "wb") as fp:
+            pickle.dump({"statistics": statistics, "num_packets": num_packets}, fp)
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
@@ -0,0 +1,98 @@
+import io
+import os
+import zlib
+from matplotlib import pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from fpdf import FPDF
+from PIL import Image
+
+
+class BufferedFPDF(FPDF):
+    # FPDF 1.7.2 can only read images from a path on disk, this lets us hand it
+    # PNGs that are already rendered into memory instead.
+    def image_buffer(self, key, buffer, x, y, w, h=0):
+        if key not in self.images:
+            buffer.seek(0)
+            # Flatten to RGB here, FPDF splits the alpha channel of a PNG row by
+            # row in Python which is what makes big reports so slow.
+            img = Image.open(buffer).convert("RGB")
+            self.images[key] = {
+                "i": len(self.images) + 1,
+                "w": img.width,
+                "h": img.height,
+                "cs": "DeviceRGB",
+                "bpc": 8,
+                "f": "FlateDecode",
+                "data": zlib.compress(img.tobytes()),
+            }
+        self.image(key, x, y, w, h, type="png")
+
+
+class RasterReport:
+    def __init__(self, export_dir=None):
+        # List of (image name, BytesIO with the PNG)
+        self.images = []
+        self.export_dir = export_dir
+
+    def add_figure(self, name, fig=None):
+        if fig is None:
+            fig = plt.gcf()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        self.images.append((name, buffer))
+        if self.export_dir is not None:
+            os.makedirs(self.export_dir, exist_ok=True)
+            with open(os.path.join(self.export_dir, name), "wb") as image_file:
+                image_file.write(buffer.getvalue())
+        return name
+
+    def save(self, filename):
+        pdf = BufferedFPDF()
+        for index, (name, buffer) in enumerate(self.images):
+            pdf.add_page()
+            # 210 is width of A4 page, height is given by the image aspect ratio
+            pdf.image_buffer("{}_{}".format(index, name), buffer, 0, 0, 210)
+        pdf.output(filename, "F")
+        return filename
+
+    def clear(self):
+        self.images = []
+
+    def __len__(self):
+        return len(self.images)
+
+
+class VectorReport:
+    # Writes figures as vector graphics straight into a multi-page PDF,
+    # each page gets the size of the figure that is drawn on it.
+    def __init__(self, export_dir=None):
+        self.export_dir = export_dir
+        self.clear()
+
+    def add_figure(self, name, fig=None):
+        if fig is None:
+            fig = plt.gcf()
+        self.pages.savefig(fig)
+        self.num_pages = self.num_pages + 1
+        if self.export_dir is not None:
+            os.makedirs(self.export_dir, exist_ok=True)
+            fig.savefig(
+                os.path.join(
+                    self.export_dir, "{}.svg".format(os.path.splitext(name)[0])
+                )
+            )
+        return name
+
+    def save(self, filename):
+        self.pages.close()
+        with open(filename, "wb") as pdf_file:
+            pdf_file.write(self.buffer.getvalue())
+        return filename
+
+    def clear(self):
+        self.buffer = io.BytesIO()
+        self.pages = PdfPages(self.buffer)
+        self.num_pages = 0
+
+    def __len__(self):
+        return self.num_pages
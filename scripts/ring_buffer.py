@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class KeyedRingBuffers:
+    # Keeps the last capacity samples of a few numeric columns for every key,
+    # like (anchor_id, tag_id). Every key owns one row of preallocated 2D
+    # arrays and is routed to it through a dict, so adding samples never
+    # searches or reallocates per sample.
+    def __init__(self, capacity, columns, initial_rows=16):
+        # columns is a dict of column name to numpy dtype
+        self.capacity = capacity
+        self.index = {}
+        self.keys = []
+        self.data = {
+            name: np.zeros((initial_rows, capacity), dtype=dtype)
+            for name, dtype in columns.items()
+        }
+        # Total number of samples ever written per row
+        self.counts = np.zeros(initial_rows, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def row(self, key):
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.counts):
+                # Double the rows, amortised O(1) per new key
+                for name, values in self.data.items():
+                    self.data[name] = np.concatenate((values, np.zeros_like(values)))
+                self.counts = np.concatenate((self.counts, np.zeros_like(self.counts)))
+            self.index[key] = row
+            self.keys.append(key)
+        return row
+
+    def extend(self, keys, columns):
+        # keys holds the key of every sample, columns the sample values per
+        # column name. Samples keep their order within every key.
+        if len(keys) == 0:
+            return
+        rows = np.fromiter((self.row(key) for key in keys), np.int64, len(keys))
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+        sizes = np.diff(np.r_[starts, len(rows)])
+        rank = np.arange(len(rows)) - np.repeat(starts, sizes)
+        # Only the last capacity samples of a key can end up in its row
+        keep = rank >= np.repeat(sizes, sizes) - self.capacity
+        slots = (self.counts[sorted_rows] + rank) % self.capacity
+        for name, values in columns.items():
+            self.data[name][sorted_rows[keep], slots[keep]] = np.asarray(values)[
+                order[keep]
+            ]
+        self.counts[sorted_rows[starts]] += sizes
+
+    def append(self, key, values):
+        # Adds one sample, values is a dict of column name to value. Cheaper
+        # than extend for a single sample.
+        row = self.row(key)
+        slot = self.counts[row] % self.capacity
+        for name, value in values.items():
+            self.data[name][row, slot] = value
+        self.counts[row] += 1
+
+    def window(self, key, name):
+        # The valid samples of a key in storage order, for when the order
+        # does not matter
+        row = self.index[key]
+        return self.data[name][row, : min(self.counts[row], self.capacity)]
+
+    def clear(self, key):
+        # Forgets the samples of a key, the key keeps its row
+        if key in self.index:
+            self.counts[self.index[key]] = 0
+
+    def lengths(self):
+        # Number of valid samples per row
+        return np.minimum(self.counts[: len(self.keys)], self.capacity)
+
+    def get(self, key, name):
+        # The valid samples of a key, oldest first
+        row = self.index[key]
+        count = self.counts[row]
+        if count <= self.capacity:
+            return self.data[name][row, :count]
+        first = count % self.capacity
+        return np.roll(self.data[name][row], -first)
+
+    def total(self, key):
+        return int(self.counts[self.index[key]])
+
+    def mean(self, name):
+        # Mean over the valid samples of every row, nan for empty rows
+        lengths = self.lengths()
+        valid = np.arange(self.capacity) < lengths[:, None]
+        values = self.data[name][: len(self.keys)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(valid, values, 0).sum(axis=1) / lengths
+
+    def std(self, name):
+        lengths = self.lengths()
+        valid = np.arange(self.capacity) < lengths[:, None]
+        values = self.data[name][: len(self.keys)].astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(valid, values, 0).sum(axis=1) / lengths
+            deviation = np.where(valid, values - mean[:, None], 0)
+            return np.sqrt((deviation * deviation).sum(axis=1) / lengths)
@@ -0,0 +1,153 @@
+import numpy as np
+
+# Width in dB of the RSSI bins
+RSSI_BIN_DB = 2
+# Percentiles of the absolute error in every bin
+RSSI_PERCENTILES = [50, 90]
+# Bins with fewer samples are left out of the model fit and the plots
+MIN_BIN_SAMPLES = 20
+# RSSI the noise term of the error model is relative to
+MODEL_REFERENCE_RSSI = -60
+# The spec the model is solved for: 90% of the errors within 10 degrees
+SPEC_PERCENTILE = 90
+SPEC_ERROR = 10
+# Bluetooth receivers get no samples below about this RSSI, a model that
+# only reaches the spec below it meets the spec at every RSSI
+MIN_RSSI = -105
+
+
+def rssi_edges(values):
+    # Edges of RSSI_BIN_DB wide bins covering values, on multiples of
+    # RSSI_BIN_DB so bins line up between tags and campaigns
+    low = int(np.floor(values.min() / RSSI_BIN_DB)) * RSSI_BIN_DB
+    high = int(np.floor(values.max() / RSSI_BIN_DB)) * RSSI_BIN_DB + RSSI_BIN_DB
+    return np.arange(low, high + 1, RSSI_BIN_DB)
+
+
+def binned_errors(groups, bins, errors, num_groups, num_bins):
+    # Count, mean and RSSI_PERCENTILES of the absolute errors per (group, bin)
+    # as (num_groups, num_bins) arrays, NaN for empty cells. Errors are whole
+    # degrees like get_errors gives them, so one sort of cell * span + error
+    # puts the errors of every cell in order; the percentiles are then read
+    # at their rank like np.percentile does.
+    errors = np.abs(errors).astype(np.int64)
+    span = int(errors.max()) + 1
+    keys = np.sort((groups.astype(np.int64) * num_bins + bins) * span + errors)
+    cells = keys // span
+    sorted_errors = (keys - cells * span).astype(np.float64)
+    starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    used = cells[starts]
+    result = {"count": np.zeros(num_groups * num_bins, dtype=np.int64)}
+    result["count"][used] = counts
+    result["mean"] = np.full(num_groups * num_bins, np.nan)
+    result["mean"][used] = np.add.reduceat(sorted_errors, starts) / counts
+    for percentile in RSSI_PERCENTILES:
+        rank = (counts - 1) * percentile / 100
+        lower = np.floor(rank).astype(np.int64)
+        upper = np.minimum(lower + 1, counts - 1)
+        fraction = rank - lower
+        name = "p{}".format(percentile)
+        result[name] = np.full(num_groups * num_bins, np.nan)
+        result[name][used] = (
+            sorted_errors[starts + lower] * (1 - fraction)
+            + sorted_errors[starts + upper] * fraction
+        )
+    return {
+        name: values.reshape(num_groups, num_bins) for name, values in result.items()
+    }
+
+
+def fit_error_model(centers, errors, counts):
+    # Least squares fit of errors = a + b * 10 ** ((MODEL_REFERENCE_RSSI -
+    # rssi) / 20) over the bins with enough samples, weighted by their sample
+    # counts. The angle noise of an array grows with the inverse of the signal
+    # amplitude, b is that noise at MODEL_REFERENCE_RSSI and a the error
+    # left at strong signals. Returns (a, b), None with less than 2 bins.
+    keep = (counts >= MIN_BIN_SAMPLES) & ~np.isnan(errors)
+    if np.count_nonzero(keep) < 2:
+        return None
+    weights = np.sqrt(counts[keep])
+    design = np.stack(
+        [
+            np.ones(np.count_nonzero(keep)),
+            10 ** ((MODEL_REFERENCE_RSSI - centers[keep]) / 20),
+        ],
+        axis=1,
+    )
+    (a, b), _, _, _ = np.linalg.lstsq(
+        design * weights[:, None], errors[keep] * weights, rcond=None
+    )
+    return (float(a), float(b))
+
+
+def model_errors(model, rssi):
+    a, b = model
+    return a + b * 10 ** ((MODEL_REFERENCE_RSSI - np.asarray(rssi)) / 20)
+
+
+def spec_rssi(model):
+    # RSSI where the error of the model reaches SPEC_ERROR, the antenna is out
+    # of spec below it. None if the model does not cross it between MIN_RSSI
+    # and 0 dBm.
+    if model is None:
+        return None
+    a, b = model
+    if b <= 0 or a >= SPEC_ERROR:
+        return None
+    rssi = MODEL_REFERENCE_RSSI - 20 * np.log10((SPEC_ERROR - a) / b)
+    if rssi < MIN_RSSI or rssi > 0:
+        return None
+    return float(rssi)
+
+
+def rssi_errors(samples, azimuth_errors, elevation_errors):
+    # Absolute errors per RSSI bin of every tag and of all tags together,
+    # for the rssi and, when the module reports it, the rssi2 column. The
+    # SPEC_PERCENTILE error per rssi bin of every tag is fitted with
+    # fit_error_model. None without samples.
+    if len(samples) == 0:
+        return None
+    axes = {"azimuth": azimuth_errors, "elevation": elevation_errors}
+    tags = samples["tag"]
+    everything = np.zeros(len(samples), dtype=np.int64)
+    statistics = {"tag_ids": samples.tag_ids, "columns": {}, "models": {}}
+    for column in ["rssi", "rssi2"]:
+        values = samples[column]
+        if column == "rssi2" and not np.any(values != 0):
+            # rssi2 is 0 when the module does not report it
+            continue
+        edges = rssi_edges(values)
+        bins = np.digitize(values, edges) - 1
+        statistics["columns"][column] = {
+            "edges": edges,
+            "centers": (edges[:-1] + edges[1:]) / 2,
+            "tags": {},
+            "all": {},
+        }
+        for axis, errors in axes.items():
+            statistics["columns"][column]["tags"][axis] = binned_errors(
+                tags, bins, errors, len(samples.tag_ids), len(edges) - 1
+            )
+            statistics["columns"][column]["all"][axis] = {
+                name: binned[0]
+                for name, binned in binned_errors(
+                    everything, bins, errors, 1, len(edges) - 1
+                ).items()
+            }
+
+    rssi = statistics["columns"]["rssi"]
+    for tag, tag_id in enumerate(samples.tag_ids):
+        statistics["models"][tag_id] = {}
+        for axis in axes:
+            binned = rssi["tags"][axis]
+            model = fit_error_model(
+                rssi["centers"],
+                binned["p{}".format(SPEC_PERCENTILE)][tag],
+                binned["count"][tag],
+            )
+            statistics["models"][tag_id][axis] = {
+                "model": model,
+                "spec_rssi": spec_rssi(model),
+            }
+    return statistics
@@ -0,0 +1,210 @@
+import numpy as np
+from ring_buffer import KeyedRingBuffers
+from sample_table import SampleTable
+
+# Columns of the sample windows of every tag
+WINDOW_COLUMNS = {"azimuth": np.float64, "elevation": np.float64}
+# Scales the median absolute deviation to the standard deviation of normal
+# distributed samples
+MAD_SCALE = 1.4826
+# Lower bound of the robust standard deviation of the Hampel filter. Angles
+# are whole degrees, a window of equal angles has no deviation at all.
+HAMPEL_MIN_STD = 1.0
+
+
+def median(values):
+    # Median of a short list, faster than np.median for a handful of values
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+class MedianFilter:
+    # Median of the last size samples of a tag
+    def __init__(self, size=5):
+        self.size = int(size)
+        self.windows = KeyedRingBuffers(self.size, WINDOW_COLUMNS)
+
+    def reset(self):
+        self.windows = KeyedRingBuffers(self.size, WINDOW_COLUMNS)
+
+    def apply(self, key, azimuth, elevation):
+        self.windows.append(key, {"azimuth": azimuth, "elevation": elevation})
+        return (
+            median(self.windows.window(key, "azimuth").tolist()),
+            median(self.windows.window(key, "elevation").tolist()),
+        )
+
+
+class HampelFilter:
+    # Rejects samples further than n_sigmas robust standard deviations (from
+    # the median absolute deviation) from the median of the last size samples
+    # of a tag. Rejected samples stay in the window.
+    def __init__(self, size=7, n_sigmas=3.0):
+        self.size = int(size)
+        self.n_sigmas = float(n_sigmas)
+        self.windows = KeyedRingBuffers(self.size, WINDOW_COLUMNS)
+
+    def reset(self):
+        self.windows = KeyedRingBuffers(self.size, WINDOW_COLUMNS)
+
+    def is_outlier(self, value, window):
+        center = median(window)
+        deviation = max(
+            median([abs(v - center) for v in window]) * MAD_SCALE, HAMPEL_MIN_STD
+        )
+        return abs(value - center) > self.n_sigmas * deviation
+
+    def apply(self, key, azimuth, elevation):
+        self.windows.append(key, {"azimuth": azimuth, "elevation": elevation})
+        azimuths = self.windows.window(key, "azimuth").tolist()
+        if len(azimuths) < 3:
+            return (azimuth, elevation)
+        elevations = self.windows.window(key, "elevation").tolist()
+        if self.is_outlier(azimuth, azimuths) or self.is_outlier(elevation, elevations):
+            return None
+        return (azimuth, elevation)
+
+
+class EmaFilter:
+    # Exponential moving average per tag, alpha is the weight of a new sample
+    def __init__(self, alpha=0.3):
+        self.alpha = float(alpha)
+        self.state = {}
+
+    def reset(self):
+        self.state = {}
+
+    def apply(self, key, azimuth, elevation):
+        state = self.state.get(key)
+        if state is None:
+            state = self.state[key] = [azimuth, elevation]
+        else:
+            state[0] = state[0] + self.alpha * (azimuth - state[0])
+            state[1] = state[1] + self.alpha * (elevation - state[1])
+        return (state[0], state[1])
+
+
+class KalmanFilter:
+    # Kalman filter per tag and axis for a tag that stays put or moves
+    # slowly: the angle is a random walk with process_std degrees per sample,
+    # measured with measurement_std degrees of noise
+    def __init__(self, process_std=0.5, measurement_std=3.0):
+        self.process_variance = float(process_std) ** 2
+        self.measurement_variance = float(measurement_std) ** 2
+        self.state = {}
+
+    def reset(self):
+        self.state = {}
+
+    def apply(self, key, azimuth, elevation):
+        state = self.state.get(key)
+        if state is None:
+            # Angles and their variance, both axes have the same variance
+            state = self.state[key] = [azimuth, elevation, self.measurement_variance]
+            return (azimuth, elevation)
+        variance = state[2] + self.process_variance
+        gain = variance / (variance + self.measurement_variance)
+        state[0] = state[0] + gain * (azimuth - state[0])
+        state[1] = state[1] + gain * (elevation - state[1])
+        state[2] = (1 - gain) * variance
+        return (state[0], state[1])
+
+
+# Filters by name, with the defaults of their arguments in order
+FILTERS = {
+    "median": MedianFilter,
+    "hampel": HampelFilter,
+    "ema": EmaFilter,
+    "kalman": KalmanFilter,
+}
+
+
+class FilterChain:
+    # Runs the angles of every sample through filters in order, per tag. The
+    # filtered angles replace azimuth/elevation, the ones the module gave are
+    # kept in raw_azimuth/raw_elevation and rejected says if a filter threw
+    # the sample out. Filters keep their state per anchor and tag.
+    def __init__(self, filters, spec=""):
+        self.filters = filters
+        self.spec = spec
+
+    @staticmethod
+    def from_spec(spec):
+        # spec is a comma separated list of filters with their arguments
+        # separated by colons, like "hampel:7:3,median:5,ema:0.3"
+        filters = []
+        for item in spec.split(","):
+            name, *arguments = item.strip().split(":")
+            if name not in FILTERS:
+                raise ValueError(
+                    "Unknown filter {}, one of {}".format(name, ", ".join(FILTERS))
+                )
+            filters.append(FILTERS[name](*[float(a) for a in arguments]))
+        return FilterChain(filters, spec)
+
+    def reset(self):
+        # Forgets the history of every tag, for example when the antenna moved
+        for sample_filter in self.filters:
+            sample_filter.reset()
+
+    def filter(self, key, azimuth, elevation):
+        # Filtered angles of a sample of tag key, None if it was rejected
+        for sample_filter in self.filters:
+            angles = sample_filter.apply(key, azimuth, elevation)
+            if angles is None:
+                return None
+            azimuth, elevation = angles
+        return (azimuth, elevation)
+
+    def apply(self, urc_dict):
+        urc_dict["raw_azimuth"] = urc_dict["azimuth"]
+        urc_dict["raw_elevation"] = urc_dict["elevation"]
+        angles = self.filter(
+            (urc_dict.get("anchor_id"), urc_dict["instanceId"]),
+            urc_dict["azimuth"],
+            urc_dict["elevation"],
+        )
+        urc_dict["rejected"] = angles is None
+        if angles is not None:
+            urc_dict["azimuth"] = int(round(angles[0]))
+            urc_dict["elevation"] = int(round(angles[1]))
+        return urc_dict
+
+
+def filter_table(samples, chain):
+    # Copy of a sample table with the angles run through chain in sample
+    # order, starting over at every position like collect_angles does. The
+    # filters keep their state per anchor and tag like FilterChain.apply.
+    # Rejected samples keep their raw angles.
+    azimuth = samples["azimuth"].tolist()
+    elevation = samples["elevation"].tolist()
+    keys = list(zip(samples["anchor"].tolist(), samples["tag"].tolist()))
+    positions = samples["position"].tolist()
+    rejected = np.zeros(len(samples), dtype=np.bool_)
+    filtered_azimuth = list(azimuth)
+    filtered_elevation = list(elevation)
+    position = None
+    for row in range(len(samples)):
+        if positions[row] != position:
+            chain.reset()
+            position = positions[row]
+        angles = chain.filter(keys[row], azimuth[row], elevation[row])
+        if angles is None:
+            rejected[row] = True
+        else:
+            filtered_azimuth[row] = round(angles[0])
+            filtered_elevation[row] = round(angles[1])
+    columns = dict(samples.columns)
+    columns["raw_azimuth"] = samples["azimuth"]
+    columns["raw_elevation"] = samples["elevation"]
+    columns["azimuth"] = np.array(filtered_azimuth, dtype=samples["azimuth"].dtype)
+    columns["elevation"] = np.array(
+        filtered_elevation, dtype=samples["elevation"].dtype
+    )
+    columns["rejected"] = rejected
+    return SampleTable(
+        samples.positions, samples.tag_ids, columns, samples.iqs, samples.anchor_ids
+    )
@@ -0,0 +1,188 @@
+import numpy as np
+from ring_buffer import KeyedRingBuffers
+from sample_table import group_indices
+
+# Updates per anchor the clock fit is made from
+DEFAULT_CLOCK_HISTORY = 2000
+# A rate is only fitted over at least this many seconds of anchor time,
+# shorter spans assume the anchor clock runs at host speed.
+MIN_DRIFT_SPAN = 10.0
+# An anchor clock going back more than this many seconds restarted, less is
+# packets arriving out of order.
+RESTART_JUMP = 1.0
+
+
+class AnchorClocks:
+    # Maps the timestamp_ms of every anchor to host time, by fitting
+    # host_time = offset + rate * anchor_time per anchor over its recent
+    # samples. Host receive time is anchor time plus a network delay that is
+    # never negative, so the offset is put on the lower envelope of the
+    # samples (the fastest packets) rather than through their middle.
+    def __init__(self, history=DEFAULT_CLOCK_HISTORY):
+        self.samples = KeyedRingBuffers(
+            history, {"anchor_time": np.float64, "host_time": np.float64}
+        )
+        self.last_anchor_time = {}
+        # Per row of self.samples: reference anchor time, host time at the
+        # reference and rate
+        self.reference = np.zeros(0)
+        self.offset = np.zeros(0)
+        self.rate = np.zeros(0)
+
+    def update(self, anchor_ids, timestamp_ms, host_time):
+        anchor_time = np.asarray(timestamp_ms, dtype=np.float64) / 1000
+        host_time = np.asarray(host_time, dtype=np.float64)
+        if len(anchor_time) == 0:
+            return
+        # Only the fastest packet of every anchor in a batch is kept, it is
+        # the one closest to the lower envelope. That way the history covers
+        # minutes, which is what the drift fit needs.
+        delay = host_time - anchor_time
+        keys, groups = group_indices(np.asarray(anchor_ids))
+        fastest = []
+        for (anchor_id,), indexes in zip(keys, groups):
+            last = self.last_anchor_time.get(anchor_id, -np.inf)
+            # An anchor clock going back means it restarted, its old samples
+            # do not fit the new clock
+            if np.min(anchor_time[indexes]) < last - RESTART_JUMP:
+                self.samples.clear(anchor_id)
+                last = -np.inf
+            self.last_anchor_time[anchor_id] = max(last, np.max(anchor_time[indexes]))
+            fastest.append(indexes[np.argmin(delay[indexes])])
+        self.samples.extend(
+            [anchor_ids[i] for i in fastest],
+            {"anchor_time": anchor_time[fastest], "host_time": host_time[fastest]},
+        )
+        self.fit()
+
+    def fit(self):
+        # Least squares rate and lower envelope offset of every anchor at once
+        lengths = self.samples.lengths()
+        valid = np.arange(self.samples.capacity) < lengths[:, None]
+        anchor_time = self.samples.data["anchor_time"][: len(lengths)]
+        host_time = self.samples.data["host_time"][: len(lengths)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reference = np.where(valid, anchor_time, 0).sum(axis=1) / lengths
+            host_mean = np.where(valid, host_time, 0).sum(axis=1) / lengths
+            x = np.where(valid, anchor_time - reference[:, None], 0)
+            y = np.where(valid, host_time - host_mean[:, None], 0)
+            rate = (x * y).sum(axis=1) / (x * x).sum(axis=1)
+        span = np.where(valid, anchor_time, -np.inf).max(axis=1) - np.where(
+            valid, anchor_time, np.inf
+        ).min(axis=1)
+        rate = np.where(span >= MIN_DRIFT_SPAN, rate, 1.0)
+        residual = np.where(valid, y - rate[:, None] * x, np.inf)
+        self.reference = reference
+        self.offset = host_mean + residual.min(axis=1)
+        self.rate = rate
+
+    def to_host_time(self, anchor_ids, timestamp_ms):
+        # Host time of anchor timestamps, nan for anchors never seen
+        rows = np.fromiter(
+            (self.samples.index.get(anchor_id, -1) for anchor_id in anchor_ids),
+            np.int64,
+            len(anchor_ids),
+        )
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+        anchor_time = np.asarray(timestamp_ms, dtype=np.float64) / 1000
+        if len(self.rate) == 0:
+            return np.full(len(rows), np.nan)
+        host_time = self.offset[rows] + self.rate[rows] * (
+            anchor_time - self.reference[rows]
+        )
+        return np.where(known, host_time, np.nan)
+
+    def get_clock(self, anchor_id):
+        # Host time of anchor time 0 and how many ppm the anchor clock runs
+        # faster than the host clock
+        row = self.samples.index[anchor_id]
+        offset = self.offset[row] - self.rate[row] * self.reference[row]
+        return offset, (1 / self.rate[row] - 1) * 1e6
+
+
+def window_indices(times, window, origin=0.0):
+    # Index of the window of length window every time falls in, counted from
+    # origin. times must be sorted, the window edges are looked up with one
+    # searchsorted instead of per sample.
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    last = int(np.floor((times[-1] - origin) / window))
+    edges = origin + window * np.arange(last + 2)
+    return np.searchsorted(edges, times, side="right") - 1
+
+
+def bucket_samples(times, tag_ids, window, origin=0.0):
+    # Groups samples from all anchors into (window, tag) buckets. Returns the
+    # window index and tag of every bucket and the sample indexes in it.
+    order = np.argsort(times, kind="stable")
+    windows = np.empty(len(times), dtype=np.int64)
+    windows[order] = window_indices(np.asarray(times)[order], window, origin)
+    tag_names, tags = np.unique(np.asarray(tag_ids), return_inverse=True)
+    keys, groups = group_indices(windows, tags)
+    return keys[:, 0], tag_names[keys[:, 1]], groups
+
+
+class WindowFuser:
+    # Aligns streamed samples from all anchors to host time and hands them out
+    # per time window, once the window is latency seconds in the past so that
+    # slower anchors have delivered their samples too.
+    def __init__(self, window=0.5, latency=0.3, clocks=None):
+        self.window = window
+        self.latency = latency
+        self.clocks = AnchorClocks() if clocks is None else clocks
+        self.pending = {}
+        self.pending_times = np.zeros(0)
+        # Start of the first window not handed out yet
+        self.next_window = None
+        self.late_samples = 0
+
+    def add(self, batch):
+        # batch holds columns like the ones of UDPReceiver.read_batch, with at
+        # least anchor_id, timestamp_ms and host_time
+        if len(batch["anchor_id"]) == 0:
+            return
+        self.clocks.update(
+            batch["anchor_id"], batch["timestamp_ms"], batch["host_time"]
+        )
+        times = self.clocks.to_host_time(batch["anchor_id"], batch["timestamp_ms"])
+        if self.next_window is None:
+            self.next_window = np.floor(np.min(times) / self.window) * self.window
+        late = times < self.next_window
+        self.late_samples = self.late_samples + int(np.sum(late))
+        for name, values in batch.items():
+            values = np.asarray(values)[~late]
+            if name in self.pending:
+                values = np.concatenate((self.pending[name], values))
+            self.pending[name] = values
+        self.pending_times = np.concatenate((self.pending_times, times[~late]))
+
+    def pop_windows(self, now):
+        # Returns a list of (window start, columns) for every window that ended
+        # at least latency seconds before host time now, in time order.
+        if self.next_window is None:
+            return []
+        ready_until = np.floor((now - self.latency) / self.window) * self.window
+        if ready_until <= self.next_window:
+            return []
+        order = np.argsort(self.pending_times, kind="stable")
+        times = self.pending_times[order]
+        num_ready = np.searchsorted(times, ready_until)
+        windows = window_indices(times[:num_ready], self.window, self.next_window)
+        num_windows = int(round((ready_until - self.next_window) / self.window))
+        splits = np.searchsorted(windows, np.arange(1, num_windows))
+
+        result = []
+        ready = order[:num_ready]
+        for i, indexes in enumerate(np.split(ready, splits)):
+            result.append(
+                (
+                    self.next_window + i * self.window,
+                    {name: values[indexes] for name, values in self.pending.items()},
+                )
+            )
+        rest = order[num_ready:]
+        self.pending = {name: values[rest] for name, values in self.pending.items()}
+        self.pending_times = self.pending_times[rest]
+        self.next_window = ready_until
+        return result
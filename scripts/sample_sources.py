@@ -0,0 +1,474 @@
+import argparse
+import base64
+import collections
+import socket
+import time
+import numpy as np
+from serial_helpers import (
+    open_port,
+    close_port,
+    send_command_and_wait_rsp,
+    read_line,
+    flush_input_buffer,
+)
+
+# Channels of the periodic advertising the tags send on
+SECONDARY_CHANNELS = 37
+NOISE_MODELS = ["gaussian", "laplace", "outliers"]
+# Noise floor in dBm of simulated IQs, their SNR is how far the RSSI is above
+IQ_NOISE_FLOOR = -90
+
+
+class SampleSource:
+    # Where AoAController reads its lines from. read_line returns one line,
+    # or "" if there was nothing to read for a while.
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def send_command(self, command):
+        # Sources other than the module itself accept every command
+        return 0
+
+    def set_ground_truth(self, azimuth, elevation):
+        # Angles the module currently sees the tags at, only used by sources
+        # that make up samples
+        pass
+
+    def read_line(self):
+        return ""
+
+
+class SerialSource(SampleSource):
+    # u-connectLocate module on a serial port
+    def __init__(self, port, baudrate, ctsrts):
+        self.port = port
+        self.baudrate = baudrate
+        self.ctsrts = ctsrts
+        self.ser = None
+
+    def start(self):
+        self.ser = open_port(self.port, self.baudrate, self.ctsrts)
+
+    def stop(self):
+        close_port(self.ser)
+
+    def flush(self):
+        flush_input_buffer(self.ser)
+
+    def send_command(self, command):
+        return send_command_and_wait_rsp(self.ser, command)
+
+    def read_line(self):
+        return read_line(self.ser)
+
+
+class UDPSource(SampleSource):
+    # +UUDF URCs forwarded by anchors over UDP
+    def __init__(self, endpoints, timeout=0.1):
+        from udp_receiver import UDPReceiver
+
+        self.receiver = UDPReceiver(endpoints)
+        self.timeout = timeout
+        self.lines = collections.deque()
+
+    def start(self):
+        self.receiver.start()
+
+    def stop(self):
+        self.receiver.stop()
+
+    def flush(self):
+        self.receiver.read_batch()
+        self.lines.clear()
+
+    def read_line(self):
+        deadline = time.time() + self.timeout
+        while len(self.lines) == 0:
+            self.lines.extend(self.receiver.read_batch()["urc"])
+            if len(self.lines) > 0 or time.time() > deadline:
+                break
+            time.sleep(0.001)
+        if len(self.lines) == 0:
+            return ""
+        return self.lines.popleft()
+
+
+class FileReplaySource(SampleSource):
+    # Replays log files with the timing they were recorded with, taken from
+    # the timestamp_ms of the URCs. speed 1 replays in real time, N N times
+    # faster and 0 as fast as the lines are read. Several files, like the
+    # logs of several anchors, are replayed side by side, each from its own
+    # first timestamp. The order of the lines only depends on the files, so
+    # every replay of the same files is the same.
+    def __init__(self, log_files, speed=1.0, loop=False):
+        self.speed = speed
+        self.loop = loop
+        self.lines = []
+        times = []
+        for log_file in log_files:
+            with open(log_file) as fp:
+                lines = [line.strip() for line in fp if line.strip()]
+            self.lines.extend(lines)
+            times.append(replay_times(lines))
+        self.times = np.concatenate(times) if len(times) > 0 else np.zeros(0)
+        order = np.argsort(self.times, kind="stable")
+        self.lines = [self.lines[i] for i in order]
+        self.times = self.times[order]
+        self.next_line = 0
+        self.start_time = None
+
+    def duration(self):
+        # Seconds the replay takes at speed 1
+        return self.times[-1] if len(self.times) > 0 else 0.0
+
+    def finished(self):
+        return self.next_line == len(self.lines) and not self.loop
+
+    def start(self):
+        # The replay clock starts with the first line read
+        self.next_line = 0
+        self.start_time = None
+
+    def read_line(self):
+        if self.next_line == len(self.lines):
+            if not self.loop or len(self.lines) == 0:
+                return ""
+            self.next_line = 0
+            self.start_time = time.time()
+        if self.speed > 0:
+            if self.start_time is None:
+                self.start_time = time.time()
+            due = self.start_time + self.times[self.next_line] / self.speed
+            now = time.time()
+            if due > now:
+                # Do not sleep longer than a caller waiting for a line would
+                if due - now > 0.1:
+                    time.sleep(0.1)
+                    return ""
+                time.sleep(due - now)
+        line = self.lines[self.next_line]
+        self.next_line = self.next_line + 1
+        return line
+
+
+def replay_times(lines):
+    # Seconds from the first line at which every line of one log was
+    # received, from the timestamp_ms of the +UUDF URCs. Lines without one
+    # share the time of the line before. Time never goes back, a clock
+    # restart or reordered packets replay without a pause.
+    timestamps = np.full(len(lines), np.nan)
+    for i, line in enumerate(lines):
+        if line[:6].upper() != "+UUDF:":
+            continue
+        params = line[6:].split(",")
+        if len(params) >= 9:
+            try:
+                timestamps[i] = int(params[8])
+            except ValueError:
+                pass
+    valid = np.flatnonzero(~np.isnan(timestamps))
+    if len(valid) == 0:
+        return np.zeros(len(lines))
+    # Forward fill, lines before the first timestamp get the first one
+    filled = np.maximum.accumulate(
+        np.where(np.isnan(timestamps), -1, np.arange(len(lines)))
+    )
+    timestamps = timestamps[np.where(filled < 0, valid[0], filled)]
+    steps = np.maximum(np.diff(timestamps, prepend=timestamps[0]), 0)
+    return np.cumsum(steps) / 1000
+
+
+class SimulatorSource(SampleSource):
+    # Makes up +UUDF URCs from num_anchors anchors seeing num_tags tags, at
+    # rate samples per second (0 for as fast as they are read).
+    # Every (anchor, tag) pair has its own angle, distance and TX power. RSSI
+    # follows from the distance with fading per sample and an offset per
+    # channel, and the angle noise grows when the RSSI drops. Tags hop over
+    # the secondary advertising channels.
+    # Given an ArrayGeometry as iq_array, lines are in the raw IQ debug format
+    # instead, with the IQs the array would sample from the true angle.
+    def __init__(
+        self,
+        num_tags=1,
+        num_anchors=1,
+        rate=1000,
+        noise_model="gaussian",
+        noise_std=3.0,
+        seed=0,
+        iq_array=None,
+    ):
+        if noise_model not in NOISE_MODELS:
+            raise ValueError("Unknown noise model {}".format(noise_model))
+        self.rng = np.random.default_rng(seed)
+        self.num_tags = num_tags
+        self.num_anchors = num_anchors
+        self.rate = rate
+        self.noise_model = noise_model
+        self.noise_std = noise_std
+        self.iq_array = iq_array
+        self.tag_ids = ["CCF9578E{:04X}".format(tag) for tag in range(num_tags)]
+        self.anchor_ids = ["CD84C98B{:04X}".format(a) for a in range(num_anchors)]
+
+        pairs = (num_anchors, num_tags)
+        self.azimuth = self.rng.uniform(-60, 60, pairs)
+        self.elevation = self.rng.uniform(-60, 60, pairs)
+        distance = self.rng.uniform(1, 10, pairs)
+        tx_power = self.rng.choice([-4, 0, 4], num_tags)
+        self.rssi = -45 + tx_power - 20 * np.log10(distance)
+        self.channel_offset = self.rng.normal(0, 2, (num_anchors, SECONDARY_CHANNELS))
+        self.hop = self.rng.integers(5, 17, num_tags)
+        self.clock_offset = self.rng.integers(0, 10**6, num_anchors)
+
+        self.events = 0
+        self.start_time = None
+        self.lines = collections.deque()
+
+    def set_ground_truth(self, azimuth, elevation):
+        self.azimuth[:] = azimuth
+        self.elevation[:] = elevation
+
+    def start(self):
+        self.start_time = time.time()
+
+    def flush(self):
+        self.lines.clear()
+
+    def angle_noise(self, std):
+        if self.noise_model == "laplace":
+            return self.rng.laplace(0, std / np.sqrt(2))
+        noise = self.rng.normal(0, std)
+        if self.noise_model == "outliers":
+            # Reflections, a few samples end up anywhere
+            outliers = self.rng.random(std.shape) < 0.05
+            noise[outliers] = self.rng.uniform(-90, 90, np.sum(outliers))
+        return noise
+
+    def generate(self, num_events):
+        # num_events advertising events, every anchor gets a sample of every
+        # tag in every event
+        events = self.events + np.arange(num_events)
+        self.events = self.events + num_events
+        shape = (num_events, self.num_anchors, self.num_tags)
+        anchors = np.broadcast_to(np.arange(self.num_anchors)[:, None], shape[1:])
+        anchors = np.broadcast_to(anchors, shape)
+        tags = np.broadcast_to(np.arange(self.num_tags), shape)
+        channels = (events[:, None, None] * self.hop + tags * 7) % SECONDARY_CHANNELS
+
+        rssi = (
+            self.rssi[anchors, tags]
+            + self.channel_offset[anchors, channels]
+            + self.rng.normal(0, 2.5, shape)
+        )
+        std = self.noise_std * (1 + np.maximum(0, -70 - rssi) / 10)
+        azimuth = self.azimuth[anchors, tags] + self.angle_noise(std)
+        elevation = self.elevation[anchors, tags] + self.angle_noise(std)
+        rssi2 = rssi + self.rng.normal(0, 3, shape)
+        event_ms = events * 1000 / max(self.rate, 1) * self.num_anchors * self.num_tags
+        timestamps = event_ms[:, None, None] + self.clock_offset[anchors]
+
+        if self.iq_array is not None:
+            return self.debug_lines(
+                tags, rssi, azimuth, elevation, channels, anchors, timestamps
+            )
+        rows = zip(
+            tags.ravel().tolist(),
+            np.round(rssi).astype(int).ravel().tolist(),
+            np.clip(np.round(azimuth), -90, 90).astype(int).ravel().tolist(),
+            np.clip(np.round(elevation), -90, 90).astype(int).ravel().tolist(),
+            np.round(rssi2).astype(int).ravel().tolist(),
+            channels.ravel().tolist(),
+            anchors.ravel().tolist(),
+            timestamps.astype(np.int64).ravel().tolist(),
+            np.broadcast_to(events[:, None, None], shape).ravel().tolist(),
+        )
+        return [
+            '+UUDF:{},{},{},{},{},{},"{}","",{},{}'.format(
+                self.tag_ids[tag],
+                rssi,
+                azimuth,
+                elevation,
+                rssi2,
+                channel,
+                self.anchor_ids[anchor],
+                timestamp,
+                event,
+            )
+            for tag, rssi, azimuth, elevation, rssi2, channel, anchor, timestamp, event in rows
+        ]
+
+    def debug_lines(self, tags, rssi, azimuth, elevation, channels, anchors, ms):
+        iqs = self.iq_array.synthesize_iqs(
+            self.azimuth[anchors, tags].ravel(),
+            self.elevation[anchors, tags].ravel(),
+            channels.ravel(),
+            rssi.ravel() - IQ_NOISE_FLOOR,
+            self.rng,
+        )
+        iq_bytes = iqs.view(np.float32).astype(np.int8)
+        rows = zip(
+            tags.ravel().tolist(),
+            np.round(rssi).astype(int).ravel().tolist(),
+            np.clip(np.round(azimuth), -90, 90).astype(int).ravel().tolist(),
+            np.clip(np.round(elevation), -90, 90).astype(int).ravel().tolist(),
+            channels.ravel().tolist(),
+            anchors.ravel().tolist(),
+            ms.astype(np.int64).ravel().tolist(),
+            iq_bytes,
+        )
+        return [
+            '{{"id":"{}","rssi":{},"est":[{},{}],"est_raw":[{},{}],"ch":{},'
+            '"a_id":"{}","ms":{},"iq_b64":"{}"}}'.format(
+                self.tag_ids[tag],
+                rssi,
+                azimuth,
+                elevation,
+                azimuth,
+                elevation,
+                channel,
+                self.anchor_ids[anchor],
+                timestamp,
+                base64.b64encode(iq.tobytes()).decode(),
+            )
+            for tag, rssi, azimuth, elevation, channel, anchor, timestamp, iq in rows
+        ]
+
+    def read_line(self):
+        if len(self.lines) == 0:
+            samples_per_event = self.num_anchors * self.num_tags
+            if self.rate > 0:
+                # Make up samples in 10 ms steps and wait until they are due
+                if self.start_time is None:
+                    self.start_time = time.time()
+                num_events = max(1, int(self.rate / 100 / samples_per_event))
+                due = self.start_time + self.events * samples_per_event / self.rate
+                if due > time.time():
+                    time.sleep(due - time.time())
+            else:
+                num_events = max(1, 1000 // samples_per_event)
+            self.lines.extend(self.generate(num_events))
+        return self.lines.popleft()
+
+
+def send_lines_udp(source, ip, port, duration=None):
+    # Forwards the lines of a source over UDP, like anchors do
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    source.start()
+    start = time.time()
+    sent = 0
+    try:
+        while duration is None or time.time() - start < duration:
+            line = source.read_line()
+            if len(line) == 0:
+                if isinstance(source, FileReplaySource) and source.finished():
+                    break
+                continue
+            sock.sendto((line + "\r\n").encode(), (ip, port))
+            sent = sent + 1
+    except KeyboardInterrupt:
+        pass
+    source.stop()
+    sock.close()
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sends simulated or logged angles over UDP, for example to udp_plotter.py"
+    )
+    parser.add_argument("--ip", dest="ip", default="127.0.0.1", required=False)
+    parser.add_argument("--port", dest="port", default=54444, type=int, required=False)
+    parser.add_argument(
+        "--logs",
+        dest="logs",
+        nargs="+",
+        default=None,
+        required=False,
+        help="Log files to send, if not given angles are simulated.",
+    )
+    parser.add_argument(
+        "--speed",
+        dest="speed",
+        default=1.0,
+        type=float,
+        required=False,
+        help="Replay speed of --logs, 1 is as recorded and 0 as fast as possible.",
+    )
+    parser.add_argument("--tags", dest="tags", default=5, type=int, required=False)
+    parser.add_argument(
+        "--anchors", dest="anchors", default=4, type=int, required=False
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        default=1000,
+        type=int,
+        required=False,
+        help="Simulated samples per second from all anchors, 0 for as fast as possible.",
+    )
+    parser.add_argument(
+        "--noise_model",
+        dest="noise_model",
+        default="gaussian",
+        choices=NOISE_MODELS,
+        required=False,
+    )
+    parser.add_argument(
+        "--noise_std",
+        dest="noise_std",
+        default=3.0,
+        type=float,
+        required=False,
+        help="Angle noise in degrees at good RSSI.",
+    )
+    parser.add_argument(
+        "--duration",
+        dest="duration",
+        default=None,
+        type=float,
+        required=False,
+        help="Stop after this many seconds, default runs until Ctrl+C.",
+    )
+    parser.add_argument(
+        "--iqs",
+        dest="iqs",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Simulate raw IQ debug lines instead of +UUDF URCs.",
+    )
+    parser.add_argument(
+        "--array",
+        dest="array",
+        default=None,
+        required=False,
+        help="Json file with the antenna array the IQs are simulated for, default a 4x4 array.",
+    )
+    args = parser.parse_args()
+
+    if args.logs is not None:
+        source = FileReplaySource(args.logs, args.speed)
+    else:
+        iq_array = None
+        if args.iqs:
+            from aoa_estimator import ArrayGeometry
+
+            if args.array is None:
+                iq_array = ArrayGeometry.rectangular()
+            else:
+                iq_array = ArrayGeometry.load(args.array)
+        source = SimulatorSource(
+            args.tags,
+            args.anchors,
+            args.rate,
+            args.noise_model,
+            args.noise_std,
+            iq_array=iq_array,
+        )
+    sent = send_lines_udp(source, args.ip, args.port, args.duration)
+    print("Sent {} lines".format(sent))
@@ -0,0 +1,174 @@
+import numpy as np
+from aoa_controller import IQ_SAMPLES
+
+# Per sample columns, stored as one numpy array each
+COLUMNS = {
+    "position": np.int32,
+    "tag": np.int32,
+    "anchor": np.int16,
+    "rssi": np.int16,
+    "azimuth": np.int16,
+    "elevation": np.int16,
+    "rssi2": np.int16,
+    "channel": np.int8,
+    "timestamp_ms": np.int64,
+}
+# Columns only there when the samples went through a FilterChain: the angles
+# before filtering and if a filter rejected the sample
+FILTER_COLUMNS = {
+    "raw_azimuth": np.int16,
+    "raw_elevation": np.int16,
+    "rejected": np.bool_,
+}
+# Columns only there when a calibration corrected the angles: the angles the
+# module measured, before filtering
+CALIBRATION_COLUMNS = {
+    "uncalibrated_azimuth": np.int16,
+    "uncalibrated_elevation": np.int16,
+}
+
+
+def group_starts(*keys):
+    # Groups samples on one or more key columns (first one is the primary key)
+    # with one lexsort. Returns the unique key combinations, one row per group,
+    # the order that sorts the samples on the keys and where every group starts
+    # in that order, for np.add.reduceat and friends. Samples keep their
+    # original order within a group.
+    if len(keys[0]) == 0:
+        return (
+            np.empty((0, len(keys)), dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+        )
+    order = np.lexsort(keys[::-1])
+    sorted_keys = np.stack([np.asarray(key)[order] for key in keys])
+    changed = np.any(sorted_keys[:, 1:] != sorted_keys[:, :-1], axis=0)
+    starts = np.flatnonzero(np.r_[True, changed])
+    return sorted_keys[:, starts].T, order, starts
+
+
+def group_indices(*keys):
+    # Like group_starts, with the sample indexes of every group instead
+    if len(keys[0]) == 0:
+        return np.empty((0, len(keys)), dtype=np.int64), []
+    unique_keys, order, starts = group_starts(*keys)
+    return unique_keys, np.split(order, starts[1:])
+
+
+class SampleTable:
+    def __init__(self, positions, tag_ids, columns, iqs=None, anchor_ids=None):
+        # positions is a list of ground truth (azimuth, elevation) tuples,
+        # tag_ids a list of tag instance ids and anchor_ids a list of anchor
+        # ids, the "position", "tag" and "anchor" columns are indexes into
+        # those.
+        self.positions = positions
+        self.tag_ids = tag_ids
+        self.anchor_ids = [] if anchor_ids is None else anchor_ids
+        self.columns = columns
+        # IQ samples of every sample as a (len, IQ_SAMPLES) complex64 array,
+        # NaN for samples without them. None if no sample has IQs, they are
+        # only logged in the raw IQ debug mode.
+        self.iqs = iqs
+
+    @staticmethod
+    def from_collected_data(collected_data):
+        positions = []
+        tag_ids = []
+        tag_index = {}
+        anchor_ids = []
+        anchor_index = {}
+        values = {name: [] for name in COLUMNS}
+        filter_values = {name: [] for name in FILTER_COLUMNS}
+        filtered = True
+        iq_rows = []
+        iq_values = []
+        # gt_key is a tuple (azimuth_gt, elevation_gt)
+        for gt_key, logs_from_location in collected_data.items():
+            position = len(positions)
+            positions.append(gt_key)
+            for tag_id, urcs in logs_from_location[1].items():
+                if tag_id not in tag_index:
+                    tag_index[tag_id] = len(tag_ids)
+                    tag_ids.append(tag_id)
+                values["position"].extend([position] * len(urcs))
+                values["tag"].extend([tag_index[tag_id]] * len(urcs))
+                for urc in urcs:
+                    anchor_id = urc.get("anchor_id", "")
+                    if anchor_id not in anchor_index:
+                        anchor_index[anchor_id] = len(anchor_ids)
+                        anchor_ids.append(anchor_id)
+                    values["anchor"].append(anchor_index[anchor_id])
+                for name in COLUMNS:
+                    if name in ("position", "tag", "anchor"):
+                        continue
+                    values[name].extend([urc[name] for urc in urcs])
+                if filtered and all("rejected" in urc for urc in urcs):
+                    for name in FILTER_COLUMNS:
+                        filter_values[name].extend([urc[name] for urc in urcs])
+                else:
+                    filtered = False
+                first_row = len(values["position"]) - len(urcs)
+                for row, urc in enumerate(urcs, first_row):
+                    if urc.get("iqs") is not None:
+                        iq_rows.append(row)
+                        iq_values.append(urc["iqs"])
+        columns = {
+            name: np.array(values[name], dtype=dtype) for name, dtype in COLUMNS.items()
+        }
+        if filtered and len(columns["position"]) > 0:
+            for name, dtype in FILTER_COLUMNS.items():
+                columns[name] = np.array(filter_values[name], dtype=dtype)
+        iqs = None
+        if len(iq_rows) > 0:
+            iqs = np.full(
+                (len(columns["position"]), IQ_SAMPLES), np.nan, dtype=np.complex64
+            )
+            iqs[iq_rows] = iq_values
+        return SampleTable(positions, tag_ids, columns, iqs, anchor_ids)
+
+    def __len__(self):
+        return len(self.columns["position"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def select(self, rows):
+        # Copy with only the samples in rows, indexes or a boolean mask
+        columns = {name: column[rows] for name, column in self.columns.items()}
+        iqs = None if self.iqs is None else self.iqs[rows]
+        return SampleTable(self.positions, self.tag_ids, columns, iqs, self.anchor_ids)
+
+    def gt_azimuth(self):
+        return np.array([p[0] for p in self.positions], dtype=np.int16)[
+            self.columns["position"]
+        ]
+
+    def gt_elevation(self):
+        return np.array([p[1] for p in self.positions], dtype=np.int16)[
+            self.columns["position"]
+        ]
+
+    def save(self, file):
+        arrays = dict(self.columns)
+        if self.iqs is not None:
+            arrays["iqs"] = self.iqs
+        np.savez_compressed(
+            file,
+            positions=np.array(self.positions, dtype=np.int16).reshape(-1, 2),
+            tag_ids=np.array(self.tag_ids, dtype=str),
+            anchor_ids=np.array(self.anchor_ids, dtype=str),
+            **arrays
+        )
+
+    @staticmethod
+    def load(file):
+        with np.load(file) as data:
+            positions = [tuple(int(v) for v in p) for p in data["positions"]]
+            tag_ids = [str(tag_id) for tag_id in data["tag_ids"]]
+            anchor_ids = [str(anchor_id) for anchor_id in data["anchor_ids"]]
+            columns = {name: data[name] for name in COLUMNS}
+            for name in list(FILTER_COLUMNS) + list(CALIBRATION_COLUMNS):
+                if name in data.files:
+                    columns[name] = data[name]
+            iqs = data["iqs"] if "iqs" in data.files else None
+        return SampleTable(positions, tag_ids, columns, iqs, anchor_ids)
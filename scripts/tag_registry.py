@@ -0,0 +1,101 @@
+import json, os, threading
+
+# Tag and anchor metadata loaded by default when it exists
+REGISTRY_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tags.json")
+# Metadata every tag or anchor may have in the config file: a friendly name,
+# the expected position in meters in the frame of the anchor poses and the TX
+# power in dBm
+METADATA = ["name", "position", "tx_power"]
+
+
+class IdTable:
+    # Interns ids: every id seen gets one shared string object and a small
+    # integer, in order of first appearance. Samples keep the shared string
+    # instead of a new one per line, and its hash is computed once for every
+    # dict it is a key of.
+    def __init__(self):
+        self.ids = []
+        self.indexes = {}
+        # Every id to its shared string, so interning a known id is one lookup
+        self.strings = {}
+        self.metadata = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, id):
+        # Integer of id, interned on first sight. Parsers run on several
+        # threads, only adding a new id takes the lock.
+        index = self.indexes.get(id)
+        if index is None:
+            with self.lock:
+                index = self.indexes.get(id)
+                if index is None:
+                    index = len(self.ids)
+                    self.ids.append(id)
+                    self.indexes[id] = index
+                    self.strings[id] = id
+        return index
+
+    def intern(self, id):
+        # The shared string object of id
+        string = self.strings.get(id)
+        if string is None:
+            string = self.ids[self.index(id)]
+        return string
+
+    def get(self, id, name, default=None):
+        return self.metadata.get(id, {}).get(name, default)
+
+    def label(self, id):
+        # Friendly name and id for plots, the id alone without a name
+        name = self.get(id, "name")
+        if name is None:
+            return id
+        return "{} ({})".format(name, id)
+
+    def short_label(self, id):
+        # Friendly name or id, for where there is little room
+        return self.get(id, "name", id)
+
+
+class Registry:
+    # Ids and metadata of the tags and anchors, shared by the parsers, the
+    # collectors, the live plots and the reports through REGISTRY
+    def __init__(self):
+        self.tags = IdTable()
+        self.anchors = IdTable()
+
+    def load(self, file):
+        # Json file like
+        #   {"tags": {"CCF9578E0001": {"name": "Desk", "position": [1, 2, 0.8],
+        #    "tx_power": 4}}, "anchors": {"CD84C98B0000": {"name": "Rig"}}}
+        # Its ids are interned first, in file order.
+        with open(file) as fp:
+            config = json.load(fp)
+        for section, table in [("tags", self.tags), ("anchors", self.anchors)]:
+            for id, metadata in config.get(section, {}).items():
+                unknown = set(metadata) - set(METADATA)
+                if len(unknown) > 0:
+                    raise ValueError(
+                        "Unknown metadata {} of {} in {}, one of {}".format(
+                            ", ".join(sorted(unknown)), id, file, ", ".join(METADATA)
+                        )
+                    )
+                table.metadata[table.intern(id)] = metadata
+
+
+REGISTRY = Registry()
+
+
+def load_registry(file=REGISTRY_FILE):
+    # Loads file into REGISTRY, the default file only when it exists
+    if file == REGISTRY_FILE and not os.path.exists(file):
+        return
+    REGISTRY.load(file)
+    print(
+        "Loaded {} tags and {} anchors from {}".format(
+            len(REGISTRY.tags.metadata), len(REGISTRY.anchors.metadata), file
+        )
+    )
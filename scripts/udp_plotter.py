@@ -1,101 +1,329 @@
 import tkinter as tk
 import time, sys, argparse
-import socket
+import numpy as np
 from live_plot_anchor import LivePlotAnchor
+from live_heatmap import LiveHeatmap, HEATMAP_METRICS
+from ring_buffer import KeyedRingBuffers
+from position_solver import PositionSolver, AlphaBetaFilter, load_anchor_poses
+from sample_fusion import WindowFuser
 from analyzer import AoATester
+from udp_receiver import UDPReceiver, DEFAULT_RCVBUF_SIZE
+from log_writer import QueuedLogWriters, DEFAULT_MAX_FILE_BYTES
+from sample_sources import FileReplaySource
+from tag_registry import REGISTRY, REGISTRY_FILE, load_registry
+import threading
 import traceback
 import signal
 from datetime import datetime
 import os
 
+# Plot at most this often, packets received in between are plotted together
+FRAME_TIME = 1 / 30
+# The anchor x tag heatmap is redrawn at this interval
+HEATMAP_FRAME_TIME = 0.25
+# Samples kept per (anchor, tag)
+HISTORY_LENGTH = 100
+# Time window in seconds that one tag position is solved from
+POSITION_WINDOW = 0.5
+# Replayed lines are handed to the receiver in chunks of at most this many
+# lines or this many seconds
+REPLAY_CHUNK_LINES = 1000
+REPLAY_CHUNK_TIME = 0.005
+# Replaying waits while this many chunks are not plotted yet
+REPLAY_MAX_PENDING = 16
+
 
 class UDPPlotter:
-    def __init__(self, ip, port, tag_id, max_anchors):
-        localIP = str(ip)
-        localPort = int(port)
-        self.tracked_tag_id = tag_id
-        self.bufferSize = 1024
-        self.UDPServerSocket = socket.socket(
-            family=socket.AF_INET, type=socket.SOCK_DGRAM
+    def __init__(
+        self,
+        endpoints,
+        tag_id,
+        max_anchors,
+        rcvbuf_size=DEFAULT_RCVBUF_SIZE,
+        print_rate=0,
+        log_folder_path=None,
+        max_log_bytes=DEFAULT_MAX_FILE_BYTES,
+        anchor_poses=None,
+        filter_positions=False,
+        replay_source=None,
+    ):
+        # Tag shown in the anchor plots, the first one seen if not given
+        self.tracked_tag = tag_id
+        # URCs are appended to one log file per anchor as they arrive, on a
+        # thread of its own so reception never waits for the disk
+        self.log_writers = None
+        if log_folder_path is not None:
+            self.log_writers = QueuedLogWriters(
+                log_folder_path, max_file_bytes=max_log_bytes
+            )
+        # endpoints is a list of (ip, port) to listen on
+        self.receiver = UDPReceiver(
+            endpoints, rcvbuf_size, print_rate, on_batch=self.log_batch
+        )
+        print("UDP receive buffer is {} bytes".format(self.receiver.rcvbuf_size))
+        # Lines of a FileReplaySource are fed to the receiver as if they
+        # came in over UDP
+        self.replay_source = replay_source
+        self.replay_thread = None
+
+        # Recent samples of every (anchor, tag) pair, so any tag can be shown
+        # without waiting for new data.
+        self.buffers = KeyedRingBuffers(
+            HISTORY_LENGTH,
+            {"azimuth": np.int16, "elevation": np.int16, "rssi": np.int16},
         )
-        self.UDPServerSocket.bind((localIP, localPort))
+        self.anchor_ids = []
+        self.tag_ids = []
+        self.updated_anchors = set()
+        self.heatmap_metrics = list(HEATMAP_METRICS)
+        self.heatmap_metric = self.heatmap_metrics[0]
+
+        # Tag positions are solved from the samples of every POSITION_WINDOW
+        # if the anchor poses are known. Windows are aligned on the anchor
+        # timestamps, not on when the packets happened to arrive.
+        self.solver = None
+        self.position_filter = None
+        self.fuser = WindowFuser(POSITION_WINDOW)
+        self.positions = {}
+        if anchor_poses is not None:
+            self.solver = PositionSolver(anchor_poses)
+            if filter_positions:
+                self.position_filter = AlphaBetaFilter()
+
+        # When the stats, heatmap and positions were last updated
+        self.last_stats = 0
+        self.last_heatmap = 0
+        self.last_position = 0
+
         self.live_plot = LivePlotAnchor(max_anchors, self.on_close_plot)
-        self.raw_result = {}
+        self.heatmap = LiveHeatmap(self.on_close_plot, self.select_tag)
+        for fig in [self.live_plot.fig, self.heatmap.fig]:
+            fig.canvas.mpl_connect("key_press_event", self.on_key_press)
 
         signal.signal(signal.SIGINT, self.exit_handler)
 
-    def get_logged_data(self):
-        return self.raw_result
+    def log_batch(self, batch):
+        if self.log_writers is not None:
+            self.log_writers.write_batch(batch["anchor_id"], batch["urc"])
+
+    def get_stats(self):
+        stats = self.receiver.get_stats()
+        stats["log_drops"] = 0
+        if self.log_writers is not None:
+            stats["log_drops"] = self.log_writers.dropped
+        return stats
 
     def run(self):
-        tracked_tag = None
         self.running = True
+        self.receiver.start()
+        if self.replay_source is not None:
+            self.replay_thread = threading.Thread(target=self.replay)
+            self.replay_thread.daemon = True
+            self.replay_thread.start()
+        self.last_stats = time.time()
+        self.last_position = time.time()
 
+        # Packets are received on the receiver thread, here we only plot what
+        # came in since the last frame. Closing the figure or SIGINT stops the
+        # loop within one frame.
         while self.running:
-            bytesAddressPair = self.UDPServerSocket.recvfrom(self.bufferSize)
-            message = bytesAddressPair[0]
-            address = bytesAddressPair[1]
-            clientMsg = "{}: {}".format(address, message)
-            print(clientMsg)
-            try:
-                urc = message
-                urc = urc.decode("utf-8")
-
-                urc_dict = self.parse_uudf(urc)
-                if urc_dict != None:
-                    tag_id = urc_dict["instanceId"]
-                    anchor_id = urc_dict["anchor_id"]
-
-                    if not anchor_id in self.raw_result:
-                        self.raw_result[anchor_id] = []
-
-                    self.raw_result[anchor_id].append(urc)
-
-                    if tracked_tag == None:
-                        tracked_tag = tag_id
-                        self.live_plot.set_title("Tracked tag: {}".format(tracked_tag))
-
-                    if (
-                        self.tracked_tag_id is not None
-                        and self.tracked_tag_id != tag_id
-                    ):
-                        continue
-
-                    self.live_plot.add_anchor_sample(
-                        anchor_id, urc_dict["azimuth"], urc_dict["elevation"]
-                    )
-            except Exception as e:
-                print(traceback.format_exc())
-                pass
+            frame_start = time.time()
+            self.update_frame(frame_start)
+            self.live_plot.fig.canvas.flush_events()
+            time.sleep(max(0, FRAME_TIME - (time.time() - frame_start)))
+
+    def replay(self):
+        self.replay_source.start()
+        while self.running and not self.replay_source.finished():
+            # Wait for the plot instead of dropping when replaying faster than
+            # it keeps up with, so that replaying as fast as possible shows
+            # the rate the plot sustains
+            while self.running and self.receiver.batches.qsize() >= REPLAY_MAX_PENDING:
+                time.sleep(FRAME_TIME / 4)
+            lines = []
+            deadline = time.time() + REPLAY_CHUNK_TIME
+            while len(lines) < REPLAY_CHUNK_LINES and time.time() < deadline:
+                line = self.replay_source.read_line()
+                if len(line) > 0:
+                    lines.append(line.encode())
+                elif self.replay_source.finished():
+                    break
+            if len(lines) > 0:
+                self.receiver.handle_datagrams(lines, time.time())
+
+    def update_frame(self, frame_start):
+        try:
+            self.add_batch(self.receiver.read_batch())
+            self.draw_tracked_tag()
+            if frame_start - self.last_heatmap > HEATMAP_FRAME_TIME:
+                self.last_heatmap = frame_start
+                self.draw_heatmap()
+            if (
+                self.solver is not None
+                and frame_start - self.last_position > POSITION_WINDOW
+            ):
+                self.last_position = frame_start
+                self.solve_positions(frame_start)
+        except Exception as e:
+            print(traceback.format_exc())
+
+        if frame_start - self.last_stats > 1:
+            self.last_stats = frame_start
+            stats = self.get_stats()
+            self.live_plot.set_status(
+                "Received: {}  Dropped: {}  Parse errors: {}  Not logged: {}\n{}".format(
+                    stats["packets_received"],
+                    stats["packets_dropped"],
+                    stats["parse_errors"],
+                    stats["log_drops"],
+                    self.position_status(),
+                )
+            )
+
+    def close(self):
+        self.receiver.stop()
+        if self.log_writers is not None:
+            self.log_writers.close()
+
+    def add_batch(self, batch):
+        if len(batch["urc"]) == 0:
+            return
+        keys = list(zip(batch["anchor_id"], batch["instanceId"]))
+        num_keys = len(self.buffers)
+        self.buffers.extend(
+            keys,
+            {
+                "azimuth": batch["azimuth"],
+                "elevation": batch["elevation"],
+                "rssi": batch["rssi"],
+            },
+        )
+        if len(self.buffers) != num_keys:
+            self.anchor_ids = sorted(set(key[0] for key in self.buffers.keys))
+            self.tag_ids = sorted(set(key[1] for key in self.buffers.keys))
+
+        if self.solver is not None:
+            self.fuser.add(
+                {
+                    name: batch[name]
+                    for name in [
+                        "anchor_id",
+                        "tag",
+                        "azimuth",
+                        "elevation",
+                        "timestamp_ms",
+                        "host_time",
+                    ]
+                }
+            )
+
+        if self.tracked_tag == None:
+            self.select_tag(batch["instanceId"][0])
+        self.updated_anchors.update(
+            anchor_id for anchor_id, tag_id in set(keys) if tag_id == self.tracked_tag
+        )
+
+    def draw_tracked_tag(self):
+        if len(self.updated_anchors) == 0:
+            return
+        for anchor_id in sorted(self.updated_anchors):
+            key = (anchor_id, self.tracked_tag)
+            if key in self.buffers:
+                self.live_plot.set_anchor_data(
+                    anchor_id,
+                    self.buffers.get(key, "azimuth").tolist(),
+                    self.buffers.get(key, "elevation").tolist(),
+                    self.buffers.total(key),
+                )
+            else:
+                self.live_plot.set_anchor_data(anchor_id, [], [], 0)
+        self.updated_anchors = set()
+        self.live_plot.draw_stats()
+
+    def draw_heatmap(self):
+        if len(self.buffers) == 0:
+            return
+        if self.heatmap_metric == "rssi":
+            values = self.buffers.mean("rssi")
+        else:
+            values = np.hypot(
+                self.buffers.std("azimuth"), self.buffers.std("elevation")
+            )
+        anchor_index = {anchor_id: i for i, anchor_id in enumerate(self.anchor_ids)}
+        tag_index = {tag_id: i for i, tag_id in enumerate(self.tag_ids)}
+        rows = [anchor_index[key[0]] for key in self.buffers.keys]
+        columns = [tag_index[key[1]] for key in self.buffers.keys]
+        grid = np.full((len(self.anchor_ids), len(self.tag_ids)), np.nan)
+        grid[rows, columns] = values
+        self.heatmap.set_data(
+            self.heatmap_metric,
+            self.anchor_ids,
+            self.tag_ids,
+            grid,
+            self.tracked_tag,
+        )
+
+    def solve_positions(self, now):
+        for window_start, window in self.fuser.pop_windows(now):
+            # Tags are fused as their integers in REGISTRY, cheaper to sort
+            # than the id strings
+            solved = self.solver.solve_window(
+                window["anchor_id"],
+                window["tag"],
+                window["azimuth"],
+                window["elevation"],
+            )
+            self.positions = {
+                REGISTRY.tags.ids[tag]: solution for tag, solution in solved.items()
+            }
+            if self.position_filter is None:
+                continue
+            for tag_id, (position, residual, num_anchors) in self.positions.items():
+                position = self.position_filter.update(tag_id, position, window_start)
+                self.positions[tag_id] = (position, residual, num_anchors)
+
+    def position_status(self):
+        if self.solver is None:
+            return ""
+        if self.tracked_tag not in self.positions:
+            return "Position: not enough anchors"
+        position, residual, num_anchors = self.positions[self.tracked_tag]
+        status = "Position: ({:.2f}, {:.2f}, {:.2f}) m  Residual: {:.2f} m  Anchors: {}".format(
+            position[0], position[1], position[2], residual, num_anchors
+        )
+        expected = REGISTRY.tags.get(self.tracked_tag, "position")
+        if expected is not None:
+            status = status + "  Off expected: {:.2f} m".format(
+                np.linalg.norm(np.asarray(position) - expected)
+            )
+        return status
+
+    def select_tag(self, tag_id):
+        self.tracked_tag = tag_id
+        self.live_plot.set_title("Tracked tag: {}".format(REGISTRY.tags.label(tag_id)))
+        # Every anchor plot is redrawn, anchors without data for this tag are
+        # cleared.
+        self.updated_anchors = set(self.anchor_ids) | set(self.live_plot.anchors)
+
+    def on_key_press(self, event):
+        if event.key in ("n", "right", "p", "left") and len(self.tag_ids) > 0:
+            step = 1 if event.key in ("n", "right") else -1
+            index = (
+                self.tag_ids.index(self.tracked_tag)
+                if self.tracked_tag in self.tag_ids
+                else -step
+            )
+            self.select_tag(self.tag_ids[(index + step) % len(self.tag_ids)])
+        elif event.key == "m":
+            index = self.heatmap_metrics.index(self.heatmap_metric)
+            self.heatmap_metric = self.heatmap_metrics[
+                (index + 1) % len(self.heatmap_metrics)
+            ]
+            self.draw_heatmap()
 
     def on_close_plot(self):
         self.running = False
 
-    def parse_uudf(self, urc_str):
-        splitted = urc_str.find(":")
-
-        urc, r = urc_str[:splitted], urc_str[splitted:]
-        if urc.upper() != "+UUDF":
-            return None
-
-        urc_params = r.split(",")
-        instanceId = urc_params[0][1:]
-        if len(instanceId) != 12:
-            return None
-
-        urc_dict = {
-            "instanceId": instanceId,
-            "rssi": int(urc_params[1]),
-            "azimuth": int(urc_params[2]),
-            "elevation": int(urc_params[3]),
-            "rssi2": int(urc_params[4]),
-            "channel": int(urc_params[5]),
-            "anchor_id": urc_params[6].replace('"', ""),
-            "user_defined_str": urc_params[7].replace('"', ""),
-            "timestamp_ms": int(urc_params[8]),
-        }
-        return urc_dict
-
     def exit_handler(self, signum, frame):
         self.running = False
 
@@ -106,23 +334,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--ip",
         dest="ip",
+        nargs="+",
         required=False,
-        default="0.0.0.0",
-        help="The local IP address UDP angles are sent to.",
+        default=["0.0.0.0"],
+        help="The local IP addresses UDP angles are sent to.",
     )
     parser.add_argument(
         "--port",
         dest="port",
+        nargs="+",
+        type=int,
         required=False,
-        default=54444,
-        help="The port UDP angles are sent to.",
+        default=[54444],
+        help="The ports UDP angles are sent to, every port is listened on at every IP.",
     )
     parser.add_argument(
         "--tagId",
         dest="tag_id",
         required=False,
         default=None,
-        help="Only plot angles from this specific tag.",
+        help="Tag to plot first, keys n/p or clicking the heatmap switch to other tags.",
     )
     parser.add_argument(
         "--max_anchors",
@@ -131,34 +362,123 @@ if __name__ == "__main__":
         default=6,
         help="Adjusts the plot size to fit this number of anchors, default 6.",
     )
+    parser.add_argument(
+        "--print_rate",
+        dest="print_rate",
+        required=False,
+        default=0,
+        type=int,
+        help="Print at most this many received URCs per second, default 0 (no printing).",
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        dest="rcvbuf",
+        required=False,
+        default=DEFAULT_RCVBUF_SIZE,
+        type=int,
+        help="Size in bytes of the UDP socket receive buffer, limited by net.core.rmem_max.",
+    )
+    parser.add_argument(
+        "--max_log_size",
+        dest="max_log_size",
+        required=False,
+        default=64,
+        type=int,
+        help="Anchor log files are rotated when they reach this size in MB, default 64.",
+    )
+    parser.add_argument(
+        "--anchor_config",
+        dest="anchor_config",
+        required=False,
+        default=None,
+        help="Json file with the position and orientation of every anchor, enables solving tag positions.",
+    )
+    parser.add_argument(
+        "--filter_positions",
+        dest="filter_positions",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Smooth the solved positions with an alpha-beta filter.",
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay",
+        nargs="+",
+        required=False,
+        default=None,
+        help="Log files to replay instead of only listening on UDP, nothing is logged when replaying.",
+    )
+    parser.add_argument(
+        "--replay_speed",
+        dest="replay_speed",
+        required=False,
+        default=1.0,
+        type=float,
+        help="Replay speed, 1 is as recorded, 0 as fast as the plot keeps up.",
+    )
 
-    args = parser.parse_args()
-
-    print("Setting up UDP server on {0}, {1}".format(args.ip, args.port), args.tag_id)
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        required=False,
+        default=REGISTRY_FILE,
+        help="Json file with the friendly name, expected position and TX power of tags and the name of anchors, default tags.json next to the scripts if it exists.",
+    )
 
-    localIP = str(args.ip)
-    localPort = int(args.port)
+    args = parser.parse_args()
+    load_registry(args.tags)
 
-    def on_close(event):
-        print("Closed Figure!")
+    endpoints = [(ip, port) for ip in args.ip for port in args.port]
+    print("Setting up UDP server on {0}".format(endpoints), args.tag_id)
 
-    plotter = UDPPlotter(localIP, localPort, args.tag_id, int(args.max_anchors))
+    replay_source = None
+    folder_path = None
+    if args.replay is not None:
+        replay_source = FileReplaySource(args.replay, args.replay_speed)
+        print(
+            "Replaying {} lines, {:.1f} s as recorded".format(
+                len(replay_source.lines), replay_source.duration()
+            )
+        )
+    else:
+        date_time = datetime.now().strftime("%d_%m_%Y-%H-%M")
+        folder_name = "log_{}".format(date_time)
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        folder_path = os.path.join(current_dir_path, folder_name)
+        print("Saving logs in", folder_name)
 
-    plotter.run()
+    anchor_poses = None
+    if args.anchor_config is not None:
+        anchor_poses = load_anchor_poses(args.anchor_config)
 
-    print("Exiting, saving logs in".format(folder_name))
-    date_time = datetime.now().strftime("%d_%m_%Y-%H-%M")
-    folder_name = "log_{}".format(date_time)
+    plotter = UDPPlotter(
+        endpoints,
+        args.tag_id,
+        int(args.max_anchors),
+        args.rcvbuf,
+        args.print_rate,
+        folder_path,
+        args.max_log_size * 1024 * 1024,
+        anchor_poses,
+        args.filter_positions,
+        replay_source,
+    )
 
-    # Create a folder
-    current_dir_path = os.path.dirname(os.path.realpath(__file__))
-    folder_path = os.path.join(current_dir_path, folder_name)
-    os.makedirs(folder_path)
+    try:
+        plotter.run()
+    finally:
+        stats = plotter.get_stats()
+        # Also on a crash, so whatever is still buffered ends up in the logs
+        plotter.close()
 
-    for key, log_lines in plotter.get_logged_data().items():
-        with open(
-            os.path.join(folder_path, "{}.log".format(key)), "w+"
-        ) as anchor_log_file:
-            for line in log_lines:
-                anchor_log_file.write(line)
-    print("Done saving logs")
+    print(
+        "Received {} packets, dropped {}, parse errors {}, not logged {}".format(
+            stats["packets_received"],
+            stats["packets_dropped"],
+            stats["parse_errors"],
+            stats["log_drops"],
+        )
+    )
+    if folder_path is not None:
+        print("Done saving logs in", folder_name)
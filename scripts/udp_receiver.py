@@ -0,0 +1,221 @@
+import asyncio
+import os
+import queue
+import socket
+import threading
+import time
+import numpy as np
+from aoa_controller import parse_uudf_batch, UUDF_COLUMNS
+
+# Ask the kernel for a big receive buffer, so bursts from many anchors are
+# queued instead of dropped while the plot is redrawing.
+# Note Linux caps this to net.core.rmem_max.
+DEFAULT_RCVBUF_SIZE = 8 * 1024 * 1024
+# Batches kept waiting for the reader before new ones are dropped
+DEFAULT_MAX_PENDING = 2000
+NUMERIC_COLUMNS = [
+    "rssi",
+    "azimuth",
+    "elevation",
+    "rssi2",
+    "channel",
+    "timestamp_ms",
+    "tag",
+    "anchor",
+]
+
+
+def socket_inode(sock):
+    return str(os.fstat(sock.fileno()).st_ino)
+
+
+def udp_socket_drops(inode):
+    # Datagrams the kernel dropped for the socket with inode, because its
+    # receive buffer was full. Matching the inode leaves out other sockets on
+    # the same port. Only available on Linux and while the socket is open,
+    # otherwise None.
+    for proc_file in ["/proc/net/udp", "/proc/net/udp6"]:
+        try:
+            with open(proc_file) as fp:
+                lines = fp.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if fields[9] == inode:
+                return int(fields[-1])
+    return None
+
+
+def empty_columns():
+    return {name: [] for name in UUDF_COLUMNS + ["urc", "tag", "anchor", "host_time"]}
+
+
+class UUDFProtocol(asyncio.DatagramProtocol):
+    # Hands the datagrams from one endpoint to the receiver in batches.
+    # asyncio reads one datagram per wakeup, so on every wakeup the rest of
+    # what is queued in the socket is drained as well.
+    def __init__(self, receiver, sock):
+        self.receiver = receiver
+        self.sock = sock
+
+    def datagram_received(self, data, addr):
+        datagrams = [data]
+        while True:
+            try:
+                datagrams.append(self.sock.recv(2048))
+            except (BlockingIOError, InterruptedError):
+                break
+        self.receiver.handle_datagrams(datagrams, time.time())
+
+    def error_received(self, exc):
+        print("UDP error: {}".format(exc))
+
+
+class UDPReceiver:
+    # Receives +UUDF URCs on one or more (ip, port) endpoints with asyncio, on a
+    # thread of its own. Parsed batches are put on a queue that the GUI empties
+    # with read_batch, so a slow redraw never stalls the network side.
+    def __init__(
+        self,
+        endpoints,
+        rcvbuf_size=DEFAULT_RCVBUF_SIZE,
+        print_rate=0,
+        max_pending=DEFAULT_MAX_PENDING,
+        on_batch=None,
+    ):
+        self.sockets = []
+        for ip, port in endpoints:
+            sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf_size)
+            sock.bind((str(ip), int(port)))
+            sock.setblocking(False)
+            self.sockets.append(sock)
+        self.ports = [sock.getsockname()[1] for sock in self.sockets]
+        # Kernel drops are looked up by inode, kept so they still work while
+        # the sockets are closed
+        self.inodes = [socket_inode(sock) for sock in self.sockets]
+        self.rcvbuf_size = self.sockets[0].getsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF
+        )
+        # Max number of received URCs printed per second, 0 to not print
+        self.print_rate = print_rate
+        self.batches = queue.Queue(maxsize=max_pending)
+        # Called on the receiver thread with every parsed batch, before it is
+        # queued. Used for things that must see every sample, like logging.
+        self.on_batch = on_batch
+
+        self.packets_received = 0
+        self.parse_errors = 0
+        self.overflow_drops = 0
+        # Kernel drops when the sockets were closed, the kernel forgets them
+        self.drops_at_stop = None
+        self.drops_at_start = self.__kernel_drops() or 0
+
+        self.loop = None
+        self.thread = None
+        self.started = threading.Event()
+        self.printed_this_second = 0
+        self.print_second = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        # Returns as soon as the event loop is stopped, nothing waits for more
+        # packets to arrive.
+        # Closing the transports closes the sockets too, count before
+        if self.drops_at_stop is None:
+            self.drops_at_stop = self.__kernel_drops()
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+        for sock in self.sockets:
+            sock.close()
+
+    def __run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        transports = []
+        for sock in self.sockets:
+            transport, _ = self.loop.run_until_complete(
+                self.loop.create_datagram_endpoint(
+                    lambda: UUDFProtocol(self, sock), sock=sock
+                )
+            )
+            transports.append(transport)
+        self.started.set()
+        self.loop.run_forever()
+        for transport in transports:
+            transport.abort()
+        self.loop.close()
+
+    def handle_datagrams(self, datagrams, host_time):
+        urcs = [datagram.decode("utf-8", "replace") for datagram in datagrams]
+        columns, errors = parse_uudf_batch(urcs)
+        columns["host_time"] = [host_time] * len(columns["urc"])
+        self.print_urcs(columns["urc"], host_time)
+        if self.on_batch is not None:
+            self.on_batch(columns)
+
+        self.packets_received = self.packets_received + len(datagrams)
+        self.parse_errors = self.parse_errors + errors
+        try:
+            self.batches.put_nowait(columns)
+        except queue.Full:
+            # Reader is not keeping up, drop the newest
+            self.overflow_drops = self.overflow_drops + len(columns["urc"])
+
+    def print_urcs(self, urcs, host_time):
+        if self.print_rate <= 0:
+            return
+        second = int(host_time)
+        if second != self.print_second:
+            self.print_second = second
+            self.printed_this_second = 0
+        to_print = urcs[: max(0, self.print_rate - self.printed_this_second)]
+        for urc in to_print:
+            print(urc)
+        self.printed_this_second = self.printed_this_second + len(to_print)
+
+    def read_batch(self):
+        # Returns all samples received since the last call as columns, numeric
+        # columns as numpy arrays.
+        batch = empty_columns()
+        while True:
+            try:
+                columns = self.batches.get_nowait()
+            except queue.Empty:
+                break
+            for name, values in columns.items():
+                batch[name].extend(values)
+        for name in NUMERIC_COLUMNS:
+            batch[name] = np.array(batch[name], dtype=np.int64)
+        batch["host_time"] = np.array(batch["host_time"])
+        return batch
+
+    def __kernel_drops(self):
+        if self.drops_at_stop is not None:
+            return self.drops_at_stop
+        drops = [udp_socket_drops(inode) for inode in self.inodes]
+        if None in drops:
+            return None
+        return sum(drops)
+
+    def packets_dropped(self):
+        # Dropped by the kernel since start plus dropped because the reader
+        # was not keeping up
+        kernel_drops = self.__kernel_drops()
+        if kernel_drops is None:
+            return self.overflow_drops
+        return kernel_drops - self.drops_at_start + self.overflow_drops
+
+    def get_stats(self):
+        return {
+            "packets_received": self.packets_received,
+            "packets_dropped": self.packets_dropped(),
+            "parse_errors": self.parse_errors,
+        }
@@ -9,7 +9,10 @@ import cv2
 
 from antenna_controller import AntennaController
 from analyzer import AoATester
+from sample_sources import SimulatorSource, FileReplaySource
 from webcam_window import WebcamWindow
+from latency import LATENCY
+from tag_registry import REGISTRY_FILE, load_registry
 
 ROTATE_OPTIONS = [1, 2, 5, 10, 20, 40, 45, 90]
 
@@ -238,15 +241,72 @@ if __name__ == "__main__":
         required=False,
         help="For testing without antenna controller and u-connectLocate. Data will be generated.",
     )
+    parser.add_argument(
+        "--mock_tags",
+        dest="mock_tags",
+        default=1,
+        type=int,
+        required=False,
+        help="Number of tags generated with --mock.",
+    )
+    parser.add_argument(
+        "--mock_rate",
+        dest="mock_rate",
+        default=10,
+        type=int,
+        required=False,
+        help="Samples per second generated with --mock.",
+    )
+    parser.add_argument(
+        "--replay",
+        dest="replay",
+        nargs="+",
+        default=None,
+        required=False,
+        help="Log files replayed by the live analysis instead of reading u-connectLocate.",
+    )
+    parser.add_argument(
+        "--replay_speed",
+        dest="replay_speed",
+        default=1.0,
+        type=float,
+        required=False,
+        help="Replay speed, 1 is as recorded and 0 as fast as possible.",
+    )
+    parser.add_argument(
+        "--latency",
+        dest="latency",
+        action="store_true",
+        default=False,
+        required=False,
+        help="Measure the latency of reading, parsing, storing and plotting every sample. Added to the report, kill -USR1 prints it.",
+    )
+    parser.add_argument(
+        "--tags",
+        dest="tags",
+        default=REGISTRY_FILE,
+        required=False,
+        help="Json file with the friendly name, expected position and TX power of tags and the name of anchors, default tags.json next to the scripts if it exists.",
+    )
 
     args = parser.parse_args()
+    load_registry(args.tags)
+
+    if args.latency:
+        LATENCY.enable()
+        LATENCY.install_signal_handler()
     controller = AntennaController(args.port, args.baudrate, args.mock)
     controller.start()
     controller.enable_antenna_control()
     analyzer = None
-    if args.locate_port:
+    if args.locate_port or args.mock or args.replay:
+        source = None
+        if args.replay:
+            source = FileReplaySource(args.replay, args.replay_speed)
+        elif args.mock:
+            source = SimulatorSource(args.mock_tags, 1, args.mock_rate)
         analyzer = AoATester(
-            args.locate_port, args.locate_baudrate, args.ctsrts, False, args.mock
+            args.locate_port, args.locate_baudrate, args.ctsrts, False, source
         )
         analyzer.start()
 